@@ -0,0 +1,105 @@
+'''
+framebuf on CPython, for the host simulation and the golden images of the screens (see virtual_lcd.py): the
+FrameBuffer methods the firmware draws with, in MONO_HLSB only, and text in the 8x8 font of petme128.py.
+Slow, pixel by pixel, and only meant to give the same pixels as MicroPython's framebuf.
+'''
+
+from petme128 import FONT
+
+MONO_VLSB = 0
+MONO_HLSB = 3
+MONO_HMSB = 4
+
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, format, stride=None):
+        if format != MONO_HLSB:
+            raise ValueError('only MONO_HLSB')
+        self.buffer = buffer
+        self.width = width
+        self.height = height
+        self.stride = (stride if stride is not None else width) + 7 & ~7    # Rows start on a byte
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return 0
+        i = (y * self.stride + x) >> 3
+        bit = 0x80 >> (x & 7)
+        if c is None:
+            return 1 if self.buffer[i] & bit else 0
+        if c:
+            self.buffer[i] |= bit
+        else:
+            self.buffer[i] &= ~bit & 0xff
+
+    def fill(self, c):
+        value = 0xff if c else 0
+        for i in range(self.stride * self.height >> 3):
+            self.buffer[i] = value
+
+    def fill_rect(self, x, y, w, h, c):
+        for yy in range(max(y, 0), min(y + h, self.height)):
+            for xx in range(max(x, 0), min(x + w, self.width)):
+                self.pixel(xx, yy, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+            return
+        self.hline(x, y, w, c)
+        self.hline(x, y + h - 1, w, c)
+        self.vline(x, y, h, c)
+        self.vline(x + w - 1, y, h, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def line(self, x1, y1, x2, y2, c):
+        # Bresenham
+        dx = abs(x2 - x1)
+        dy = -abs(y2 - y1)
+        sx = 1 if x1 < x2 else -1
+        sy = 1 if y1 < y2 else -1
+        error = dx + dy
+        while True:
+            self.pixel(x1, y1, c)
+            if x1 == x2 and y1 == y2:
+                return
+            if 2 * error >= dy:
+                error += dy
+                x1 += sx
+            if 2 * error <= dx:
+                error += dx
+                y1 += sy
+
+    def text(self, s, x, y, c=1):
+        for char in s:
+            code = ord(char)
+            if code < 32 or code > 127:
+                code = 127
+            for column in range(8):
+                bits = FONT[(code - 32) * 8 + column]
+                for row in range(8):
+                    if bits >> row & 1:
+                        self.pixel(x + column, y + row, c)
+            x += 8
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        for yy in range(fbuf.height):
+            for xx in range(fbuf.width):
+                c = fbuf.pixel(xx, yy)
+                if c != key:
+                    self.pixel(x + xx, y + yy, c)
+
+    def scroll(self, xstep, ystep):
+        # Shift the contents, the pixels left behind keep their value
+        w = self.width
+        h = self.height
+        old = [[self.pixel(x, y) for x in range(w)] for y in range(h)]
+        for y in range(h):
+            for x in range(w):
+                if 0 <= x - xstep < w and 0 <= y - ystep < h:
+                    self.pixel(x, y, old[y - ystep][x - xstep])
@@ -0,0 +1,13 @@
+'''
+micropython on CPython, for the host simulation: the code emitters leave the functions as they are.
+'''
+
+
+def const(value):
+    return value
+
+def native(function):
+    return function
+
+def viper(function):
+    return function
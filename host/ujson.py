@@ -0,0 +1,5 @@
+'''
+ujson on CPython, for the host simulation: the json module.
+'''
+
+from json import *
@@ -0,0 +1,29 @@
+'''
+uos on CPython, for the host simulation (see simulate() in main.py): the os functions, plus the MicroPython ones the
+firmware uses. CPython has no FAT driver, so mount() only creates the mount point, as a directory of the host, and the
+block device is not used.
+'''
+
+from os import *
+import os
+
+
+def ilistdir(path='.'):
+    # (name, type, inode, size) of every entry, as on MicroPython
+    for entry in os.scandir(path):
+        yield entry.name, 0x4000 if entry.is_dir() else 0x8000, 0, entry.stat().st_size
+
+def mount(vfs, mount_point):
+    os.makedirs(mount_point, exist_ok=True)
+
+def umount(mount_point):
+    pass
+
+
+class VfsFat:
+    def __init__(self, device):
+        self.device = device
+
+    @staticmethod
+    def mkfs(device):
+        pass
@@ -0,0 +1,117 @@
+'''
+MicroPython module to draw numbers with large 16x24 digits on the LCD12864.
+The glyphs are stored as packed MONO_HLSB bitmaps and copied with FrameBuffer.blit. A whole number ('24.5') is
+rendered once into its own framebuffer and kept in a small cache, so redrawing a value already seen is a single blit.
+'''
+
+import framebuf
+from binascii import unhexlify
+
+HEIGHT = 24
+
+# 16x24 glyphs (2 bytes per row), except '.' and ' ' (8x24, 1 byte per row)
+GLYPHS = {
+    '0': unhexlify('00003ffc7ffe7ffe700e700e700e700e700e700e700e700e700e700e700e700e700e700e700e700e7ffe7ffe3ffc0000'),
+    '1': unhexlify('00000000000e000e000e000e000e000e000e000e000e000e000e000e000e000e000e000e000e000e000e000e00000000'),
+    '2': unhexlify('00003ffc3ffe3ffe000e000e000e000e000e000e3ffe3ffe7ffc70007000700070007000700070007ffc7ffc3ffc0000'),
+    '3': unhexlify('00003ffc3ffe3ffe000e000e000e000e000e000e3ffe3ffe3ffe000e000e000e000e000e000e000e3ffe3ffe3ffc0000'),
+    '4': unhexlify('00000000700e700e700e700e700e700e700e700e7ffe7ffe3ffe000e000e000e000e000e000e000e000e000e00000000'),
+    '5': unhexlify('00003ffc7ffc7ffc7000700070007000700070007ffc7ffc3ffe000e000e000e000e000e000e000e3ffe3ffe3ffc0000'),
+    '6': unhexlify('00003ffc7ffc7ffc7000700070007000700070007ffc7ffc7ffe700e700e700e700e700e700e700e7ffe7ffe3ffc0000'),
+    '7': unhexlify('00003ffc3ffe3ffe000e000e000e000e000e000e000e000e000e000e000e000e000e000e000e000e000e000e00000000'),
+    '8': unhexlify('00003ffc7ffe7ffe700e700e700e700e700e700e7ffe7ffe7ffe700e700e700e700e700e700e700e7ffe7ffe3ffc0000'),
+    '9': unhexlify('00003ffc7ffe7ffe700e700e700e700e700e700e7ffe7ffe3ffe000e000e000e000e000e000e000e3ffe3ffe3ffc0000'),
+    '.': unhexlify('000000000000000000000000000000000000003c3c3c3c00'),
+}
+GLYPHS[' '] = bytes(HEIGHT)
+
+
+class BigFont:
+    def __init__(self, cache_size=16):
+        self.height = HEIGHT
+
+        # Writable copies of the glyphs, FrameBuffer needs them
+        self.glyphs = {}
+        for char, bitmap in GLYPHS.items():
+            width = 8 * len(bitmap) // HEIGHT
+            self.glyphs[char] = (framebuf.FrameBuffer(bytearray(bitmap), width, HEIGHT, framebuf.MONO_HLSB), width)
+
+        # Rendered strings, the oldest one is dropped when the cache is full
+        self.cache_size = cache_size
+        self._cache = {}
+        self._cache_order = []
+        self.hits = 0
+        self.misses = 0
+
+    def width(self, text):
+        width = 0
+        for char in text:
+            width += self.glyphs[char][1] if char in self.glyphs else 8
+        return width
+
+    def render(self, text):
+        # Framebuffer with text drawn in it and its width, from the cache if it was rendered before
+        rendered = self._cache.get(text)
+        if rendered is not None:
+            self.hits += 1
+            return rendered
+        self.misses += 1
+
+        width = self.width(text)
+        fbuf = framebuf.FrameBuffer(bytearray((width + 7) // 8 * HEIGHT), width, HEIGHT, framebuf.MONO_HLSB)
+        x = 0
+        for char in text:
+            glyph = self.glyphs.get(char)
+            if glyph is None:
+                x += 8
+                continue
+            fbuf.blit(glyph[0], x, 0)
+            x += glyph[1]
+
+        rendered = (fbuf, width)
+        if len(self._cache_order) >= self.cache_size:
+            del self._cache[self._cache_order.pop(0)]
+        self._cache[text] = rendered
+        self._cache_order.append(text)
+        return rendered
+
+    def draw(self, fbuf, text, x, y):
+        # Draw text with its top left corner at (x, y). Returns its width
+        rendered, width = self.render(text)
+        fbuf.blit(rendered, x, y)
+        return width
+
+# Test
+
+import time
+
+def benchmark (lcd, iterations=200):
+    # Time per redraw of a speed value: 8x8 text vs large digits (every value new, then values from the cache)
+    font = BigFont()
+    values = [str(i / 10) for i in range(iterations)]
+
+    def run(draw):
+        start = time.ticks_us()
+        for value in values:
+            lcd.fill_rect(0, 20, 128, HEIGHT, 0)
+            draw(value)
+        return time.ticks_diff(time.ticks_us(), start) / iterations
+
+    text_us = run(lambda value: lcd.text('speed: ' + value + 'km/h', 0, 20, 1))
+    font.cache_size = iterations
+    miss_us = run(lambda value: font.draw(lcd, value, 0, 20))
+    hit_us = run(lambda value: font.draw(lcd, value, 0, 20))
+    print('text: ' + str(round(text_us)) + ' us, big digits: ' + str(round(miss_us)) + ' us, cached: ' + str(round(hit_us)) + ' us')
+
+if __name__ == '__main__':
+    from machine import Pin, SPI
+    from lcd12864 import LCD12864
+    spi = SPI(1, baudrate=1_000_000, sck=Pin(14, Pin.OUT), mosi=Pin(15, Pin.OUT))
+    cs = Pin(13, Pin.OUT, value=0)
+    lcd = LCD12864(spi, cs)
+    benchmark(lcd)
+
+    lcd.fill(0)
+    BigFont().draw(lcd, '0123456789.', 0, 0)
+    BigFont().draw(lcd, '24.5', 0, 32)
+    lcd.show()
@@ -0,0 +1,102 @@
+'''
+MicroPython module to send the saved rides to the phone over BLE, streaming them from the SD card.
+A ride file is read one chunk at a time into a fixed buffer and notified in packets that are slices of that buffer,
+no packet list or copy of the file is ever built: memory use during a sync doesn't depend on the size of the rides.
+'''
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+PACKET_SIZE = 20    # BLE notification payload (default ATT MTU)
+CHUNK_SIZE = 512
+
+
+def send (sp, data, packet_size=PACKET_SIZE):
+    # Notify data (bytes, bytearray or memoryview) in packets of packet_size bytes. Returns False if the phone
+    # disconnected
+    mv = memoryview(data)
+    for i in range(0, len(mv), packet_size):
+        if not sp.is_connected():
+            return False
+        sp.send(mv[i:i + packet_size])
+    return True
+
+async def send_file (sp, f, buffer, packet_size=PACKET_SIZE):
+    # Stream an open file through buffer (a bytearray), letting the other tasks run between chunks. Returns False if
+    # the phone disconnected
+    bufmv = memoryview(buffer)
+    while True:
+        n = f.readinto(buffer)
+        if not n:
+            return True
+        if not send(sp, bufmv[:n], packet_size):
+            return False
+        await asyncio.sleep(0)
+
+# Test
+
+import gc
+import io
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+MAX_HEAP_GROWTH = 2 * CHUNK_SIZE    # Heap a sync may keep, whatever the size of the file
+
+class FakePeripheral:
+    # Counts what would be notified
+    def __init__(self):
+        self.packets = 0
+        self.bytes_sent = 0
+        self.crc = 0
+
+    def is_connected(self):
+        return True
+
+    def send(self, data):
+        self.packets += 1
+        self.bytes_sent += len(data)
+        self.crc = (self.crc + sum(data)) & 0xffffffff
+
+def heap_used ():
+    # Bytes in use on the heap: gc.mem_alloc() on MicroPython, tracemalloc (started by the caller) on CPython
+    gc.collect()
+    if hasattr(gc, 'mem_alloc'):
+        return gc.mem_alloc()
+    return tracemalloc.get_traced_memory()[0]
+
+def sync_test (path='sync_test.bin', size=2 * 1024 * 1024):
+    # Stream a multi-megabyte file and compare the heap in use before and after, it may not grow by more than
+    # MAX_HEAP_GROWTH. Also meant to run on the unix port with a small heap (micropython -X heapsize=32K ble_sync.py):
+    # it can only pass if memory use is independent of the size of the file
+    if not hasattr(gc, 'mem_alloc') and tracemalloc is None:
+        print('No way to measure the heap')
+        return False
+    chunk = bytearray(range(256)) * (CHUNK_SIZE // 256)
+    with open(path, 'wb') as f:
+        for _ in range(size // CHUNK_SIZE):
+            f.write(chunk)
+    sp = FakePeripheral()
+    buffer = bytearray(CHUNK_SIZE)
+    # The first run sets the event loop up, not measured
+    asyncio.run(send_file(FakePeripheral(), io.BytesIO(chunk), buffer))
+    if not hasattr(gc, 'mem_alloc'):
+        tracemalloc.start()
+    used = heap_used()
+    with open(path, 'rb') as f:
+        sent = asyncio.run(send_file(sp, f, buffer))
+    grown = heap_used() - used
+    if not hasattr(gc, 'mem_alloc'):
+        tracemalloc.stop()
+    expected = sum(chunk) * (size // CHUNK_SIZE) & 0xffffffff
+    print('Sent ' + str(sp.bytes_sent) + ' bytes in ' + str(sp.packets) + ' packets, heap grown by ' + str(grown) +
+          ' bytes')
+    import os
+    os.remove(path)
+    return sent and sp.bytes_sent == size and sp.crc == expected and grown <= MAX_HEAP_GROWTH
+
+if __name__ == '__main__':
+    print('Sync: ' + ('OK' if sync_test() else 'FAIL'))
@@ -0,0 +1,213 @@
+'''
+MicroPython module with a write-back block cache for a block device (SDCard), to mount with uos.VfsFat in its place.
+FatFs reads and rewrites the same FAT and directory blocks over and over while a file grows, the cache keeps the most
+recently used blocks in a fixed number of 512 byte slots: reads of cached blocks never reach the card, and a block
+written several times is only written back once, when it is evicted (least recently used first) or on sync.
+FatFs syncs (ioctl 3) whenever a file is flushed or closed, so whatever was flushed is still on the card.
+Multi-block transfers (file data) go straight to the card, keeping its fast multi-block commands.
+'''
+
+BLOCK = 512
+
+
+class BlockCache:
+    def __init__(self, device, slots=8):
+        self.device = device
+        self.slots = [bytearray(BLOCK) for _ in range(slots)]
+        self._blocks = [-1] * slots     # Block held by each slot, -1 if free
+        self._dirty = [False] * slots
+        self._used = [0] * slots        # Last use, to evict the least recently used
+        self._index = {}                # Block number: slot
+        self._clock = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.reads = 0          # Blocks read from the device
+        self.writes = 0         # Blocks written to the device
+        self.syncs = 0
+
+    def _slot(self, block_num, load):
+        # Slot holding block_num, after evicting the least recently used block if it wasn't cached. The block is read
+        # from the device if load is True
+        slot = self._index.get(block_num)
+        if slot is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            slot = 0
+            for i in range(1, len(self.slots)):
+                if self._used[i] < self._used[slot]:
+                    slot = i
+            if self._dirty[slot]:
+                self.device.writeblocks(self._blocks[slot], self.slots[slot])
+                self.writes += 1
+                self._dirty[slot] = False
+            if self._blocks[slot] >= 0:
+                del self._index[self._blocks[slot]]
+            self._blocks[slot] = -1
+            if load:
+                self.device.readblocks(block_num, self.slots[slot])
+                self.reads += 1
+            self._blocks[slot] = block_num
+            self._index[block_num] = slot
+        self._clock += 1
+        self._used[slot] = self._clock
+        return slot
+
+    def readblocks(self, block_num, buf):
+        nblocks = len(buf) // BLOCK
+        if nblocks == 1:
+            buf[:] = self.slots[self._slot(block_num, True)]
+            return
+        # Straight from the device, with the cached blocks on top since they may be newer
+        self.device.readblocks(block_num, buf)
+        self.reads += nblocks
+        mv = memoryview(buf)
+        for i in range(nblocks):
+            slot = self._index.get(block_num + i)
+            if slot is not None:
+                mv[i * BLOCK:(i + 1) * BLOCK] = self.slots[slot]
+
+    def writeblocks(self, block_num, buf):
+        nblocks = len(buf) // BLOCK
+        if nblocks == 1:
+            slot = self._slot(block_num, False)
+            self.slots[slot][:] = buf
+            self._dirty[slot] = True
+            return
+        # Straight to the device, the cached copies of these blocks are updated and clean
+        self.device.writeblocks(block_num, buf)
+        self.writes += nblocks
+        mv = memoryview(buf)
+        for i in range(nblocks):
+            slot = self._index.get(block_num + i)
+            if slot is not None:
+                self.slots[slot][:] = mv[i * BLOCK:(i + 1) * BLOCK]
+                self._dirty[slot] = False
+
+    def sync(self):
+        # Write back every dirty block, in block order
+        while True:
+            slot = -1
+            for i in range(len(self.slots)):
+                if self._dirty[i] and (slot < 0 or self._blocks[i] < self._blocks[slot]):
+                    slot = i
+            if slot < 0:
+                return
+            self.device.writeblocks(self._blocks[slot], self.slots[slot])
+            self.writes += 1
+            self._dirty[slot] = False
+
+    def invalidate(self):
+        # Forget every block, written back or not (the card was removed)
+        for i in range(len(self.slots)):
+            self._blocks[i] = -1
+            self._dirty[i] = False
+            self._used[i] = 0
+        self._index = {}
+
+    def init_card(self, baudrate):
+        # SDCard interface: the card may have been replaced
+        self.invalidate()
+        self.device.init_card(baudrate)
+
+    def ioctl(self, op, arg):
+        if op == 3 or op == 2:  # Sync, deinit
+            self.syncs += 1
+            self.sync()
+            return 0
+        return self.device.ioctl(op, arg)
+
+    def report(self):
+        return ('cache: hits ' + str(self.hits) + ', misses ' + str(self.misses) + ', blocks read ' + str(self.reads) +
+                ', blocks written ' + str(self.writes) + ', syncs ' + str(self.syncs))
+
+# Test
+
+class FileBlockDevice:
+    # Block device backed by a file (an image of the card), counting the blocks actually transferred and the syncs
+    def __init__(self, path, blocks=2048):
+        self.blocks = blocks
+        self.reads = 0
+        self.writes = 0
+        self.syncs = 0
+        try:
+            self.file = open(path, 'r+b')
+        except OSError:
+            self.file = open(path, 'w+b')
+            self.file.write(bytearray(blocks * BLOCK))
+
+    def readblocks(self, block_num, buf):
+        self.file.seek(block_num * BLOCK)
+        self.file.readinto(buf)
+        self.reads += len(buf) // BLOCK
+
+    def writeblocks(self, block_num, buf):
+        self.file.seek(block_num * BLOCK)
+        self.file.write(buf)
+        self.writes += len(buf) // BLOCK
+
+    def ioctl(self, op, arg):
+        if op == 4:  # Number of blocks
+            return self.blocks
+        if op == 5:  # Block size
+            return BLOCK
+        if op == 3:
+            self.syncs += 1
+            self.file.flush()
+        return 0
+
+def ride_save_benchmark (slots=8, rides=3, points=2000, image='sd.img'):
+    # Record and save rides (track, checkpoints, ride file, index) on a FAT image, with and without the cache. Needs
+    # VfsFat (the device or the MicroPython unix port). Returns the blocks read and written, and the blocks written by
+    # the checkpoints alone: each one flushes the track and the journal, and FatFs syncs the device (ioctl 3) on every
+    # flush, which writes back the whole cache
+    import uos
+    from ride_index import RideIndex
+    from ride_recorder import RideRecorder
+    from ride_journal import RideJournal
+
+    results = []
+    for cached in (False, True):
+        try:
+            uos.remove(image)
+        except OSError:
+            pass
+        card = FileBlockDevice(image)
+        device = BlockCache(card, slots) if cached else card
+        uos.VfsFat.mkfs(device)
+        uos.mount(uos.VfsFat(device), '/bench')
+        card.reads = card.writes = card.syncs = 0
+        if cached:
+            device.reset_stats()
+        checkpoint_writes = 0
+        index = RideIndex('/bench')
+        index.load()
+        recorder = RideRecorder('/bench')
+        journal = RideJournal('/bench')
+        for ride in range(rides):
+            recorder.start()
+            journal.start()
+            for i in range(points):
+                recorder.add_point(36000 + i * 10, -25.4 + i * 1e-4, -49.2 - i * 1e-4, 25.0)
+                if i % 3 == 2:  # Checkpoint every 3 points (30 s at the default track period)
+                    writes = card.writes
+                    journal.write('01/01/24', '10:00', i * 10, i * 0.01, 35.0, i * 0.5, recorder.points,
+                                  recorder.sync(), recorder.encoder.last)
+                    checkpoint_writes += card.writes - writes
+            recorder.finish()
+            index.add(['01/01/24', '10:00', '01/01/24', '11:00', '01:00:00', '20000', '35.0', '600.0'],
+                      recorder.path, recorder.buffer, recorder.points, recorder.bytes_written)
+            journal.clear()
+        uos.umount('/bench')
+        results.append((card.reads, card.writes, checkpoint_writes))
+        print(('Cached ' + str(slots) + ' slots: ' if cached else 'Uncached: ') + str(card.reads) + ' blocks read, ' +
+              str(card.writes) + ' blocks written (' + str(checkpoint_writes) + ' by ' + str(rides * (points // 3)) +
+              ' checkpoints), ' + str(device.syncs) + ' syncs' + (', ' + device.report() if cached else ''))
+    uos.remove(image)
+    return results
+
+if __name__ == '__main__':
+    ride_save_benchmark()
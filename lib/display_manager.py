@@ -0,0 +1,65 @@
+'''
+MicroPython module to redraw the LCD only when what it shows changes.
+Each screen is a render function plus a model, the tuple of the values it displays (already rounded as displayed).
+The screen is only rendered when the screen or its model changed since the last render, and never faster than the
+configured frame rate.
+'''
+
+import time
+
+
+class DisplayManager:
+    def __init__(self, lcd, max_fps=4):
+        self.lcd = lcd
+        self.min_interval_ms = 1000 // max_fps
+        self._screen = None
+        self._model = None
+        self._t_render = time.ticks_add(time.ticks_ms(), -self.min_interval_ms)
+
+        # Statistics
+        self.renders = 0
+        self.unchanged = 0      # Updates skipped because nothing displayed changed
+        self.throttled = 0      # Updates postponed by the frame rate cap
+
+    def update(self, screen, render, model):
+        # Render screen (render(lcd, *model)) if it or its model changed. Returns True if it was rendered. A throttled
+        # change is rendered by a later update, since the model still differs then
+        if screen == self._screen and model == self._model:
+            self.unchanged += 1
+            return False
+        t_current = time.ticks_ms()
+        if time.ticks_diff(t_current, self._t_render) < self.min_interval_ms:
+            self.throttled += 1
+            return False
+        render(self.lcd, *model)
+        self._screen = screen
+        self._model = model
+        self._t_render = t_current
+        self.renders += 1
+        return True
+
+    def invalidate(self):
+        # Render on the next update, after something else drew on the display
+        self._screen = None
+        self._model = None
+
+# Test
+
+def render_counter (lcd, count):
+    lcd.fill(0)
+    lcd.text('Count: ' + str(count), 0, 0, 1)
+    lcd.show()
+
+if __name__ == '__main__':
+    from machine import Pin, SPI
+    from lcd12864 import LCD12864
+    spi = SPI(1, baudrate=1_000_000, sck=Pin(14, Pin.OUT), mosi=Pin(15, Pin.OUT))
+    cs = Pin(13, Pin.OUT, value=0)
+    display = DisplayManager(LCD12864(spi, cs), max_fps=4)
+
+    # Poll every 10 ms, the count changes every 100 ms: at most 4 renders/s
+    t_start = time.ticks_ms()
+    while time.ticks_diff(time.ticks_ms(), t_start) < 5000:
+        display.update('counter', render_counter, (time.ticks_diff(time.ticks_ms(), t_start) // 100,))
+        time.sleep_ms(10)
+    print('Renders: ' + str(display.renders) + ', unchanged: ' + str(display.unchanged) + ', throttled: ' + str(display.throttled))
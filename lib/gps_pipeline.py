@@ -0,0 +1,218 @@
+'''
+MicroPython module to process the GPS fixes of a ride.
+Distance and max speed are integrated from every fix, so nothing is lost at 5/10 Hz, while the speed shown on the
+display and the points saved to the track are decimated to their own (slower) periods.
+'''
+
+from math import sqrt, sin, cos, atan2, radians
+
+
+# Calculate distance between two points using Haversine formula (in km)
+def distance (lat0, lon0, lat1, lon1):
+    R = 6371.0
+    lat0 = radians(lat0)
+    lon0 = radians(lon0)
+    lat1 = radians(lat1)
+    lon1 = radians(lon1)
+    dlon = lon1 - lon0
+    dlat = lat1 - lat0
+    a = sin(dlat / 2)**2 + cos(lat0) * cos(lat1) * sin(dlon / 2)**2
+    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    return R * c
+
+
+class GPSPipeline:
+    def __init__(self, rate_hz=1, display_period_ms=1000, track_period_ms=10000):
+        # Number of fixes between two display updates / two track points
+        self.display_every = max(1, rate_hz * display_period_ms // 1000)
+        self.track_every = max(1, rate_hz * track_period_ms // 1000)
+        self.reset()
+
+    def reset(self):
+        # Ride accumulators
+        self.distance = 0.0     # km
+        self.max_speed = 0.0    # km/h
+        self.fixes = 0
+
+        # Decimated outputs
+        self.display_speed = 0.0
+        self.track_due = False
+
+        self._prev_lat = None
+        self._prev_lon = None
+        self._last_epoch = -1
+        self._speed_sum = 0.0
+        self._speed_count = 0
+        self._display_count = 0
+
+    def add_fix(self, lat, lon, speed, timestamp, integrate=True):
+        # Process a new fix. timestamp is the receiver time ([hours, minutes, seconds]), used to count each
+        # navigation epoch only once since several sentences/messages carry the same fix. Position and speed are
+        # only integrated when integrate is True (ride not paused). Returns True if the fix was new
+        epoch = timestamp[0] * 3600 + timestamp[1] * 60 + timestamp[2]
+        if epoch == self._last_epoch:
+            return False
+        self._last_epoch = epoch
+
+        if integrate:
+            if self._prev_lat is not None:
+                self.distance += distance(self._prev_lat, self._prev_lon, lat, lon)
+            self._prev_lat = lat
+            self._prev_lon = lon
+
+            if speed > self.max_speed:
+                self.max_speed = speed
+
+            self.fixes += 1
+            if self.fixes % self.track_every == 0:
+                self.track_due = True
+
+        # Display the mean speed of the fixes since the last display update
+        self._speed_sum += speed
+        self._speed_count += 1
+        self._display_count += 1
+        if self._display_count >= self.display_every:
+            self.display_speed = self._speed_sum / self._speed_count
+            self._speed_sum = 0.0
+            self._speed_count = 0
+            self._display_count = 0
+
+        return True
+
+    def take_track_point(self):
+        # Returns True once every track period, when the current position should be saved to the track
+        if self.track_due:
+            self.track_due = False
+            return True
+        return False
+
+# Test
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    # CPython, so the benchmarks also run on a computer
+    import time
+
+    def ticks_us():
+        return int(time.perf_counter() * 1000000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+def nmea_sentence (body):
+    crc = 0
+    for c in body:
+        crc ^= ord(c)
+    return '$' + body + '*' + '{0:02X}'.format(crc) + '\r\n'
+
+def throughput_benchmark (rate_hz=10, seconds=10, baudrate=38400, rxbuf=1024, poll_ms=50):
+    # Replay <seconds> of RMC+GGA output at <rate_hz>, arriving at <baudrate>, polled every <poll_ms> (DT_GPS_POLL in
+    # main.py) through get_data() into the pipeline as gps_job does: every epoch must reach the pipeline, and the bytes
+    # waiting between two polls must fit in the RX buffer
+    from micropyGPS import MicropyGPS, get_data
+
+    epochs = []
+    for i in range(rate_hz * seconds):
+        t = i / rate_hz
+        utc = '{0:02d}{1:02d}{2:05.2f}'.format(12, int(t // 60), t % 60)
+        lat = '25{0:08.5f}'.format(24.0 + i * 0.00005)
+        sentences = nmea_sentence('GPRMC,' + utc + ',A,' + lat + ',S,04912.00000,W,10.5,90.0,170524,,,A')
+        sentences += nmea_sentence('GPGGA,' + utc + ',' + lat + ',S,04912.00000,W,1,08,1.01,900.0,M,-5.0,M,,')
+        epochs.append(sentences.encode())
+    data = b''.join(epochs)
+
+    # When each epoch starts arriving, and where it is in data: sent at the start of its period, or right after the
+    # previous one if the UART is still busy with it
+    byte_us = 10_000_000 // baudrate
+    arrival = []
+    first = 0
+    t_free = 0
+    for i, epoch in enumerate(epochs):
+        t_start = max(i * 1_000_000 // rate_hz, t_free)
+        arrival.append((t_start, first, first + len(epoch)))
+        first += len(epoch)
+        t_free = t_start + len(epoch) * byte_us
+
+    class Wire:
+        # UART stand-in, returns the bytes arrived by the current poll
+        pos = 0
+        arrived = 0
+        def any(self):
+            return self.arrived - self.pos
+        def read(self, n):
+            self.pos += n
+            return data[self.pos - n:self.pos]
+
+    gps = MicropyGPS(-3, sentences=('RMC', 'GGA'))
+    pipeline = GPSPipeline(rate_hz)
+    uart = Wire()
+    epoch = 0
+    worst_us = 0
+    total_us = 0
+    worst_pending = 0
+    for now_us in range(0, (seconds + 1) * 1_000_000, poll_ms * 1000):
+        while epoch + 1 < len(arrival) and arrival[epoch + 1][0] <= now_us:
+            epoch += 1
+        t_start, first, last = arrival[epoch]
+        if now_us >= t_start:
+            uart.arrived = min(last, first + (now_us - t_start) // byte_us)
+        worst_pending = max(worst_pending, uart.any())
+        t_poll = ticks_us()
+        gps_data, changed = get_data(gps, uart)
+        if changed and gps_data:
+            pipeline.add_fix(gps_data[0], gps_data[1], gps_data[2], gps.timestamp)
+        elapsed = ticks_diff(ticks_us(), t_poll)
+        total_us += elapsed
+        worst_us = max(worst_us, elapsed)
+
+    print('Fixes: ' + str(pipeline.fixes) + '/' + str(rate_hz * seconds) + ', polled every ' + str(poll_ms) + ' ms')
+    print('UART load: ' + str(round(len(data) / seconds)) + ' B/s of ' + str(baudrate // 10) + ' B/s')
+    print('CPU share: ' + str(round(total_us / (seconds * 10_000), 1)) + '%')
+    print('Worst poll: ' + str(worst_us / 1000) + ' ms, ' + str(worst_pending) + ' bytes waiting, RX buffer ' +
+          str(rxbuf) + ' bytes')
+    return pipeline.fixes == rate_hz * seconds and worst_pending <= rxbuf
+
+def ubx_rate_test (rate_hz=10, seconds=5, chunk=64):
+    # Replay <seconds> of UBX output (NAV-POSLLH, NAV-STATUS, NAV-VELNED, NAV-TIMEUTC) at <rate_hz>: every epoch must
+    # reach the pipeline, the epochs within a second only differ by their fraction of a second
+    import struct
+    from micropyGPS import get_data
+    from ubx import MicropyUBX, frame, CLS_NAV, NAV_POSLLH, NAV_STATUS, NAV_VELNED, NAV_TIMEUTC
+
+    data = bytearray()
+    for i in range(rate_hz * seconds):
+        itow = i * 1000 // rate_hz
+        nano = (i % rate_hz) * 1_000_000_000 // rate_hz
+        sec = (i // rate_hz) % 60
+        data += frame(CLS_NAV, NAV_POSLLH, struct.pack('<IiiiiII', itow, -492000000, -254000000 - i * 50, 900000,
+                                                       905000, 2000, 3000))
+        data += frame(CLS_NAV, NAV_STATUS, struct.pack('<IBBBBII', itow, 3, 0x01, 0, 0, 0, 0))
+        data += frame(CLS_NAV, NAV_VELNED, struct.pack('<IiiiIIiII', itow, 0, 0, 0, 2920, 2920, 0, 0, 0))
+        data += frame(CLS_NAV, NAV_TIMEUTC, struct.pack('<IIiHBBBBBB', itow, 50, nano, 2024, 5, 17, 12, 0, sec, 0x07))
+    data = bytes(data)
+
+    class Chunks:
+        # UART stand-in, returns one chunk per read
+        pos = 0
+        def any(self):
+            return min(chunk, len(data) - self.pos)
+        def read(self, n):
+            self.pos += n
+            return data[self.pos - n:self.pos]
+
+    # Polled like the firmware does, through get_data()
+    gps = MicropyUBX(-3)
+    uart = Chunks()
+    pipeline = GPSPipeline(rate_hz)
+    while uart.any():
+        gps_data, changed = get_data(gps, uart)
+        if changed and gps_data and gps.date != [0, 0, 0]:    # Time received
+            pipeline.add_fix(gps_data[0], gps_data[1], gps_data[2], gps.timestamp)
+    print('UBX fixes at ' + str(rate_hz) + ' Hz: ' + str(pipeline.fixes) + '/' + str(rate_hz * seconds))
+    return pipeline.fixes == rate_hz * seconds
+
+if __name__ == "__main__":
+    for rate_hz in (1, 5, 10):
+        print(str(rate_hz) + ' Hz: ' + ('OK' if throughput_benchmark(rate_hz) else 'FAIL'))
+        print(str(rate_hz) + ' Hz UBX: ' + ('OK' if ubx_rate_test(rate_hz) else 'FAIL'))
@@ -0,0 +1,201 @@
+'''
+MicroPython module to run the GPS on the RP2040's second core.
+Core 1 owns the UART and the parser and publishes every new fix through a lock protected double buffer, core 0 (UI,
+state machine, storage) only copies the latest fix out of it. The handoff uses preallocated slots, publishing and
+reading a fix doesn't allocate.
+'''
+
+import _thread
+import time
+from micropyGPS import get_data
+
+# Slot layout
+VALID = 0
+LATITUDE = 1
+LONGITUDE = 2
+SPEED = 3
+DATE = 4
+TIME = 5
+HOURS = 6
+MINUTES = 7
+SECONDS = 8
+ALTITUDE = 9
+LATITUDE_UDEG = 10
+LONGITUDE_UDEG = 11
+SLOT_SIZE = 12
+
+
+class FixExchange:
+    def __init__(self):
+        # The writer fills the back slot without the lock, then swaps it to the front under the lock. The reader only
+        # copies the front slot under the lock, so it never sees a half written fix
+        self._slots = ([False, 0.0, 0.0, 0.0, '', '', 0, 0, 0, 0.0, 0, 0], [False, 0.0, 0.0, 0.0, '', '', 0, 0, 0, 0.0, 0, 0])
+        self._front = 0
+        self._lock = _thread.allocate_lock()
+        self.generation = 0     # Incremented on every publish
+
+        # Reader side, used by get_data()
+        self.fix = [False, 0.0, 0.0, 0.0, '', '', 0, 0, 0, 0.0, 0, 0]
+        self.timestamp = [0, 0, 0]
+        self.altitude = 0.0
+        self.latitude_udeg = self.longitude_udeg = 0
+        self._snapshot = None
+        self._read_generation = 0
+
+    def publish(self, snapshot, timestamp, altitude=0.0, fix=None):
+        # Writer (core 1): snapshot is (latitude, longitude, speed, date, time) or None without a fix, timestamp is
+        # the receiver time [hours, minutes, seconds], fix the parser's GPSFix for the position in microdegrees
+        slot = self._slots[1 - self._front]
+        if snapshot is None:
+            slot[VALID] = False
+        else:
+            slot[VALID] = True
+            slot[LATITUDE] = snapshot[0]
+            slot[LONGITUDE] = snapshot[1]
+            slot[SPEED] = snapshot[2]
+            slot[DATE] = snapshot[3]
+            slot[TIME] = snapshot[4]
+            if fix is not None:
+                slot[LATITUDE_UDEG] = fix.latitude_udeg
+                slot[LONGITUDE_UDEG] = fix.longitude_udeg
+        slot[HOURS] = timestamp[0]
+        slot[MINUTES] = timestamp[1]
+        slot[SECONDS] = timestamp[2]
+        slot[ALTITUDE] = altitude
+        self._lock.acquire()
+        self._front = 1 - self._front
+        self.generation += 1
+        self._lock.release()
+
+    def read_into(self, dest):
+        # Reader (core 0): copy the latest fix into dest (a list of SLOT_SIZE items). Returns its generation
+        self._lock.acquire()
+        slot = self._slots[self._front]
+        for i in range(SLOT_SIZE):
+            dest[i] = slot[i]
+        generation = self.generation
+        self._lock.release()
+        return generation
+
+    def get_data(self):
+        # Same as micropyGPS.get_data(): the (latitude, longitude, speed, date, time) snapshot or None, and whether it
+        # changed since the previous call. Only builds a new snapshot when a new fix was published
+        if self.generation == self._read_generation:
+            return self._snapshot, False
+        fix = self.fix
+        self._read_generation = self.read_into(fix)
+        self.timestamp[0] = fix[HOURS]
+        self.timestamp[1] = fix[MINUTES]
+        self.timestamp[2] = fix[SECONDS]
+        self.altitude = fix[ALTITUDE]
+        self.latitude_udeg = fix[LATITUDE_UDEG]
+        self.longitude_udeg = fix[LONGITUDE_UDEG]
+        if fix[VALID]:
+            self._snapshot = (fix[LATITUDE], fix[LONGITUDE], fix[SPEED], fix[DATE], fix[TIME])
+        else:
+            self._snapshot = None
+        return self._snapshot, True
+
+
+class GPSThread:
+    def __init__(self, gps_module, gps, exchange, period_ms=5):
+        self.gps_module = gps_module
+        self.gps = gps
+        self.exchange = exchange
+        self.period_ms = period_ms
+        self.running = False
+        self.stopped = True
+
+        # Statistics
+        self.loops = 0
+        self.published = 0
+
+    def start(self):
+        # Only one extra thread is available on the RP2040, it runs on core 1
+        self.running = True
+        self.stopped = False
+        _thread.start_new_thread(self._run, ())
+
+    def stop(self):
+        self.running = False
+        while not self.stopped:
+            time.sleep_ms(self.period_ms)
+
+    def poll(self):
+        # Read and parse everything waiting in the UART, publish the fix if it changed
+        snapshot, changed = get_data(self.gps, self.gps_module)
+        if changed:
+            self.exchange.publish(snapshot, self.gps.timestamp, self.gps.altitude, self.gps.get_fix())
+            self.published += 1
+        self.loops += 1
+
+    def _run(self):
+        try:
+            while self.running:
+                self.poll()
+                time.sleep_ms(self.period_ms)
+        finally:
+            self.stopped = True
+
+# Test
+
+try:
+    from time import ticks_ms, ticks_diff, sleep_ms
+except ImportError:
+    # CPython, so the test also runs on a computer
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+    def sleep_ms(ms):
+        time.sleep(ms / 1000)
+
+def exchange_test (seconds=2):
+    # Hammer the exchange from a writer thread while reading it here, every fix read must be a consistent one
+    exchange = FixExchange()
+    done = [False]
+
+    def writer():
+        i = 0
+        timestamp = [0, 0, 0]
+        snapshots = [(float(i), float(-i), float(i % 100), str(i), str(i)) for i in range(256)]
+        while not done[0]:
+            timestamp[2] = i % 256
+            exchange.publish(snapshots[i % 256], timestamp)
+            i += 1
+        done[0] = False
+
+    _thread.start_new_thread(writer, ())
+    dest = [None] * SLOT_SIZE
+    reads = 0
+    torn = 0
+    t_start = ticks_ms()
+    while ticks_diff(ticks_ms(), t_start) < seconds * 1000:
+        exchange.read_into(dest)
+        if dest[VALID]:
+            i = int(dest[LATITUDE])
+            if dest[LONGITUDE] != -i or dest[DATE] != str(i) or dest[SECONDS] != i:
+                torn += 1
+            reads += 1
+    done[0] = True
+    while done[0]:
+        sleep_ms(1)
+    print('Published: ' + str(exchange.generation) + ', read: ' + str(reads) + ', torn: ' + str(torn))
+    return torn == 0
+
+if __name__ == '__main__':
+    print('Exchange: ' + ('OK' if exchange_test() else 'FAIL'))
+
+    from machine import Pin, UART
+    from micropyGPS import MicropyGPS
+    gps_module = UART(1, baudrate=9600, tx=Pin(8), rx=Pin(9))
+    exchange = FixExchange()
+    thread = GPSThread(gps_module, MicropyGPS(-3, sentences=('RMC', 'GGA')), exchange)
+    thread.start()
+    while True:
+        data, changed = exchange.get_data()
+        if changed:
+            print(data, exchange.timestamp)
+        time.sleep_ms(100)
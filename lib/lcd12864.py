@@ -4,8 +4,8 @@ Original source: https://gist.github.com/phoreglad/ca01e9b66ff76abdb2e098ad47130
 '''
 
 
-from machine import Pin, SPI
 import framebuf
+import micropython
 
 
 '''
@@ -18,6 +18,13 @@ section followed by 4 〝0
 '''
 
 SYNC = 0b11111000
+DATA = SYNC | 0x2
+
+# Each byte sent as its two nibble bytes: NIBBLES[2*b] = high nibble, NIBBLES[2*b + 1] = low nibble
+NIBBLES = bytearray(512)
+for _b in range(256):
+    NIBBLES[2 * _b] = _b & 0xf0
+    NIBBLES[2 * _b + 1] = (_b & 0xf) << 4
 
 class LCD12864(framebuf.FrameBuffer):
     def __init__(self, spi, cs):
@@ -28,6 +35,27 @@ class LCD12864(framebuf.FrameBuffer):
         self._buf = bytearray(128 * 64 // 2)
         self._bufmv = memoryview(self._buf)
         super().__init__(self._buf, 128, 64, framebuf.MONO_HLSB)
+
+        # Copy of what the display is showing, show() only sends what differs from it
+        self._shadow = bytearray(128 * 64 // 8)
+        self._shadow_valid = False
+        self._dirty_top = 0
+        self._dirty_bottom = self.height
+
+        # Transmit buffers: a whole row of data (sync byte + 16 bytes as nibbles) and an address command, with a
+        # view per data length so sending a row doesn't allocate
+        self._tx = bytearray(1 + 2 * 16)
+        self._tx[0] = DATA
+        txmv = memoryview(self._tx)
+        self._tx_views = [txmv[:1 + 2 * n] for n in range(17)]
+        self._cmd = bytearray(5)
+        self._cmd[0] = SYNC
+
+        # Statistics
+        self.bytes_sent = 0     # SPI bytes, commands included
+        self.rows_sent = 0
+        self.frames = 0
+
         self._disp_init()
     
     def _disp_init(self):
@@ -43,11 +71,26 @@ class LCD12864(framebuf.FrameBuffer):
         self._cs.value(1)
         self._spi.write(buf)
         self._cs.value(0)
+        self.bytes_sent += len(buf)
         #self._cs(0)
 
     def _format_byte(self, byte):
         return [byte & 0xf0, (byte & 0xf) << 4]
 
+    @micropython.native
+    def _encode(self, data, start, end, shadow):
+        # Expand data[start:end] (at most 16 bytes) into the transmit buffer, copying it to shadow if given
+        tx = self._tx
+        lut = NIBBLES
+        j = 1
+        for i in range(start, end):
+            b = data[i]
+            if shadow is not None:
+                shadow[i] = b
+            tx[j] = lut[2 * b]
+            tx[j + 1] = lut[2 * b + 1]
+            j += 2
+
     def write_cmd(self, cmd):
         buf = [SYNC]
         if isinstance(cmd, int):
@@ -58,25 +101,103 @@ class LCD12864(framebuf.FrameBuffer):
         self._send(bytes(buf))
         
     def write_data(self, data: bytearray):
-        buf = [SYNC | 0x2]
-        for b in data:
-            buf += self._format_byte(b)
-        self._send(bytes(buf))
+        # Sends 16 bytes per transfer through the transmit buffer
+        for start in range(0, len(data), 16):
+            end = min(start + 16, len(data))
+            self._encode(data, start, end, None)
+            self._send(self._tx_views[end - start])
 
     def set_address(self, x, y):
-        self.write_cmd([0x80 + y, 0x80 + x])
+        cmd = self._cmd
+        cmd[1] = NIBBLES[2 * (0x80 + y)]
+        cmd[2] = NIBBLES[2 * (0x80 + y) + 1]
+        cmd[3] = NIBBLES[2 * (0x80 + x)]
+        cmd[4] = NIBBLES[2 * (0x80 + x) + 1]
+        self._send(cmd)
         
-    def show(self):
-        for j in range(2):
-            for i in range(32):
-                self.set_address(8*j, i)
-                self.write_data(bytearray(self._bufmv[(512 * j) + i * 16 : (512 * j) + (16 + i * 16)]))
+    def mark_dirty(self, x, y, w, h):
+        # Record a drawn rectangle, show_dirty() only looks at the rows marked since the last show
+        if y < self._dirty_top:
+            self._dirty_top = max(0, y)
+        if y + h > self._dirty_bottom:
+            self._dirty_bottom = min(self.height, y + h)
+
+    def show(self, full=False):
+        # Send the framebuffer to the display. Unless full is True, only the rows that changed since the last call
+        # are sent, and of those only the span between the first and the last changed 16 bit word
+        self._show_rows(0, self.height, full)
+
+    def show_dirty(self):
+        # Same as show(), looking only at the rows marked with mark_dirty()
+        if self._shadow_valid:
+            self._show_rows(self._dirty_top, self._dirty_bottom, False)
+        else:
+            self._show_rows(0, self.height, True)
+
+    def _show_rows(self, top, bottom, full):
+        full = full or not self._shadow_valid
+        buf = self._buf
+        shadow = self._shadow
+        for y in range(top, bottom):
+            row = y * 16
+            start = row
+            end = row + 16
+            if not full:
+                while start < end and buf[start] == shadow[start]:
+                    start += 1
+                if start == end:
+                    continue
+                while buf[end - 1] == shadow[end - 1]:
+                    end -= 1
+                start &= ~1
+                end += end & 1
+            # GDRAM rows are 8 words wide, the lower half of the screen is on the right of the upper half
+            self.set_address(8*(y // 32) + (start - row) // 2, y % 32)
+            self._encode(buf, start, end, shadow)
+            self._send(self._tx_views[end - start])
+            self.rows_sent += 1
+        self._shadow_valid = True
+        self._dirty_top = self.height
+        self._dirty_bottom = 0
+        self.frames += 1
 
 # Test
 
 import time
+import gc
+
+class FakeSPI:
+    # Stands in for the SPI bus, to time the serializer on its own
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, buf):
+        self.bytes += len(buf)
+
+class FakePin:
+    # Stands in for the chip select pin
+    def value(self, value=None):
+        return 0
+
+def benchmark (frames=100):
+    # Full frames serialized per second, and heap allocated while doing it (MicroPython only)
+    lcd = LCD12864(FakeSPI(), FakePin())
+    lcd.fill(0)
+    lcd.text('Benchmark', 0, 0, 1)
+    lcd.show(full=True)
+    alloc = gc.mem_alloc() if hasattr(gc, 'mem_alloc') else None
+    start = time.ticks_us()
+    for _ in range(frames):
+        lcd.show(full=True)
+    elapsed = time.ticks_diff(time.ticks_us(), start)
+    if alloc is not None:
+        alloc = gc.mem_alloc() - alloc
+    print('Frames/s: ' + str(round(frames * 1_000_000 / elapsed, 1)) + ', heap allocated: ' + str(alloc))
+    return frames * 1_000_000 / elapsed
 
 if __name__ == '__main__':
+    from machine import Pin, SPI
+    benchmark()
     
     spi = SPI(1, baudrate=1_000_000, sck=Pin(14, Pin.OUT), mosi=Pin(15, Pin.OUT))
     cs = Pin(13, Pin.OUT, value=0)
@@ -98,6 +219,17 @@ if __name__ == '__main__':
     fbuf.text('20', 0, 16, 1)
     fbuf.ellipse(17, 16, 1, 1, 1, False)
     fbuf.show()
+
+    # Partial refresh: only the changing seconds should be sent
+    sent = fbuf.bytes_sent
+    fbuf.show(full=True)
+    full_bytes = fbuf.bytes_sent - sent
+    sent = fbuf.bytes_sent
+    for s in range(10):
+        fbuf.fill_rect(0, 32, 128, 8, 0)
+        fbuf.text('00:00:0' + str(s), 0, 32, 1)
+        fbuf.show()
+    print('Full frame: ' + str(full_bytes) + ' bytes, partial: ' + str((fbuf.bytes_sent - sent) // 10) + ' bytes/frame')
     # fbuf.ellipse(64, 31, 32, 16, 1, True)
     # fbuf.ellipse(64, 31, 16, 32, 1, True)
     
@@ -13,7 +13,6 @@ Adapted from: https://github.com/inmcm/micropyGPS/blob/master/micropyGPS.py
 # Time Since First Fix
 # Distance/Time to Target
 # More Helper Functions
-# Dynamically limit sentences types to parse
 
 from math import floor, modf
 
@@ -29,7 +28,7 @@ except ImportError:
 
 class MicropyGPS(object):
     """GPS NMEA Sentence Parser. Creates object that stores all relevant GPS data and statistics.
-    Parses sentences one character at a time using update(). """
+    Parses sentences one character at a time using update(), or a whole chunk of bytes at a time using feed(). """
 
     # Max Number of Characters a valid sentence can be (based on GGA sentence)
     SENTENCE_LIMIT = 90
@@ -42,8 +41,9 @@ class MicropyGPS(object):
     __MONTHS = ('January', 'February', 'March', 'April', 'May',
                 'June', 'July', 'August', 'September', 'October',
                 'November', 'December')
+    __DELIMITERS = (ord('$'), ord(','), ord('*'))
 
-    def __init__(self, local_offset=0, location_formatting='ddm'):
+    def __init__(self, local_offset=0, location_formatting='ddm', sentences=None):
         """
         Setup GPS Object Status Flags, Internal Data Registers, etc
             local_offset (int): Timzone Difference to UTC
@@ -51,6 +51,8 @@ class MicropyGPS(object):
                                        Decimal Degree Minute (ddm) - 40° 26.767′ N
                                        Degrees Minutes Seconds (dms) - 40° 26′ 46″ N
                                        Decimal Degrees (dd) - 40.446° N
+            sentences (tuple): Sentence types to parse, without the talker ID (e.g. ('RMC', 'GGA')).
+                               Other sentences are skipped as soon as their type is known. None parses all
         """
 
         #####################
@@ -62,12 +64,17 @@ class MicropyGPS(object):
         self.crc_xor = 0
         self.char_count = 0
         self.fix_time = 0
+        self.pending_data = b''
+        self.sentence_types = tuple(sentences) if sentences else None
+        self.sentence_types_bytes = tuple(t.encode() for t in sentences) if sentences else None
 
         #####################
         # Sentence Statistics
         self.crc_fails = 0
         self.clean_sentences = 0
         self.parsed_sentences = 0
+        self.skipped_sentences = 0
+        self.generation = 0  # Bumped on every successful RMC/GGA parse
 
         #####################
         # Logging Related
@@ -89,6 +96,12 @@ class MicropyGPS(object):
         self.course = 0.0
         self.altitude = 0.0
         self.geoid_height = 0.0
+        self.fix = GPSFix()
+
+        # Last get_data() result and the generation/speed unit it was built from
+        self.data_snapshot = None
+        self.data_snapshot_generation = -1
+        self.data_snapshot_unit = None
 
         # GPS Info
         self.satellites_in_view = 0
@@ -276,6 +289,9 @@ class MicropyGPS(object):
             self.course = 0.0
             self.valid = False
 
+        # Let get_data() know the fix data changed
+        self.generation += 1
+
         return True
 
     def gpgll(self):
@@ -432,6 +448,9 @@ class MicropyGPS(object):
         if fix_stat:
             self.new_fix_time()
 
+        # Let get_data() know the fix data changed
+        self.generation += 1
+
         return True
 
     def gpgsa(self):
@@ -593,6 +612,13 @@ class MicropyGPS(object):
                 # Check if a section is ended (,), Create a new substring to feed
                 # characters to
                 elif new_char == ',':
+
+                    # Sentence type is known, drop the rest of the sentence if it isn't wanted
+                    if self.active_segment == 0 and not self.sentence_wanted(self.gps_segments[0]):
+                        self.skipped_sentences += 1
+                        self.sentence_active = False
+                        return None
+
                     self.active_segment += 1
                     self.gps_segments.append('')
 
@@ -629,6 +655,7 @@ class MicropyGPS(object):
 
                             # Let host know that the GPS object was updated by returning parsed sentence type
                             self.parsed_sentences += 1
+                            self.update_fix()
                             return self.gps_segments[0]
 
                 # Check that the sentence buffer isn't filling up with Garage waiting for the sentence to complete
@@ -638,6 +665,145 @@ class MicropyGPS(object):
         # Tell Host no new sentence was parsed
         return None
 
+    def feed(self, buf):
+        """Process a chunk of raw bytes (bytes or bytearray) as read from the UART. Complete sentences ('$...*hh')
+        are located with find() and sliced out instead of being built one character at a time, the CRC is computed
+        in a single pass and only valid sentences are split into segments and parsed. An incomplete sentence at the
+        end of the chunk is kept until the next call. Sentences that fail the CRC or contain unusual characters are
+        handed to update(), so the object ends up in the same state as if every character had been fed to update().
+        Returns the type of the last sentence parsed, None otherwise"""
+
+        # Logging needs every character, leave it to the character based path
+        if self.log_en:
+            return self._update_chars(buf)
+
+        if self.pending_data:
+            data = self.pending_data + buf
+            self.pending_data = b''
+        else:
+            data = buf
+
+        data_mv = memoryview(data)
+        start = data.find(b'$')
+
+        # Finish a sentence left open by update() before looking for new ones
+        parsed = None
+        if self.sentence_active:
+            parsed = self._update_chars(data_mv[:start] if start >= 0 else data_mv)
+
+        while start >= 0:
+            self.sentence_active = False
+            next_start = data.find(b'$', start + 1)
+            end = data.find(b'*', start + 1)
+
+            # Sentence still incomplete, keep it for the next chunk unless it is already too long
+            if end < 0 or end + 3 > len(data):
+                if next_start < 0:
+                    if len(data) - start - 1 <= self.SENTENCE_LIMIT:
+                        self.pending_data = bytes(data_mv[start:])
+                    break
+                if end < 0 or end > next_start:
+                    start = next_start
+                    continue
+
+            # A new sentence started before this one was finished
+            elif 0 <= next_start < end:
+                start = next_start
+                continue
+
+            # Sentence is too long, update() would have dropped it before reaching the CRC
+            if end - start + 1 > self.SENTENCE_LIMIT:
+                start = next_start
+                continue
+
+            # Unwanted sentence type, skip it without checking the CRC
+            if self.sentence_types_bytes and not self._prefix_wanted(data, start):
+                self.skipped_sentences += 1
+                start = next_start
+                continue
+
+            crc_xor = self._sentence_crc(data_mv, start, end)
+            if crc_xor >= 0:
+                message = self._parse_sentence(data_mv, start, end, crc_xor)
+                start = data.find(b'$', end + 3)
+            else:
+                # CRC mismatch or unusual characters, update() knows how to deal with those
+                stop = next_start if next_start >= 0 else len(data)
+                message = self._update_chars(data_mv[start:stop])
+                start = next_start
+
+            if message:
+                parsed = message
+
+        return parsed
+
+    def _prefix_wanted(self, data, start):
+        """Check the sentence type following the talker ID of the sentence starting at data[start] ('$')
+        against the types selected in the constructor"""
+        if data[start + 1] == 44 or data[start + 2] == 44:  # ',' inside the talker ID
+            return False
+        for sentence_type in self.sentence_types_bytes:
+            if data.startswith(sentence_type, start + 3):
+                return True
+        return False
+
+    def sentence_wanted(self, address):
+        """Check if a sentence with the given address (talker ID + sentence type, e.g. 'GPRMC') should be parsed
+        :return: boolean
+        """
+        return not self.sentence_types or address[2:5] in self.sentence_types
+
+    def _update_chars(self, buf):
+        """Feed every byte of buf to update(). Returns the type of the last sentence parsed, None otherwise"""
+        parsed = None
+        for byte in buf:
+            message = self.update(chr(byte))
+            if message:
+                parsed = message
+        return parsed
+
+    def _sentence_crc(self, data_mv, start, end):
+        """Compute the CRC of the sentence between data_mv[start] ('$') and data_mv[end] ('*') and check it against
+        the two hex digits that follow. Returns the CRC if it matches, -1 if it doesn't or the sentence contains
+        characters update() would treat differently"""
+        crc_xor = 0
+        for byte in data_mv[start + 1:end]:
+            if byte < 10 or byte > 126:
+                return -1
+            crc_xor ^= byte
+
+        for byte in data_mv[end + 1:end + 3]:
+            if byte < 10 or byte > 126 or byte in self.__DELIMITERS:
+                return -1
+
+        try:
+            if int(str(data_mv[end + 1:end + 3], 'ascii'), 16) == crc_xor:
+                return crc_xor
+        except ValueError:
+            pass  # CRC Value was deformed and could not have been correct
+        return -1
+
+    def _parse_sentence(self, data_mv, start, end, crc_xor):
+        """Split the valid sentence between data_mv[start] ('$') and data_mv[end] ('*') into segments and parse it.
+        Returns sentence type on successful parse, None otherwise"""
+        self.gps_segments = str(data_mv[start + 1:end], 'ascii').split(',')
+        self.gps_segments.append(str(data_mv[end + 1:end + 3], 'ascii'))
+        self.active_segment = len(self.gps_segments) - 1
+        self.crc_xor = crc_xor
+        self.process_crc = False
+        self.char_count = end - start + 2
+        self.clean_sentences += 1
+
+        if self.gps_segments[0] in self.supported_sentences:
+
+            # parse the Sentence Based on the message type, return True if parse is clean
+            if self.supported_sentences[self.gps_segments[0]](self):
+                self.parsed_sentences += 1
+                self.update_fix()
+                return self.gps_segments[0]
+
+        return None
+
     def new_fix_time(self):
         """Updates a high resolution counter with current time when fix is updated. Currently only triggered from
         GGA, GSA and RMC sentences"""
@@ -691,6 +857,36 @@ class MicropyGPS(object):
 
         return current
 
+    def update_fix(self):
+        """Refresh the numeric fix returned by get_fix() from the latest parsed data. Called once per parsed sentence"""
+        fix = self.fix
+
+        # Same rule as convert_coordinates(): no degrees means no position yet
+        fix.valid = self._latitude[0] != 0 and self._longitude[0] != 0
+
+        latitude = self._latitude[0] * 1_000_000 + round(self._latitude[1] * 1_000_000 / 60)
+        if self._latitude[2] == 'S':
+            latitude = -latitude
+        longitude = self._longitude[0] * 1_000_000 + round(self._longitude[1] * 1_000_000 / 60)
+        if self._longitude[2] == 'W':
+            longitude = -longitude
+
+        fix.latitude_udeg = latitude
+        fix.longitude_udeg = longitude
+        fix.latitude = latitude / 1_000_000
+        fix.longitude = longitude / 1_000_000
+        fix.speed = self.speed[2]
+        fix.course = self.course
+        fix.altitude = self.altitude
+
+    def get_fix(self):
+        """
+        Returns the current position and motion as numbers, without any string formatting.
+        The same GPSFix object is returned (and updated in place) on every call, copy the values that must be kept
+        :return: GPSFix
+        """
+        return self.fix
+
     def compass_direction(self):
         """
         Determine a cardinal or inter-cardinal direction based on current course.
@@ -846,6 +1042,25 @@ class MicropyGPS(object):
             minutes = "0" + minutes
         return hours + ':' + minutes
 
+class GPSFix(object):
+    """Numeric snapshot of the current fix. Preallocated by MicropyGPS and updated in place"""
+
+    def __init__(self):
+        self.valid = False
+        self.latitude_udeg = 0      # Microdegrees, negative for S
+        self.longitude_udeg = 0     # Microdegrees, negative for W
+        self.latitude = 0.0         # Decimal degrees
+        self.longitude = 0.0        # Decimal degrees
+        self.speed = 0.0            # km/h
+        self.course = 0.0
+        self.altitude = 0.0
+
+def format_coordinate(udeg):
+    # Format microdegrees as a decimal degrees string with 6 decimal places, without going through a float
+    sign = '-' if udeg < 0 else ''
+    udeg = abs(udeg)
+    return sign + str(udeg // 1_000_000) + '.' + '{0:06d}'.format(udeg % 1_000_000)
+
 def convert_coordinates(sections):
     if sections[0] == 0:  # sections[0] contains the degrees
         return None
@@ -864,33 +1079,67 @@ def convert_coordinates(sections):
     
 
 def get_data (gps, gps_module, speed_unit='kph'):
+    # Returns the (latitude, longitude, speed, date, time) snapshot, or None without a fix, and whether it changed
+    # since the previous call. The snapshot is only rebuilt when a new RMC/GGA sentence was parsed
     length = gps_module.any()
     if length > 0:
         data = gps_module.read(length)
-        for byte in data:
-            message = gps.update(chr(byte))
+        message = gps.feed(data)
+
+    if gps.generation == gps.data_snapshot_generation and speed_unit == gps.data_snapshot_unit:
+        return gps.data_snapshot, False
+    gps.data_snapshot_generation = gps.generation
+    gps.data_snapshot_unit = speed_unit
 
-    latitude = convert_coordinates(gps.latitude)
-    longitude = convert_coordinates(gps.longitude)
+    fix = gps.get_fix()
     speed = (gps.speed[2] if speed_unit == 'kph' else gps.speed[1] if speed_unit == 'mph' else gps.speed[0])
     date = gps.date_string(formatting='s_dmy')
     time = gps.time_string()
 
-    if latitude is None or longitude is None or speed is None or date is None or time is None:
-        return None
-    return latitude, longitude, speed, date, time
+    if not fix.valid or speed is None or date is None or time is None:
+        gps.data_snapshot = None
+    else:
+        gps.data_snapshot = (fix.latitude, fix.longitude, speed, date, time)
+    return gps.data_snapshot, True
 
 # Test
 
-from machine import Pin, UART
+try:
+    from utime import ticks_us, ticks_diff
+except ImportError:
+    # CPython, so the benchmark also runs on a computer
+    def ticks_us():
+        return int(time.perf_counter() * 1_000_000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+def benchmark (data, sentences=None, chunk=256):
+    # Parse a recorded NMEA log with feed() and return the parsing rate (sentences/second)
+    gps = MicropyGPS(sentences=sentences)
+    start = ticks_us()
+    for i in range(0, len(data), chunk):
+        gps.feed(data[i:i+chunk])
+    elapsed = ticks_diff(ticks_us(), start)
+    return data.count(b'$') * 1_000_000 / elapsed
 
 if __name__ == "__main__":
+    from machine import Pin, UART
 
     # Initialize GPS module
     gps_module = UART(1, baudrate=9600, tx=Pin(8), rx=Pin(9))
     time_zone = -3
     gps = MicropyGPS(time_zone)
 
+    # Record a few seconds of NMEA output and compare parsing all sentences vs only RMC and GGA
+    log = b''
+    t_log = utime.ticks_ms()
+    while utime.ticks_diff(utime.ticks_ms(), t_log) < 5000:
+        if gps_module.any():
+            log += gps_module.read(gps_module.any())
+    print('All sentences: ' + str(round(benchmark(log))) + ' sentences/s')
+    print('RMC and GGA: ' + str(round(benchmark(log, ('RMC', 'GGA')))) + ' sentences/s')
+
     # def convert_coordinates(sections):
     #     if sections[0] == 0:  # sections[0] contains the degrees
     #         return None
@@ -913,16 +1162,14 @@ if __name__ == "__main__":
         length = gps_module.any()
         if length > 0:
             data = gps_module.read(length)
-            for byte in data:
-                message = gps.update(chr(byte))
+            message = gps.feed(data)
         
-        latitude = convert_coordinates(gps.latitude)
-        longitude = convert_coordinates(gps.longitude)
+        fix = gps.get_fix()
 
-        if latitude is None or longitude is None:
+        if not fix.valid:
             continue
-        print('Lat: ' + latitude)
-        print('Lon: ' + longitude)
+        print('Lat: ' + format_coordinate(fix.latitude_udeg))
+        print('Lon: ' + format_coordinate(fix.longitude_udeg))
         print('Speed: ' + str(gps.speed[2]) + ' km/h')
         print(gps.date_string(formatting='s_dmy'))
         print(gps.time_string())
@@ -0,0 +1,203 @@
+'''
+MicroPython module to keep an index of the rides saved on the SD card.
+The index (rides.json) holds the next ride id and an entry per ride (id, file name, size, summary, sync status), so
+saving a ride or listing the unsynced ones doesn't scan and parse the whole directory. It is rewritten on every
+change through a temporary file and a rename, a power loss leaves either the old or the new index. A sync session marks
+its rides synced without saving and saves once at the end, the files of the synced rides are only deleted once the
+index saying so is saved.
+Rides are saved as binary ride files (ride_N.bin, see track_format), text ride files (data_N.txt) saved by older
+firmware are still listed and synced.
+'''
+
+import uos
+import ujson as json
+import track_format
+
+INDEX = 'rides.json'
+INDEX_TMP = 'rides.tmp'
+SUMMARY_FIELDS = 8      # Start date, start time, finish date, finish time, elapsed time, distance, max speed, calories
+
+
+class RideIndex:
+    def __init__(self, root='/sd', history=20):
+        # history: number of synced rides kept in the index (their files are deleted)
+        self.root = root
+        self.history = history
+        self.next_id = 1
+        self.rides = []
+        self.unsynced_count = 0
+        self._synced_files = []     # Files of the rides marked synced since the last save, deleted after it
+        self.discarded = []         # Unfinished ride files deleted by the last rebuild()
+
+    def _path(self, name):
+        return self.root + '/' + name
+
+    def load(self):
+        # Read the index, falling back to the temporary copy of an interrupted save, or rebuild it from the ride files
+        # found on the card (first boot with an older card)
+        self._synced_files = []
+        for name in (INDEX, INDEX_TMP):
+            try:
+                with open(self._path(name), 'r') as f:
+                    index = json.load(f)
+                self.next_id = index['next_id']
+                self.rides = index['rides']
+                self._count()
+                return
+            except (OSError, ValueError, KeyError):
+                pass
+        self.rebuild()
+
+    def rebuild(self):
+        # Ride files cut short by a power loss while saving are deleted (listed in discarded): their track is still in
+        # the track file, and the ride is saved again after the recovery (see Storage.recover())
+        self.next_id = 1
+        self.rides = []
+        self.discarded = []
+        for file in list(uos.ilistdir(self.root)):
+            name = file[0]
+            if name.startswith('ride_') and name.endswith('.bin'):
+                ride_id = int(name[5:-4])
+                with open(self._path(name), 'rb') as f:
+                    header = f.read(track_format.HEADER_SIZE)
+                try:
+                    summary, _, track_size, _ = track_format.decode_header(header)
+                except ValueError:
+                    if len(header) == track_format.HEADER_SIZE and track_format.is_ride_file(header):
+                        self.next_id = max(self.next_id, ride_id + 1)
+                        continue    # Another version, left alone
+                    track_size = None
+                if track_size is None or (len(file) > 3 and file[3] < track_format.HEADER_SIZE + track_size):
+                    uos.remove(self._path(name))
+                    self.discarded.append(name)
+                    continue
+            elif name.startswith('data_') and name.endswith('.txt'):
+                ride_id = int(name[5:-4])
+                with open(self._path(name), 'r') as f:
+                    summary = f.read().split('\n')[:SUMMARY_FIELDS]
+            else:
+                continue
+            self.rides.append({'id': ride_id, 'file': name, 'size': file[3] if len(file) > 3 else 0,
+                               'summary': summary, 'synced': False})
+            self.next_id = max(self.next_id, ride_id + 1)
+        self.rides.sort(key=lambda ride: ride['id'])
+        self._count()
+        self.save()
+
+    def _count(self):
+        self.unsynced_count = 0
+        for ride in self.rides:
+            if not ride['synced']:
+                self.unsynced_count += 1
+
+    def save(self):
+        with open(self._path(INDEX_TMP), 'w') as f:
+            json.dump({'next_id': self.next_id, 'rides': self.rides}, f)
+        uos.rename(self._path(INDEX_TMP), self._path(INDEX))
+        while self._synced_files:
+            try:
+                uos.remove(self._path(self._synced_files.pop()))
+            except OSError:
+                pass
+
+    def add(self, summary, track=None, buffer=None, points=0, track_size=None):
+        # Save a ride to its own file and add it to the index. Returns its entry. summary is the list of the summary
+        # lines, track the path of the track file recorded during the ride (points points, its first track_size
+        # bytes, by default the whole file), copied after the header through buffer (a bytearray) and deleted once the
+        # index is saved, so an interrupted add can be run again
+        ride_id = self.next_id
+        name = 'ride_' + str(ride_id) + '.bin'
+        if track is None:
+            track_size = 0
+        elif track_size is None:
+            track_size = uos.stat(track)[6]
+        with open(self._path(name), 'wb') as f:
+            f.write(track_format.encode_header(summary, points, track_size))
+            if track is not None:
+                self._copy(track, f, buffer, track_size)
+        ride = {'id': ride_id, 'file': name, 'size': track_format.HEADER_SIZE + track_size,
+                'summary': summary[:SUMMARY_FIELDS], 'synced': False}
+        self.rides.append(ride)
+        self.next_id = ride_id + 1
+        self.unsynced_count += 1
+        self.save()
+        if track is not None:
+            uos.remove(track)
+        return ride
+
+    def _copy(self, path, f, buffer, size):
+        # Append the first size bytes of the file at path to f, one buffer at a time
+        bufmv = memoryview(buffer)
+        with open(path, 'rb') as src:
+            while size > 0:
+                n = src.readinto(bufmv[:min(size, len(buffer))])
+                if not n:
+                    return
+                f.write(bufmv[:n])
+                size -= n
+
+    def find(self, ride_id):
+        # Entry of the ride ride_id, or None
+        for ride in self.rides:
+            if ride['id'] == ride_id:
+                return ride
+        return None
+
+    def unsynced(self):
+        return [ride for ride in self.rides if not ride['synced']]
+
+    def open(self, ride):
+        # Ride file, opened to be read a chunk at a time
+        return open(self._path(ride['file']), 'rb')
+
+    def read(self, ride):
+        # Contents of a ride file (bytes)
+        with open(self._path(ride['file']), 'rb') as f:
+            return f.read()
+
+    def mark_synced(self, ride, save=True):
+        # The ride was sent to the phone: delete its file, keep its summary among the last synced rides. Without save
+        # both wait for the next save(), one for a whole sync session
+        if ride['synced']:
+            return
+        self._synced_files.append(ride['file'])
+        ride['synced'] = True
+        self.unsynced_count -= 1
+        synced = [r for r in self.rides if r['synced']]
+        for r in synced[:max(0, len(synced) - self.history)]:
+            self.rides.remove(r)
+        if save:
+            self.save()
+
+    def clear(self):
+        # Delete every ride file and empty the index
+        for ride in self.rides:
+            if not ride['synced']:
+                try:
+                    uos.remove(self._path(ride['file']))
+                except OSError:
+                    pass
+        self.rides = []
+        self.unsynced_count = 0
+        self.next_id = 1
+        self.save()
+
+# Test
+
+if __name__ == '__main__':
+    from machine import Pin, SPI
+    import sdcard
+    import time
+
+    spi = SPI(0, baudrate=1000000, polarity=0, phase=0, bits=8, firstbit=SPI.MSB, sck=Pin(6), mosi=Pin(7), miso=Pin(4))
+    vfs = uos.VfsFat(sdcard.SDCard(spi, Pin(5, Pin.OUT)))
+    uos.mount(vfs, '/sd')
+
+    index = RideIndex('/sd')
+    start = time.ticks_ms()
+    index.load()
+    print('Load: ' + str(time.ticks_diff(time.ticks_ms(), start)) + ' ms, ' + str(index.unsynced_count) + ' unsynced')
+    start = time.ticks_ms()
+    ride = index.add(['01/01/24', '10:00', '01/01/24', '11:00', '01:00:00', '20000', '35.0', '600.0'])
+    print('Save: ' + str(time.ticks_diff(time.ticks_ms(), start)) + ' ms, ride ' + str(ride['id']))
+    uos.umount('/sd')
@@ -0,0 +1,146 @@
+'''
+MicroPython module to checkpoint the ride in progress, so it survives a power loss.
+The journal file holds two 512 byte slots, written in turn: each checkpoint is a single block write, and a power loss
+while writing one leaves the other intact. Each slot has a sequence number and a CRC, the newest valid one wins.
+A checkpoint holds the ride accumulators and where the track recorded so far ends (see RideRecorder.sync()), the
+journal is deleted once the ride is saved, so finding one at boot means a ride was interrupted. Before the ride is
+added to the index the journal is marked with its ride id, so a power loss while saving doesn't save it twice.
+'''
+
+import struct
+import time
+import uos
+from binascii import crc32
+
+JOURNAL = 'ride.jnl'
+BLOCK = 512
+MAGIC = b'BBJ'
+VERSION = 2
+
+# Magic, version, sequence, start date, start time, ride seconds, distance (km), max speed (km/h), calories (kcal),
+# track points, track size (bytes), last point as encoded (microdegrees, microdegrees, seconds, 0.1 km/h), paused,
+# id of the ride being saved (0 while recording)
+CHECKPOINT = '<3sBI8s5sIfffIIiiIiBI'
+CHECKPOINT_SIZE = struct.calcsize(CHECKPOINT)
+
+
+class RideJournal:
+    def __init__(self, root='/sd'):
+        self.path = root + '/' + JOURNAL
+        self.block = bytearray(BLOCK)
+        self._blockmv = memoryview(self.block)
+        self._file = None
+        self.sequence = 0
+        self._fields = None     # Fields of the last checkpoint, after the sequence
+
+        # Statistics
+        self.checkpoints = 0
+        self.checkpoint_us_total = 0
+        self.checkpoint_us_max = 0
+
+    def start(self):
+        # New ride: empty journal, both slots allocated now so a checkpoint never grows the file
+        self.close()
+        self._file = open(self.path, 'wb')
+        for i in range(BLOCK):
+            self.block[i] = 0
+        self._file.write(self.block)
+        self._file.write(self.block)
+        self._file.flush()
+        self.sequence = 0
+        self._fields = None
+
+    def write(self, start_date, start_time, seconds, distance, max_speed, calories, points, track_size, last_point,
+              paused=False):
+        self._write((start_date.encode(), start_time.encode(), seconds, distance, max_speed, calories, points,
+                     track_size, last_point[0], last_point[1], last_point[2], last_point[3], paused, 0))
+
+    def mark_saved(self, ride_id):
+        # The last checkpoint again, marked as being saved as ride ride_id (see Storage.recover())
+        self._write(self._fields[:-1] + (ride_id,))
+
+    def _write(self, fields):
+        t_start = time.ticks_us()
+        self.sequence += 1
+        struct.pack_into(CHECKPOINT, self.block, 0, MAGIC, VERSION, self.sequence, *fields)
+        struct.pack_into('<I', self.block, CHECKPOINT_SIZE, crc32(self._blockmv[:CHECKPOINT_SIZE]) & 0xffffffff)
+        self._fields = fields
+        if self._file is None:
+            # Reopened after an error (the card was mounted again) or after a recovery
+            self._file = open(self.path, 'r+b')
+        try:
+            self._file.seek((self.sequence & 1) * BLOCK)
+            self._file.write(self.block)
+            self._file.flush()
+        except OSError:
+            self.close()
+            raise
+        elapsed = time.ticks_diff(time.ticks_us(), t_start)
+        self.checkpoints += 1
+        self.checkpoint_us_total += elapsed
+        self.checkpoint_us_max = max(self.checkpoint_us_max, elapsed)
+
+    def read(self):
+        # Newest valid checkpoint, as a dict, or None without a journal (no ride was interrupted)
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read(2 * BLOCK)
+        except OSError:
+            return None
+        newest = None
+        for offset in range(0, len(data) - CHECKPOINT_SIZE - 3, BLOCK):
+            slot = memoryview(data)[offset:offset + CHECKPOINT_SIZE + 4]
+            if bytes(slot[:3]) != MAGIC or slot[3] != VERSION:
+                continue
+            if struct.unpack_from('<I', slot, CHECKPOINT_SIZE)[0] != crc32(slot[:CHECKPOINT_SIZE]) & 0xffffffff:
+                continue
+            fields = struct.unpack_from(CHECKPOINT, slot)
+            if newest is None or fields[2] > newest[2]:
+                newest = fields
+        if newest is None:
+            return None
+        self.sequence = newest[2]
+        self._fields = newest[3:]
+        return {'start_date': newest[3].decode().rstrip('\x00'), 'start_time': newest[4].decode().rstrip('\x00'),
+                'seconds': newest[5], 'distance': newest[6], 'max_speed': newest[7], 'calories': newest[8],
+                'points': newest[9], 'track_size': newest[10], 'last_point': newest[11:15],
+                'paused': bool(newest[15]), 'saved_id': newest[16]}
+
+    def clear(self):
+        self.close()
+        self.sequence = 0
+        self._fields = None
+        try:
+            uos.remove(self.path)
+        except OSError:
+            pass
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def report(self):
+        mean = self.checkpoint_us_total // self.checkpoints if self.checkpoints else 0
+        return ('journal: ' + str(self.checkpoints) + ' checkpoints, mean ' + str(mean) + ' us, max ' +
+                str(self.checkpoint_us_max) + ' us')
+
+# Test
+
+if __name__ == '__main__':
+    from machine import Pin, SPI
+    import sdcard
+
+    spi = SPI(0, baudrate=1000000, polarity=0, phase=0, bits=8, firstbit=SPI.MSB, sck=Pin(6), mosi=Pin(7), miso=Pin(4))
+    uos.mount(uos.VfsFat(sdcard.SDCard(spi, Pin(5, Pin.OUT))), '/sd')
+    journal = RideJournal('/sd')
+    journal.start()
+    for i in range(100):
+        journal.write('01/01/24', '10:00', i * 30, i * 0.2, 35.0, i * 7.5, i * 3, i * 18, (-25400000, -49200000, i, 250))
+    print(journal.report())
+    print(journal.read())
+    journal.clear()
+    uos.umount('/sd')
@@ -0,0 +1,175 @@
+'''
+MicroPython module to log the track of a ride to the SD card while riding.
+Points are appended to a track file through a fixed write buffer that is written out in whole 512 byte blocks (the
+SD card block size, so every write fills complete sectors), memory use doesn't depend on the length of the ride.
+Points are binary encoded (see track_format). When the ride stops the ride index copies the track, behind its
+summary, into the ride file.
+'''
+
+import time
+from track_format import TrackEncoder
+
+BLOCK = 512
+TRACK = 'track.tmp'
+
+
+class RideRecorder:
+    def __init__(self, root='/sd', buffer_size=BLOCK):
+        self.path = root + '/' + TRACK
+        self.buffer = bytearray(buffer_size)
+        self._bufmv = memoryview(self.buffer)
+        self._len = 0
+        self._file = None
+        self.encoder = TrackEncoder()
+        self.recording = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.points = 0
+        self.bytes_written = 0
+        self.flushes = 0
+        self.flush_us_total = 0
+        self.flush_us_max = 0
+
+    def start(self):
+        # New track, replacing whatever was left of a previous one
+        self.close()
+        self._file = open(self.path, 'wb')
+        self._len = 0
+        self.encoder.reset()
+        self.recording = True
+        self.reset_stats()
+
+    def resume(self, track_size, points, last_point):
+        # Carry on recording an interrupted track, from its last checkpoint: whatever was written after it is
+        # overwritten. The last partial block is read back into the buffer, so writes stay block aligned
+        self.close()
+        self.reset_stats()
+        self._len = track_size % len(self.buffer)
+        self.bytes_written = track_size - self._len
+        self._file = open(self.path, 'r+b')
+        self._file.seek(self.bytes_written)
+        if self._len:
+            self._file.readinto(self._bufmv[:self._len])
+            self._file.seek(self.bytes_written)
+        self.encoder.resume(points, last_point)
+        self.points = points
+        self.recording = True
+
+    def add_point(self, t, lat, lon, speed):
+        # Add a track point (time of day in seconds, degrees, km/h)
+        self.append(self.encoder.encode(t, lat, lon, speed))
+        self.encoder.commit()
+
+    def append(self, data):
+        # Add a point (bytes). Either the whole point is buffered or, if a flush fails (OSError), nothing changes and
+        # it can be appended again
+        n = len(data)
+        free = len(self.buffer) - self._len
+        if n < free:
+            self._bufmv[self._len:self._len + n] = data
+            self._len += n
+        else:
+            self._bufmv[self._len:] = data[:free]
+            length = self._len
+            self._len = len(self.buffer)
+            try:
+                self._write()
+            except OSError:
+                self._len = length
+                raise
+            self._len = n - free
+            self._bufmv[:self._len] = data[free:]
+        self.points += 1
+
+    def _write(self):
+        t_start = time.ticks_us()
+        if self._file is None:
+            # Reopened after an error (the card was mounted again)
+            self._file = open(self.path, 'r+b')
+            self._file.seek(self.bytes_written)
+        try:
+            self._file.write(self._bufmv[:self._len])
+            self._file.flush()
+        except OSError:
+            self.close()
+            raise
+        elapsed = time.ticks_diff(time.ticks_us(), t_start)
+        self.bytes_written += self._len
+        self.flushes += 1
+        self.flush_us_total += elapsed
+        self.flush_us_max = max(self.flush_us_max, elapsed)
+        self._len = 0
+
+    def sync(self):
+        # Write the partial block too, so every point recorded so far is on the card (for a checkpoint), without
+        # consuming it: the next write rewrites that block in full. Returns the size of the track
+        if self._len:
+            self._write_partial()
+        return self.size()
+
+    def _write_partial(self):
+        if self._file is None:
+            self._file = open(self.path, 'r+b')
+        try:
+            self._file.seek(self.bytes_written)
+            self._file.write(self._bufmv[:self._len])
+            self._file.flush()
+            self._file.seek(self.bytes_written)
+        except OSError:
+            self.close()
+            raise
+
+    def size(self):
+        # Size of the track recorded so far
+        return self.bytes_written + self._len
+
+    def finish(self):
+        # Write out the last partial block and close the track. Returns its path, its size is then bytes_written (the
+        # file may be longer, after a resume)
+        if self._len:
+            self._write()
+        self.close()
+        self.recording = False
+        return self.path
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def report(self):
+        mean = self.flush_us_total // self.flushes if self.flushes else 0
+        return ('track: ' + str(self.points) + ' points, ' + str(self.bytes_written) + ' bytes, ' + str(self.flushes) +
+                ' flushes, mean ' + str(mean) + ' us, max ' + str(self.flush_us_max) + ' us')
+
+# Test
+
+import gc
+
+def recorder_benchmark (root='/sd', points=5000):
+    # Record a long track: the free heap must not shrink with the number of points
+    recorder = RideRecorder(root)
+    recorder.start()
+    gc.collect()
+    free = gc.mem_free()
+    for i in range(points):
+        recorder.add_point(36000 + i * 10, -25.4 + i * 1e-4, -49.2 - i * 1e-4, 25.0)
+    gc.collect()
+    print('Heap used by ' + str(points) + ' points: ' + str(free - gc.mem_free()) + ' bytes')
+    recorder.finish()
+    print(recorder.report())
+
+if __name__ == '__main__':
+    from machine import Pin, SPI
+    import uos
+    import sdcard
+
+    spi = SPI(0, baudrate=1000000, polarity=0, phase=0, bits=8, firstbit=SPI.MSB, sck=Pin(6), mosi=Pin(7), miso=Pin(4))
+    uos.mount(uos.VfsFat(sdcard.SDCard(spi, Pin(5, Pin.OUT))), '/sd')
+    recorder_benchmark('/sd')
+    uos.remove('/sd/' + TRACK)
+    uos.umount('/sd')
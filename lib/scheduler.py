@@ -0,0 +1,148 @@
+'''
+MicroPython module to run periodic jobs from a list of deadlines sorted by due time.
+All the arithmetic uses ticks_diff/ticks_add, so it keeps working when time.ticks_ms() wraps around, and the loop
+sleeps until the next deadline instead of spinning. Each job keeps statistics on how late it actually runs.
+'''
+
+import time
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+
+class Job:
+    def __init__(self, name, period_ms, callback, deadline, catch_up=False):
+        self.name = name
+        self.period_ms = period_ms
+        self.callback = callback
+        self.deadline = deadline
+        self.catch_up = catch_up    # Run every missed period (counters) instead of skipping to the next one
+
+        # Statistics
+        self.runs = 0
+        self.late = 0           # Runs started more than the scheduler's late_ms after their deadline
+        self.max_late_ms = 0
+        self.skipped = 0        # Periods dropped because the job fell more than a period behind
+        self._first_start = None
+        self._last_start = None
+
+    def mean_period_ms(self):
+        # Mean time between two runs
+        if self.runs < 2:
+            return 0
+        return time.ticks_diff(self._last_start, self._first_start) / (self.runs - 1)
+
+    def reset_stats(self):
+        self.runs = 0
+        self.late = 0
+        self.max_late_ms = 0
+        self.skipped = 0
+        self._first_start = None
+        self._last_start = None
+
+
+class Scheduler:
+    def __init__(self, late_ms=10):
+        self.late_ms = late_ms
+        self.jobs = []      # Sorted by deadline, the next job due first
+
+    def add(self, name, period_ms, callback, delay_ms=None, catch_up=False):
+        # Run callback() every period_ms, the first time after delay_ms (default one period)
+        if delay_ms is None:
+            delay_ms = period_ms
+        job = Job(name, period_ms, callback, time.ticks_add(time.ticks_ms(), delay_ms), catch_up)
+        self._insert(job)
+        return job
+
+    def remove(self, job):
+        if job in self.jobs:
+            self.jobs.remove(job)
+
+    def _insert(self, job):
+        i = 0
+        while i < len(self.jobs) and time.ticks_diff(self.jobs[i].deadline, job.deadline) <= 0:
+            i += 1
+        self.jobs.insert(i, job)
+
+    def next_delay(self, now=None):
+        # Milliseconds until the next deadline, 0 if a job is already due, None if there are no jobs
+        if not self.jobs:
+            return None
+        if now is None:
+            now = time.ticks_ms()
+        return max(0, time.ticks_diff(self.jobs[0].deadline, now))
+
+    def run_pending(self, now=None):
+        # Run every job whose deadline has passed. Returns the number of jobs run
+        if now is None:
+            now = time.ticks_ms()
+        count = 0
+        while self.jobs and time.ticks_diff(now, self.jobs[0].deadline) >= 0:
+            job = self.jobs.pop(0)
+            lateness = time.ticks_diff(now, job.deadline)
+            if lateness > self.late_ms:
+                job.late += 1
+            if lateness > job.max_late_ms:
+                job.max_late_ms = lateness
+            if job._first_start is None:
+                job._first_start = now
+            job._last_start = now
+            job.runs += 1
+
+            # Next deadline is a whole period after this one (no drift), unless the job fell behind and doesn't
+            # catch up: then the missed periods are dropped
+            job.deadline = time.ticks_add(job.deadline, job.period_ms)
+            if not job.catch_up and time.ticks_diff(now, job.deadline) >= 0:
+                missed = time.ticks_diff(now, job.deadline) // job.period_ms + 1
+                job.skipped += missed
+                job.deadline = time.ticks_add(job.deadline, missed * job.period_ms)
+            self._insert(job)
+
+            job.callback()
+            count += 1
+            now = time.ticks_ms()
+        return count
+
+    async def run(self):
+        # Scheduler loop for asyncio: sleep until the next deadline, then run the due jobs
+        while True:
+            delay = self.next_delay()
+            await asyncio.sleep((delay if delay is not None else self.late_ms) / 1000)
+            self.run_pending()
+
+    def report(self):
+        # One line of statistics per job
+        lines = []
+        for job in sorted(self.jobs, key=lambda job: job.name):
+            lines.append(job.name + ': runs ' + str(job.runs) + ', late ' + str(job.late) + ', max late ' +
+                         str(job.max_late_ms) + ' ms, skipped ' + str(job.skipped) + ', mean period ' +
+                         str(round(job.mean_period_ms(), 1)) + ' ms')
+        return '\n'.join(lines)
+
+    def reset_stats(self):
+        for job in self.jobs:
+            job.reset_stats()
+
+# Test
+
+if __name__ == '__main__':
+    scheduler = Scheduler()
+    counter = [0]
+
+    def fast():
+        counter[0] += 1
+
+    def slow():
+        # Blocks like a DHT11 read or an SD write
+        time.sleep_ms(120)
+
+    scheduler.add('fast 20 ms', 20, fast)
+    scheduler.add('second', 1000, lambda: None, catch_up=True)
+    scheduler.add('slow 500 ms', 500, slow)
+
+    t_end = time.ticks_add(time.ticks_ms(), 5000)
+    while time.ticks_diff(t_end, time.ticks_ms()) > 0:
+        time.sleep_ms(scheduler.next_delay())
+        scheduler.run_pending()
+    print(scheduler.report())
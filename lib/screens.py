@@ -0,0 +1,111 @@
+'''
+MicroPython module with the screens of the firmware, one render function (lcd_*) per screen.
+Screens are built from widgets: static labels are drawn once, fields only redraw when their value changes. The display
+manager calls a render function with the values shown (its model) whenever they change.
+'''
+
+import widgets
+import bigfont
+
+
+def chronometer_str (chronometer):
+    hours = str(chronometer[0])
+    minutes = str(chronometer[1])
+    seconds = str(chronometer[2])
+    if len(hours) == 1:
+        hours = "0" + hours
+    if len(minutes) == 1:
+        minutes = "0" + minutes
+    if len(seconds) == 1:
+        seconds = "0" + seconds
+    return hours + ":" + minutes + ":" + seconds
+
+DEGREE = (0b11100000, 0b10100000, 0b11100000)
+
+def dist_str (dist):
+    if dist >= 1.0:
+        return str(dist) + 'km'
+    return str(round(dist*1000)) + 'm'
+
+NO_INFO_BLE = widgets.Field(0, 50, 13)
+NO_INFO = widgets.Screen((widgets.Label(0, 0, 'No user data'), widgets.Label(0, 10, 'Please send data'), NO_INFO_BLE))
+
+IDLE_LINES = (widgets.Field(0, 20, 16), widgets.Field(0, 30, 16), widgets.Field(0, 40, 16))
+IDLE_GPS = widgets.Field(0, 50, 16)
+IDLE = widgets.Screen((widgets.Label(0, 0, 'Press button'), widgets.Label(0, 10, 'to start')) + IDLE_LINES + (IDLE_GPS,))
+
+SENDING_DONE = widgets.Field(0, 30, 4)
+SENDING = widgets.Screen((widgets.Label(0, 0, 'Syncing data'), widgets.Label(0, 10, 'Please wait'), widgets.Label(0, 20, '...'), SENDING_DONE))
+
+# Speed in large digits, readable while riding
+BIG_FONT = bigfont.BigFont()
+RUNNING_TIME = widgets.Field(0, 0, 5)
+RUNNING_DATE = widgets.Field(48, 0, 10)
+RUNNING_CHRONO = widgets.Field(0, 10, 8, lambda chronometer: chronometer_str(chronometer))
+RUNNING_TEMP = widgets.Field(88, 10, 2)
+RUNNING_SPEED = widgets.BigField(0, 20, 72, BIG_FONT)
+RUNNING_SIGNAL = widgets.Field(80, 20, 6)
+RUNNING_DIST = widgets.Field(48, 46, 10, dist_str)
+RUNNING_CAL = widgets.Field(40, 56, 11, '{}kcal')
+RUNNING = widgets.Screen((RUNNING_TIME, RUNNING_DATE, RUNNING_CHRONO, RUNNING_TEMP, widgets.Icon(104, 9, 3, 3, DEGREE),
+                          widgets.Label(110, 10, 'C'), RUNNING_SPEED, RUNNING_SIGNAL, widgets.Label(80, 36, 'km/h'),
+                          widgets.Label(0, 46, 'dist: '), RUNNING_DIST, widgets.Label(0, 56, 'cal: '), RUNNING_CAL))
+
+SAVING_ERROR = (widgets.Field(0, 10, 12), widgets.Field(0, 20, 11))
+SAVING = widgets.Screen((widgets.Label(0, 0, 'Saving...'),) + SAVING_ERROR)
+
+ALARM_GPS = widgets.Field(0, 10, 13)
+ALARM = widgets.Screen((widgets.Label(0, 0, 'Alarm on'), ALARM_GPS))
+
+# Speed and altitude over the last minutes (GRAPH_MINUTES in main.py, one column per sample)
+GRAPH_SPEED = widgets.Field(0, 0, 16, 'speed max {}')
+SPEED_GRAPH = widgets.Graph(0, 8, 128, 22, 10)
+GRAPH_ALTITUDE = widgets.Field(0, 33, 16, lambda altitude: 'alt ' + str(altitude[0]) + '-' + str(altitude[1]) + 'm')
+ALTITUDE_GRAPH = widgets.Graph(0, 41, 128, 23, 10)
+GRAPH = widgets.Screen((GRAPH_SPEED, SPEED_GRAPH, GRAPH_ALTITUDE, ALTITUDE_GRAPH))
+
+def lcd_no_info (lcd, ble_connected):
+    NO_INFO_BLE.set('Bluetooth on' if ble_connected else 'Bluetooth off')
+    NO_INFO.show(lcd)
+
+def lcd_idle (lcd, data_synced, ble_connected, gps_connected):
+    if data_synced:
+        lines = ('Data synced', '', '')
+    elif not ble_connected:
+        lines = ('Unsynced data', 'Please connect', 'to phone')
+    else:
+        lines = ('', '', '')
+    for field, line in zip(IDLE_LINES, lines):
+        field.set(line)
+    IDLE_GPS.set('' if gps_connected else 'No GPS signal')
+    IDLE.show(lcd)
+
+def lcd_sending (lcd, synced):
+    SENDING_DONE.set('Done' if synced else '')
+    SENDING.show(lcd)
+
+def lcd_running_paused (lcd, speed, chronometer, date, current_time, calories, temp, dist, gps_connected):
+    RUNNING_TIME.set(current_time)
+    RUNNING_DATE.set(date)
+    RUNNING_CHRONO.set(chronometer)
+    RUNNING_DIST.set(dist)
+    RUNNING_CAL.set(calories)
+    RUNNING_SPEED.set(speed)
+    RUNNING_TEMP.set(temp)
+    RUNNING_SIGNAL.set('' if gps_connected else 'No GPS')
+    RUNNING.show(lcd)
+
+def lcd_graph (lcd, samples):
+    # samples (number of samples pushed) only tells the display manager the graphs changed
+    GRAPH_SPEED.set(round(SPEED_GRAPH.trend.max))
+    GRAPH_ALTITUDE.set((round(ALTITUDE_GRAPH.trend.min), round(ALTITUDE_GRAPH.trend.max)))
+    GRAPH.show(lcd)
+
+def lcd_saving (lcd, error):
+    SAVING_ERROR[0].set('Error saving' if error else '')
+    SAVING_ERROR[1].set('Please wait' if error else '')
+    SAVING.show(lcd)
+
+def lcd_alarm (lcd, gps_connected):
+    ALARM_GPS.set('GPS signal OK' if gps_connected else 'No GPS signal')
+    ALARM.show(lcd)
@@ -1,6 +1,8 @@
 '''
 MicroPython module to manage the microSD card, using SPI interface.
 Original source: https://github.com/micropython/micropython-lib/blob/master/micropython/drivers/storage/sdcard/sdcard.py
+Changes: optional high speed clock, the fastest of the given rates at which reads check out (same data as at the
+initialisation rate, valid CRC) is used, and reads poll for the start token without sleeping.
 '''
 
 
@@ -31,6 +33,9 @@ import time
  
  
 _CMD_TIMEOUT = const(10000)
+_READ_TIMEOUT_MS = const(100)   # Maximum read access time of SD cards
+_VERIFY_READS = const(4)
+_THROUGHPUT_BLOCKS = const(16)
  
 _R1_IDLE_STATE = const(1 << 0)
 # R1_ERASE_RESET = const(1 << 1)
@@ -44,14 +49,37 @@ _TOKEN_STOP_TRAN = const(0xFD)
 _TOKEN_DATA = const(0xFE)
  
  
+_crc_table = None
+ 
+def crc16 (data):
+    # CRC-16-CCITT (polynomial 0x1021, initial value 0), as sent by the card after each data block
+    global _crc_table
+    if _crc_table is None:
+        _crc_table = []
+        for i in range(256):
+            crc = i << 8
+            for _ in range(8):
+                crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+            _crc_table.append(crc & 0xFFFF)
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ _crc_table[(crc >> 8) ^ byte]
+    return crc
+ 
+ 
 class SDCard:
-    def __init__(self, spi, cs, baudrate=1320000):
+    def __init__(self, spi, cs, baudrate=1320000, rates=None):
+        # rates: higher clock rates to try, fastest first, after the initialisation at baudrate
         self.spi = spi
         self.cs = cs
+        self.rates = rates
+        self.baudrate = baudrate    # Clock rate in use
+        self.throughput = 0         # Single block reads, bytes/s, measured when the rate is chosen
  
         self.cmdbuf = bytearray(6)
         self.dummybuf = bytearray(512)
         self.tokenbuf = bytearray(1)
+        self.crcbuf = bytearray(2)
         for i in range(512):
             self.dummybuf[i] = 0xFF
         self.dummybuf_memoryview = memoryview(self.dummybuf)
@@ -70,6 +98,11 @@ class SDCard:
             self.spi.init(master, baudrate=baudrate, phase=0, polarity=0)
  
     def init_card(self, baudrate):
+        self._init_card(baudrate)
+        if self.rates:
+            self.select_rate(self.rates)
+ 
+    def _init_card(self, baudrate):
  
         # init CS pin
         self.cs.init(self.cs.OUT, value=1)
@@ -121,6 +154,54 @@ class SDCard:
  
         # set to high data rate now that it's initialised
         self.init_spi(baudrate)
+        self.baudrate = baudrate
+ 
+    def _read_checked(self, block_num, buf):
+        # Read a block, False if it failed or its CRC is wrong
+        try:
+            self.readblocks(block_num, buf)
+        except OSError:
+            return False
+        return crc16(buf) == (self.crcbuf[0] << 8 | self.crcbuf[1])
+ 
+    def select_rate(self, rates, block_num=0):
+        # Switch to the fastest of rates at which block_num reads back the same as at the current rate, with valid
+        # CRCs, else stay at the current rate. Returns the rate in use
+        reference = bytearray(512)
+        buf = bytearray(512)
+        if not self._read_checked(block_num, reference):
+            return self.baudrate
+        safe = self.baudrate
+        for rate in rates:
+            if rate <= safe:
+                continue
+            self.init_spi(rate)
+            for _ in range(_VERIFY_READS):
+                if not self._read_checked(block_num, buf) or buf != reference:
+                    break
+            else:
+                self.baudrate = rate
+                break
+            self._resync(safe, block_num, reference, buf)
+        self.throughput = self.measure_throughput(buf, block_num)
+        return self.baudrate
+ 
+    def _resync(self, baudrate, block_num, reference, buf):
+        # Back to baudrate after a rate failed. The card may have been left in the middle of a transfer or out of step
+        # with the host: stop any transfer (CMD12), then check that block_num reads back as reference again, else
+        # initialise the card from scratch
+        self.init_spi(baudrate)
+        self.cmd(12, 0, 0xFF, skip1=True)
+        if not self._read_checked(block_num, buf) or buf != reference:
+            self._init_card(baudrate)
+ 
+    def measure_throughput(self, buf, block_num=0):
+        # Single block reads (bytes/s), as the file system mostly does
+        t_start = time.ticks_us()
+        for i in range(_THROUGHPUT_BLOCKS):
+            self.readblocks(block_num + i, buf)
+        elapsed = time.ticks_diff(time.ticks_us(), t_start)
+        return _THROUGHPUT_BLOCKS * 512 * 1000000 // max(1, elapsed)
  
     def init_card_v1(self):
         for i in range(_CMD_TIMEOUT):
@@ -191,15 +272,15 @@ class SDCard:
     def readinto(self, buf):
         self.cs(0)
  
-        # read until start byte (0xff)
-        for i in range(_CMD_TIMEOUT):
+        # read until start byte (0xfe), polling without sleeping: the token usually comes within a few bytes
+        t_start = time.ticks_ms()
+        while True:
             self.spi.readinto(self.tokenbuf, 0xFF)
             if self.tokenbuf[0] == _TOKEN_DATA:
                 break
-            time.sleep_ms(1)
-        else:
-            self.cs(1)
-            raise OSError("timeout waiting for response")
+            if time.ticks_diff(time.ticks_ms(), t_start) > _READ_TIMEOUT_MS:
+                self.cs(1)
+                raise OSError("timeout waiting for response")
  
         # read data
         mv = self.dummybuf_memoryview
@@ -207,9 +288,8 @@ class SDCard:
             mv = mv[: len(buf)]
         self.spi.write_readinto(mv, buf)
  
-        # read checksum
-        self.spi.write(b"\xff")
-        self.spi.write(b"\xff")
+        # read checksum, checked when choosing the clock rate
+        self.spi.readinto(self.crcbuf, 0xFF)
  
         self.cs(1)
         self.spi.write(b"\xff")
@@ -321,8 +401,9 @@ if __name__ == '__main__':
                     mosi=machine.Pin(7),
                     miso=machine.Pin(4))
     
-    # Initialize SD card
-    sd = SDCard(spi, cs)
+    # Initialize SD card, at the fastest clock rate that works
+    sd = SDCard(spi, cs, rates=(25000000, 20000000, 10000000))
+    print("Clock: " + str(sd.baudrate) + " Hz, single block reads: " + str(sd.throughput // 1024) + " KB/s")
 
     # Mount filesystem
     vfs = uos.VfsFat(sd)
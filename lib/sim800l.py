@@ -6,17 +6,20 @@ Original source: https://github.com/basanovase/sim800/blob/main/sim800/core.py
 
 import machine
 import utime
+from uart_ring import UARTRingBuffer
 
 class SIM800:
     """
     Core class for handling communication with the SIM800 module.
     Includes basic functionalities to initialize, send commands, and read responses.
     """
-    def __init__(self, uart_id, uart_rx, uart_tx, baud=115200):
+    def __init__(self, uart_id, uart_rx, uart_tx, baud=115200, rx_buffer=0):
         """
         Initializes the UART connection with the SIM800 module.
+        With rx_buffer > 0, responses are received through an interrupt drained ring buffer of that size.
         """
         self.uart = machine.UART(uart_id, baudrate=baud, rx=uart_rx, tx=uart_tx)
+        self.rx = UARTRingBuffer(self.uart, rx_buffer, name='sim800l rx') if rx_buffer else self.uart
         self.initialize()
 
     def send_command(self, command, timeout=1000):
@@ -34,8 +37,8 @@ class SIM800:
         start_time = utime.ticks_ms()
         response = b''
         while (utime.ticks_diff(utime.ticks_ms(), start_time) < timeout):
-            if self.uart.any():
-                response += self.uart.read(self.uart.any())
+            if self.rx.any():
+                response += self.rx.read(self.rx.any())
         return response
 
     def initialize(self):
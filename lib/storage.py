@@ -0,0 +1,172 @@
+'''
+MicroPython module to manage the SD card as a service.
+The card is mounted once at boot and stays mounted, the ride index is kept in memory, so checking for unsynced rides
+does no I/O at all. Files are closed (and so flushed) after every write, which keeps the card consistent while mounted.
+If an operation fails (card removed and inserted again, bus glitch) the card is initialised and mounted again and the
+operation retried once. The track of the ride in progress is logged as it is recorded, see RideRecorder, and
+checkpointed with the ride accumulators, see RideJournal.
+'''
+
+import uos
+from ride_index import RideIndex
+from ride_recorder import RideRecorder
+from ride_journal import RideJournal
+
+
+class Storage:
+    def __init__(self, sd, mount_point='/sd', baudrate=1320000):
+        self.sd = sd
+        self.mount_point = mount_point
+        self.baudrate = baudrate
+        self.mounted = False
+        self.rides = RideIndex(mount_point)
+        self.recorder = RideRecorder(mount_point)
+        self.journal = RideJournal(mount_point)
+        self._track = None      # Track recorded for the next saved ride
+        self._start = ('', '')  # Start date and time of the ride in progress
+        self._save_id = None    # Id of the ride being saved, kept when the save is run again
+
+        # Statistics
+        self.mounts = 0
+        self.errors = 0
+
+    def mount(self):
+        if self.mounted:
+            return
+        uos.mount(uos.VfsFat(self.sd), self.mount_point)
+        self.mounted = True
+        self.mounts += 1
+
+    def unmount(self):
+        if self.mounted:
+            try:
+                uos.umount(self.mount_point)
+            except OSError:
+                pass
+            self.mounted = False
+
+    def remount(self):
+        # Start over: the card may have been replaced, so the index is read again too. The track file is reopened on the
+        # next write
+        self.recorder.close()
+        self.journal.close()
+        self.unmount()
+        self.sd.init_card(self.baudrate)
+        self.mount()
+        self.rides.load()
+
+    def _run(self, function, *args):
+        try:
+            self.mount()
+            return function(*args)
+        except OSError:
+            self.errors += 1
+            self.remount()
+            return function(*args)
+
+    def start(self):
+        # Mount the card and load the ride index
+        self._run(self.rides.load)
+
+    def is_empty(self):
+        # No unsynced rides, from the index in memory
+        return self.rides.unsynced_count == 0
+
+    def recover(self):
+        # Look for a ride interrupted by a power loss. Returns its last checkpoint (see RideJournal.read()), recording
+        # carries on after it, or None. A ride found in the index was saved before the power loss, only its journal
+        # was left behind
+        checkpoint = self._run(self.journal.read)
+        if checkpoint is None:
+            return None
+        if checkpoint['saved_id'] and self.rides.find(checkpoint['saved_id']) is not None:
+            self._run(self.journal.clear)
+            return None
+        self._start = (checkpoint['start_date'], checkpoint['start_time'])
+        try:
+            self._run(self.recorder.resume, checkpoint['track_size'], checkpoint['points'], checkpoint['last_point'])
+        except OSError:
+            self._run(self.recorder.start)  # Track lost, the ride is still saved
+        self._track = self.recorder.path
+        return checkpoint
+
+    def start_track(self, start_date, start_time):
+        self._run(self.recorder.start)
+        self._track = self.recorder.path
+        self._start = (start_date, start_time)
+        self._run(self.journal.start)
+        self.checkpoint(0, 0.0, 0.0, 0.0)
+
+    def checkpoint(self, seconds, distance, max_speed, calories, paused=False):
+        # Save the ride accumulators and every track point recorded so far, two block writes at most
+        if self.recorder.recording:
+            self._run(self._checkpoint, seconds, distance, max_speed, calories, paused)
+
+    def _checkpoint(self, seconds, distance, max_speed, calories, paused):
+        track_size = self.recorder.sync()
+        self.journal.write(self._start[0], self._start[1], seconds, distance, max_speed, calories, self.recorder.points,
+                           track_size, self.recorder.encoder.last, paused)
+
+    def add_point(self, t, lat, lon, speed):
+        # Log a track point (time of day in seconds, degrees, km/h) of the ride in progress
+        if self.recorder.recording:
+            self._run(self.recorder.add_point, t, lat, lon, speed)
+
+    def save_ride(self, lines):
+        # Save the ride summary (list of lines), followed by the track recorded since start_track()
+        return self._run(self._save_ride, lines)
+
+    def _save_ride(self, lines):
+        # Run again after an error (see _run()): the ride id is picked once, and the journal marked with it before the
+        # index changes, so neither a retry nor a recovery adds the ride twice
+        if self.recorder.recording:
+            self.recorder.finish()
+        if self._save_id is None:
+            ride_id = self.rides.next_id
+            if self.journal.sequence:
+                self.journal.mark_saved(ride_id)
+            self._save_id = ride_id
+        ride = self.rides.find(self._save_id)
+        if ride is None:
+            ride = self.rides.add(lines, self._track, self.recorder.buffer, self.recorder.points,
+                                  self.recorder.bytes_written)
+        self.journal.clear()
+        self._track = None
+        self._save_id = None
+        return ride
+
+    def unsynced(self):
+        return self.rides.unsynced()
+
+    def open_ride(self, ride):
+        # Ride file to stream, see ble_sync
+        return self._run(self.rides.open, ride)
+
+    def mark_synced(self, ride, save=True):
+        # Without save the index is saved by save_index(), once per sync session
+        self._run(self.rides.mark_synced, ride, save)
+
+    def save_index(self):
+        self._run(self.rides.save)
+
+    def clear(self):
+        self.journal.clear()
+        self._run(self.rides.clear)
+
+# Test
+
+if __name__ == '__main__':
+    from machine import Pin, SPI
+    from sdcard import SDCard
+    import time
+
+    spi = SPI(0, baudrate=1000000, polarity=0, phase=0, bits=8, firstbit=SPI.MSB, sck=Pin(6), mosi=Pin(7), miso=Pin(4))
+    storage = Storage(SDCard(spi, Pin(5, Pin.OUT)))
+    storage.start()
+
+    # Checking for unsynced rides is free once mounted
+    start = time.ticks_us()
+    for _ in range(1000):
+        storage.is_empty()
+    print('is_empty: ' + str(time.ticks_diff(time.ticks_us(), start) / 1000) + ' us')
+    print('Unsynced rides: ' + str(storage.rides.unsynced_count) + ', mounts: ' + str(storage.mounts))
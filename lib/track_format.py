@@ -0,0 +1,200 @@
+'''
+MicroPython module to encode and decode the binary ride files.
+A ride file is a fixed header with the ride summary, followed by its track. Every ANCHOR_EVERY points the track has an
+anchor point, stored whole (int32 microdegrees, uint32 time of day in seconds, uint16 speed in 0.1 km/h), the other
+points only store their difference from the previous one as zigzag varints (small signed numbers take 1 or 2 bytes).
+Points take about 6 bytes instead of the 22 of a text line, with their time and speed on top.
+'''
+
+import struct
+
+MAGIC = b'BBR'
+VERSION = 1
+ANCHOR_EVERY = 32
+
+# Magic, version, anchor interval, start date, start time, finish date, finish time, elapsed time (s), distance (m),
+# max speed (0.1 km/h), calories (0.1 kcal), number of points, track size (bytes)
+HEADER = '<3sBB8s5s8s5sIIHIII'
+HEADER_SIZE = struct.calcsize(HEADER)
+ANCHOR = '<iiIH'
+ANCHOR_SIZE = struct.calcsize(ANCHOR)
+POINT_MAX_SIZE = 4 * 5      # Four varints of up to 5 bytes
+SPEED_MAX = 0xffff          # 0.1 km/h, the anchor field
+T_MAX = 0xffffffff
+
+
+def _clamp (value, low, high):
+    return low if value < low else high if value > high else value
+
+def _seconds (elapsed):
+    # 'hh:mm:ss' to seconds
+    hours, minutes, seconds = elapsed.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+def _elapsed (seconds):
+    return '{:02d}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+def _text (field):
+    # Fixed size text field, padded with zeros
+    return field.decode().rstrip('\x00')
+
+def encode_header (summary, points=0, track_size=0):
+    # summary: the 8 summary lines of a ride (start date, start time, finish date, finish time, elapsed time,
+    # distance (m), max speed (km/h), calories (kcal)), as strings
+    return struct.pack(HEADER, MAGIC, VERSION, ANCHOR_EVERY, summary[0].encode(), summary[1].encode(),
+                       summary[2].encode(), summary[3].encode(), _seconds(summary[4]), int(summary[5]),
+                       round(float(summary[6]) * 10), round(float(summary[7]) * 10), points, track_size)
+
+def decode_header (data):
+    # Returns (summary lines, number of points, track size, anchor interval), ValueError if not a ride file
+    if len(data) < HEADER_SIZE or data[:3] != MAGIC:
+        raise ValueError('not a ride file')
+    fields = struct.unpack_from(HEADER, data)
+    if fields[1] != VERSION:
+        raise ValueError('ride file version ' + str(fields[1]))
+    summary = [_text(fields[3]), _text(fields[4]), _text(fields[5]), _text(fields[6]), _elapsed(fields[7]),
+               str(fields[8]), str(fields[9] / 10), str(fields[10] / 10)]
+    return summary, fields[11], fields[12], fields[2]
+
+def is_ride_file (data):
+    return data[:3] == MAGIC
+
+
+class TrackEncoder:
+    def __init__(self, anchor_every=ANCHOR_EVERY):
+        self.anchor_every = anchor_every
+        self.buffer = bytearray(max(ANCHOR_SIZE, POINT_MAX_SIZE))
+        self._bufmv = memoryview(self.buffer)
+        self.reset()
+
+    def reset(self):
+        self.points = 0
+        self.last = (0, 0, 0, 0)    # Last point committed, as encoded
+        self._next = None
+
+    def resume(self, points, last):
+        # Carry on encoding a track after points points, the last one being last (as encoded)
+        self.points = points
+        self.last = tuple(last)
+        self._next = None
+
+    def _varint(self, n, value):
+        # Unsigned LEB128
+        while value > 0x7f:
+            self.buffer[n] = (value & 0x7f) | 0x80
+            value >>= 7
+            n += 1
+        self.buffer[n] = value
+        return n + 1
+
+    def _zigzag(self, n, value):
+        return self._varint(n, (value << 1) if value >= 0 else ((-value) << 1) - 1)
+
+    def encode(self, t, lat, lon, speed):
+        # Encode a point (time of day in seconds, degrees, km/h). Returns a memoryview of its bytes, valid until the
+        # next call. The encoder only moves on to the next point on commit(), so a point that couldn't be written can
+        # be encoded again. Values out of range (a GPS glitch) are clamped to what an anchor can hold, which keeps the
+        # deltas within POINT_MAX_SIZE too
+        point = (_clamp(round(lat * 1000000), -90000000, 90000000), _clamp(round(lon * 1000000), -180000000, 180000000),
+                 _clamp(int(t), 0, T_MAX), _clamp(round(speed * 10), 0, SPEED_MAX))
+        self._next = point
+        if self.points % self.anchor_every == 0:
+            struct.pack_into(ANCHOR, self.buffer, 0, point[0], point[1], point[2], point[3])
+            return self._bufmv[:ANCHOR_SIZE]
+        prev = self.last
+        n = self._zigzag(0, point[0] - prev[0])
+        n = self._zigzag(n, point[1] - prev[1])
+        n = self._zigzag(n, point[2] - prev[2])
+        n = self._zigzag(n, point[3] - prev[3])
+        return self._bufmv[:n]
+
+    def commit(self):
+        self.last = self._next
+        self.points += 1
+
+
+def decode_track (data, anchor_every=ANCHOR_EVERY):
+    # Generator of the (time of day in seconds, latitude, longitude, speed) points of an encoded track
+    pos = 0
+    i = 0
+    size = len(data)
+    lat = lon = t = speed = 0
+    while pos < size:
+        if i % anchor_every == 0:
+            lat, lon, t, speed = struct.unpack_from(ANCHOR, data, pos)
+            pos += ANCHOR_SIZE
+        else:
+            deltas = [0, 0, 0, 0]
+            for k in range(4):
+                value = 0
+                shift = 0
+                while True:
+                    byte = data[pos]
+                    pos += 1
+                    value |= (byte & 0x7f) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                deltas[k] = (value >> 1) ^ -(value & 1)
+            lat += deltas[0]
+            lon += deltas[1]
+            t += deltas[2]
+            speed += deltas[3]
+        i += 1
+        yield t, lat / 1000000, lon / 1000000, speed / 10
+
+def decode_ride (data):
+    # (summary lines, list of points) of a whole ride file
+    summary, points, track_size, anchor_every = decode_header(data)
+    track = memoryview(data)[HEADER_SIZE:HEADER_SIZE + track_size]
+    return summary, list(decode_track(track, anchor_every))
+
+# Test
+
+import random
+
+def roundtrip_test (rides=20, seed=1):
+    # Encode random rides (including points far apart, stops, the day changing and edge values) and decode them back.
+    # Speeds above the anchor field come back clamped
+    random.seed(seed)
+    failures = 0
+    text_size = binary_size = 0
+    for ride in range(rides):
+        summary = ['31/12/25', '23:50', '01/01/26', '01:10', '01:20:00', str(random.randint(0, 200000)),
+                   str(random.randint(0, 999) / 10), str(random.randint(0, 99999) / 10)]
+        encoder = TrackEncoder()
+        track = bytearray()
+        points = []
+        t = 86400 - 600
+        lat = random.uniform(-90, 90)
+        lon = random.uniform(-180, 180)
+        for i in range(random.randint(0, 500)):
+            t = (t + random.choice((1, 2, 10, 3600))) % 86400
+            jump = random.choice((0.0, 0.0001, 0.001, 1.0))
+            lat = max(-90.0, min(90.0, lat + random.uniform(-jump, jump)))
+            lon = max(-180.0, min(180.0, lon + random.uniform(-jump, jump)))
+            speed = random.choice((0.0, random.uniform(0, 80), 6553.5, random.uniform(6553.6, 20000)))
+            point = (t, round(lat, 6), round(lon, 6), round(speed, 1))
+            points.append(point)
+            track.extend(encoder.encode(*point))
+            encoder.commit()
+            text_size += len('{0:.6f},{1:.6f}\n'.format(lat, lon))
+        data = encode_header(summary, encoder.points, len(track)) + track
+        binary_size += len(data) - HEADER_SIZE
+        decoded_summary, decoded = decode_ride(data)
+        if decoded_summary != [summary[0], summary[1], summary[2], summary[3], summary[4], summary[5],
+                               str(float(summary[6])), str(float(summary[7]))]:
+            failures += 1
+        for a, b in zip(points, decoded):
+            if (a[0] != b[0] or abs(a[1] - b[1]) > 1e-9 or abs(a[2] - b[2]) > 1e-9 or
+                    abs(min(a[3], SPEED_MAX / 10) - b[3]) > 1e-9):
+                failures += 1
+                break
+        if len(decoded) != len(points):
+            failures += 1
+    print('Round trip: ' + str(rides) + ' rides, ' + str(failures) + ' failures, track ' + str(text_size) +
+          ' bytes as text, ' + str(binary_size) + ' bytes encoded')
+    return failures == 0
+
+if __name__ == '__main__':
+    print('Round trip: ' + ('OK' if roundtrip_test() else 'FAIL'))
@@ -0,0 +1,86 @@
+'''
+MicroPython module to keep the last samples of a value (speed, altitude) in a preallocated ring buffer.
+The minimum and maximum of the samples in the buffer are kept up to date on every push, only when the sample
+leaving the buffer was the minimum or the maximum are the samples scanned again.
+'''
+
+from array import array
+
+
+class Trend:
+    def __init__(self, size):
+        self.size = size
+        self._buf = array('f', [0.0] * size)
+        self._next = 0          # Where the next sample goes
+        self.count = 0          # Samples in the buffer
+        self.pushed = 0         # Samples pushed since the last clear
+        self.min = 0.0
+        self.max = 0.0
+
+    def clear(self):
+        self._next = 0
+        self.count = 0
+        self.pushed = 0
+        self.min = 0.0
+        self.max = 0.0
+
+    def push(self, value):
+        # Add a sample, dropping the oldest one if the buffer is full
+        dropped = None
+        if self.count == self.size:
+            dropped = self._buf[self._next]
+        else:
+            self.count += 1
+        self._buf[self._next] = value
+        value = self._buf[self._next]  # As stored (single precision)
+        self._next = (self._next + 1) % self.size
+        self.pushed += 1
+
+        if self.count == 1:
+            self.min = value
+            self.max = value
+        elif dropped is not None and (dropped == self.min or dropped == self.max):
+            self._scan()
+        else:
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def _scan(self):
+        buf = self._buf
+        low = high = buf[0]
+        for i in range(1, self.count):
+            value = buf[i]
+            if value < low:
+                low = value
+            elif value > high:
+                high = value
+        self.min = low
+        self.max = high
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        # i-th sample, oldest first
+        if i < 0 or i >= self.count:
+            raise IndexError
+        return self._buf[(self._next - self.count + i) % self.size]
+
+    def last(self):
+        return self[self.count - 1]
+
+# Test
+
+if __name__ == '__main__':
+    import random
+    trend = Trend(16)
+    samples = []
+    for _ in range(1000):
+        value = random.getrandbits(8) / 4
+        trend.push(value)
+        samples = (samples + [value])[-16:]
+        assert trend.min == min(samples) and trend.max == max(samples)
+        assert [trend[i] for i in range(len(trend))] == samples
+    print('OK')
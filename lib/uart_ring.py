@@ -0,0 +1,147 @@
+'''
+MicroPython module to buffer UART input in a preallocated ring buffer, drained from a UART RX interrupt or, where the
+port doesn't support one, from a periodic timer callback. Keeps receiving while the main loop is blocked (SMS, DHT11,
+SD card) and counts the bytes that didn't fit.
+'''
+
+from machine import UART, Timer
+
+
+class UARTRingBuffer:
+    def __init__(self, uart, size=2048, period_ms=10, start=True, name='rx'):
+        self.uart = uart
+        self.name = name    # For the report
+        self._buf = bytearray(size)
+        self._mv = memoryview(self._buf)
+        self._size = size
+        self._scratch = bytearray(32)
+
+        # Only the drain callback moves head, only the reader moves tail
+        self._head = 0
+        self._tail = 0
+
+        self.reset_stats()
+
+        self._period_ms = period_ms
+        self._timer = None
+        if start:
+            self.start()
+
+    def reset_stats(self):
+        self.high_water = 0     # Most bytes ever waiting in the buffer
+        self.lost_bytes = 0     # Bytes discarded because the buffer was full
+        self.overflows = 0      # Number of times the buffer was full
+
+    def start(self):
+        # Drain on RX interrupt if the port supports it, otherwise poll from a timer
+        try:
+            self.uart.irq(handler=self.drain, trigger=UART.IRQ_RXIDLE)
+        except (AttributeError, TypeError, ValueError):
+            self._timer = Timer(period=self._period_ms, mode=Timer.PERIODIC, callback=self.drain)
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
+        else:
+            try:
+                self.uart.irq(handler=None)
+            except (AttributeError, TypeError, ValueError):
+                pass
+
+    def drain(self, _=None):
+        # Move everything waiting in the UART into the ring buffer
+        size = self._size
+        n = self.uart.any()
+        while n > 0:
+            head = self._head
+            tail = self._tail
+
+            # Contiguous free space after head, one slot is always kept empty
+            if tail > head:
+                free = tail - head - 1
+            else:
+                free = size - head - (1 if tail == 0 else 0)
+
+            if free == 0:
+                lost = self.uart.readinto(self._scratch, min(n, len(self._scratch))) or 0
+                self.lost_bytes += lost
+                self.overflows += 1
+                n -= lost
+                if lost == 0:
+                    break
+                continue
+
+            got = self.uart.readinto(self._mv[head:head + min(free, n)]) or 0
+            if got == 0:
+                break
+            self._head = (head + got) % size
+            n -= got
+
+        waiting = self.any()
+        if waiting > self.high_water:
+            self.high_water = waiting
+
+    def any(self):
+        return (self._head - self._tail) % self._size
+
+    def readinto(self, buf, nbytes=None):
+        # Copy up to nbytes (default len(buf)) waiting bytes into buf. Returns the number of bytes copied
+        if nbytes is None or nbytes > len(buf):
+            nbytes = len(buf)
+        nbytes = min(nbytes, self.any())
+        tail = self._tail
+        first = min(nbytes, self._size - tail)
+        dest = memoryview(buf)
+        dest[:first] = self._mv[tail:tail + first]
+        if nbytes > first:
+            dest[first:nbytes] = self._mv[:nbytes - first]
+        self._tail = (tail + nbytes) % self._size
+        return nbytes
+
+    def read(self, nbytes=None):
+        # Same as UART.read(): returns the waiting bytes (up to nbytes), None if there are none
+        waiting = self.any()
+        if nbytes is None or nbytes > waiting:
+            nbytes = waiting
+        if nbytes == 0:
+            return None
+        buf = bytearray(nbytes)
+        self.readinto(buf)
+        return bytes(buf)
+
+    def readline(self):
+        # Returns the next complete line (including b'\n'), None if there is no complete line yet
+        size = self._size
+        tail = self._tail
+        waiting = self.any()
+        for i in range(waiting):
+            if self._buf[(tail + i) % size] == 10:
+                return self.read(i + 1)
+        return None
+
+    def write(self, buf):
+        return self.uart.write(buf)
+
+    def report(self):
+        return (self.name + ': high water ' + str(self.high_water) + ' of ' + str(self._size - 1) + ' bytes, lost ' +
+                str(self.lost_bytes) + ' bytes in ' + str(self.overflows) + ' overflows')
+
+# Test
+
+import time
+from machine import Pin
+
+if __name__ == '__main__':
+    gps_module = UART(1, baudrate=9600, tx=Pin(8), rx=Pin(9))
+    rx = UARTRingBuffer(gps_module)
+
+    # Block for a while like an SMS send would, nothing should be lost
+    time.sleep_ms(1500)
+    while True:
+        line = rx.readline()
+        if line:
+            print(line)
+        else:
+            print('waiting: ' + str(rx.any()) + ', ' + rx.report())
+            time.sleep_ms(500)
@@ -0,0 +1,360 @@
+'''
+MicroPython module to manage the GPS NEO-6M module, using the u-blox UBX binary protocol and UART interface.
+Frames are parsed in place with struct.unpack_from and fill the same data as MicropyGPS, so get_data() works unchanged.
+Reference: u-blox 6 Receiver Description Including Protocol Specification (GPS.G6-SW-10018)
+'''
+
+import struct
+import time
+from micropyGPS import MicropyGPS
+
+# Frame layout: sync chars, class, id, payload length (little endian), payload, checksum (CK_A, CK_B)
+SYNC = b'\xb5\x62'
+HEADER_SIZE = 6
+CHECKSUM_SIZE = 2
+MAX_PAYLOAD = 100
+
+# Message classes and ids
+CLS_NAV = 0x01
+CLS_ACK = 0x05
+CLS_CFG = 0x06
+CLS_NMEA = 0xF0
+NAV_POSLLH = 0x02
+NAV_STATUS = 0x03
+NAV_PVT = 0x07      # Not available on u-blox 6 (NEO-6M), parsed for newer receivers
+NAV_VELNED = 0x12
+NAV_TIMEUTC = 0x21
+ACK_NAK = 0x00
+ACK_ACK = 0x01
+CFG_PRT = 0x00
+CFG_MSG = 0x01
+CFG_RATE = 0x08
+NMEA_GGA = 0x00
+NMEA_GLL = 0x01
+NMEA_GSA = 0x02
+NMEA_GSV = 0x03
+NMEA_RMC = 0x04
+NMEA_VTG = 0x05
+
+# Minimum payload length of the parsed messages
+NAV_LENGTHS = {NAV_POSLLH: 28, NAV_STATUS: 16, NAV_PVT: 92, NAV_VELNED: 36, NAV_TIMEUTC: 20}
+
+# Messages enabled by configure(), in the order the receiver outputs them
+NEO6_MESSAGES = (NAV_POSLLH, NAV_STATUS, NAV_VELNED, NAV_TIMEUTC)
+PVT_MESSAGES = (NAV_PVT,)
+NMEA_SENTENCES = (NMEA_GGA, NMEA_GLL, NMEA_GSA, NMEA_GSV, NMEA_RMC, NMEA_VTG)
+
+# CFG-PRT constants
+PORT_UART1 = 1
+MODE_8N1 = 0x08D0
+PROTO_UBX = 0x0001
+PROTO_NMEA = 0x0002
+
+
+def checksum(buf):
+    # 8-bit Fletcher checksum over class, id, length and payload
+    ck_a = 0
+    ck_b = 0
+    for byte in buf:
+        ck_a = (ck_a + byte) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return ck_a, ck_b
+
+def frame(msg_class, msg_id, payload=b''):
+    # Build a complete UBX frame
+    buf = bytearray(HEADER_SIZE + len(payload) + CHECKSUM_SIZE)
+    buf[0:2] = SYNC
+    struct.pack_into('<BBH', buf, 2, msg_class, msg_id, len(payload))
+    buf[HEADER_SIZE:HEADER_SIZE + len(payload)] = payload
+    buf[-2], buf[-1] = checksum(memoryview(buf)[2:-2])
+    return buf
+
+def cfg_prt(baudrate, out_proto=PROTO_UBX, in_proto=PROTO_UBX | PROTO_NMEA):
+    # Set UART1 baudrate and the protocols it accepts/outputs
+    return frame(CLS_CFG, CFG_PRT, struct.pack('<BBHIIHHHH', PORT_UART1, 0, 0, MODE_8N1, baudrate,
+                                               in_proto, out_proto, 0, 0))
+
+def cfg_msg(msg_class, msg_id, rate=1):
+    # Output a message every <rate> navigation solutions on the current port (0 disables it)
+    return frame(CLS_CFG, CFG_MSG, struct.pack('<BBB', msg_class, msg_id, rate))
+
+def cfg_rate(meas_rate_ms=1000):
+    # Set the measurement period, one navigation solution per measurement, aligned to GPS time
+    return frame(CLS_CFG, CFG_RATE, struct.pack('<HHH', meas_rate_ms, 1, 1))
+
+def configure(uart, baudrate=38400, meas_rate_ms=1000, messages=NEO6_MESSAGES, delay_ms=100):
+    # Switch the receiver to UBX-only output at a higher baudrate. Must be called with the UART still at the
+    # receiver's current baudrate, the UART is then reinitialized to the new one
+    uart.write(cfg_prt(baudrate))
+    time.sleep_ms(delay_ms)
+    uart.init(baudrate=baudrate)
+    for msg_id in messages:
+        uart.write(cfg_msg(CLS_NAV, msg_id))
+        time.sleep_ms(delay_ms)
+    uart.write(cfg_rate(meas_rate_ms))
+    time.sleep_ms(delay_ms)
+
+def configure_nmea(uart, baudrate=38400, meas_rate_ms=1000, sentences=(NMEA_RMC, NMEA_GGA), delay_ms=100):
+    # Keep NMEA output but only for the given sentences, at a higher baudrate and navigation rate. Needed for
+    # 5/10 Hz, the default sentences at 9600 baud only fit in the UART at 1 Hz
+    uart.write(cfg_prt(baudrate, out_proto=PROTO_NMEA))
+    time.sleep_ms(delay_ms)
+    uart.init(baudrate=baudrate)
+    for msg_id in NMEA_SENTENCES:
+        uart.write(cfg_msg(CLS_NMEA, msg_id, 1 if msg_id in sentences else 0))
+        time.sleep_ms(delay_ms)
+    uart.write(cfg_rate(meas_rate_ms))
+    time.sleep_ms(delay_ms)
+
+
+class MicropyUBX(MicropyGPS):
+    """UBX Frame Parser. Stores the same data as MicropyGPS, from NAV-POSLLH, NAV-STATUS, NAV-VELNED and NAV-TIMEUTC
+    (u-blox 6) or NAV-PVT (u-blox 7 and later) messages. Parses chunks of bytes using feed()"""
+
+    def __init__(self, local_offset=0, location_formatting='ddm'):
+        super().__init__(local_offset, location_formatting)
+
+        # Position in 1e-7 degrees, as sent by the receiver
+        self.latitude_e7 = 0
+        self.longitude_e7 = 0
+
+        # Configuration acknowledges, (class, id) of the last acknowledged/rejected message
+        self.acks = 0
+        self.naks = 0
+        self.last_ack = None
+
+        self.message_parsers = {NAV_POSLLH: self.nav_posllh, NAV_STATUS: self.nav_status,
+                                NAV_VELNED: self.nav_velned, NAV_TIMEUTC: self.nav_timeutc,
+                                NAV_PVT: self.nav_pvt}
+
+    ########################################
+    # Message Parsers
+    ########################################
+    def nav_posllh(self, mv, offset):
+        """Parse Geodetic Position Solution (NAV-POSLLH). Updates latitude, longitude and altitude"""
+        _, lon, lat, height, h_msl = struct.unpack_from('<Iiiii', mv, offset)
+        self.set_position(lat, lon)
+        self.altitude = h_msl / 1000
+        self.geoid_height = (height - h_msl) / 1000
+
+    def nav_status(self, mv, offset):
+        """Parse Receiver Navigation Status (NAV-STATUS). Updates fix type and validity"""
+        fix_type, flags = struct.unpack_from('<BB', mv, offset + 4)
+        self.set_fix_status(fix_type, flags & 0x01)
+
+    def nav_velned(self, mv, offset):
+        """Parse Velocity Solution in NED (NAV-VELNED). Updates speed and course"""
+        g_speed, heading = struct.unpack_from('<Ii', mv, offset + 20)
+        self.set_speed(g_speed * 10, heading)
+
+    def nav_timeutc(self, mv, offset):
+        """Parse UTC Time Solution (NAV-TIMEUTC). Updates timestamp and date if they are valid"""
+        nano, year, month, day, hour, minute, sec, valid = struct.unpack_from('<iHBBBBBB', mv, offset + 8)
+        if valid & 0x04:  # UTC time fully resolved
+            self.set_time(year, month, day, hour, minute, sec, nano)
+
+    def nav_pvt(self, mv, offset):
+        """Parse Navigation Position Velocity Time Solution (NAV-PVT). Updates all data at once"""
+        (_, year, month, day, hour, minute, sec, valid, _, nano, fix_type, flags, _, num_sv,
+         lon, lat, height, h_msl, _, _, _, _, _, g_speed, heading) = struct.unpack_from(
+            '<IHBBBBBBIiBBBBiiiiIIiiiii', mv, offset)
+        if valid & 0x03 == 0x03:  # Date and time valid
+            self.set_time(year, month, day, hour, minute, sec, nano)
+        self.set_fix_status(fix_type, flags & 0x01)
+        self.satellites_in_use = num_sv
+        self.set_position(lat, lon)
+        self.altitude = h_msl / 1000
+        self.geoid_height = (height - h_msl) / 1000
+        self.set_speed(g_speed, heading)
+
+    ########################################
+    # Data Updates
+    ########################################
+    def set_position(self, lat, lon):
+        """Store a position given in 1e-7 degrees, also keeping the degrees/minutes form used by MicropyGPS"""
+        self.latitude_e7 = lat
+        self.longitude_e7 = lon
+        self._latitude = [abs(lat) // 10_000_000, (abs(lat) % 10_000_000) * 60 / 10_000_000, 'S' if lat < 0 else 'N']
+        self._longitude = [abs(lon) // 10_000_000, (abs(lon) % 10_000_000) * 60 / 10_000_000, 'W' if lon < 0 else 'E']
+
+    def set_fix_status(self, fix_type, fix_ok):
+        """Store the fix type (0 no fix, 2 2D, 3 3D, ...) and whether the fix is valid"""
+        self.fix_type = fix_type
+        self.fix_stat = 1 if fix_ok else 0
+        self.valid = bool(fix_ok) and fix_type >= 2
+        if self.valid:
+            self.new_fix_time()
+
+    def set_speed(self, g_speed_mm, heading_e5):
+        """Store ground speed given in mm/s and heading in 1e-5 degrees"""
+        kph = g_speed_mm * 0.0036
+        knots = kph / 1.852
+        self.speed = [knots, knots * 1.151, kph]
+        self.course = heading_e5 / 100_000
+
+    def set_time(self, year, month, day, hour, minute, sec, nano=0):
+        """Store UTC date and time, applying the local offset to the hours like the NMEA parsers do. The seconds keep
+        their fraction (nano, -1e9..1e9 ns), so each epoch at 5/10 Hz has its own timestamp"""
+        self.timestamp = [(hour + self.local_offset) % 24, minute, sec + nano / 1_000_000_000]
+        self.date = (day, month, year % 100)
+
+    def update_fix(self):
+        """Refresh the numeric fix returned by get_fix() straight from the 1e-7 degrees position"""
+        fix = self.fix
+        fix.valid = self.valid and (self.latitude_e7 != 0 or self.longitude_e7 != 0)
+        fix.latitude_udeg = (self.latitude_e7 + 5) // 10
+        fix.longitude_udeg = (self.longitude_e7 + 5) // 10
+        fix.latitude = self.latitude_e7 / 10_000_000
+        fix.longitude = self.longitude_e7 / 10_000_000
+        fix.speed = self.speed[2]
+        fix.course = self.course
+        fix.altitude = self.altitude
+
+    ##########################################
+    # Data Stream Handler Functions
+    ##########################################
+    def feed(self, buf):
+        """Process a chunk of raw bytes (bytes or bytearray) as read from the UART. Frames are located by their sync
+        chars, validated with the Fletcher checksum and parsed in place from a memoryview. An incomplete frame at the
+        end of the chunk is kept until the next call. Returns the (class, id) of the last frame parsed, None otherwise"""
+
+        if self.pending_data:
+            data = self.pending_data + buf
+            self.pending_data = b''
+        else:
+            data = buf
+
+        parsed = None
+        data_mv = memoryview(data)
+        start = data.find(SYNC)
+
+        while start >= 0:
+
+            # Frame header still incomplete
+            if start + HEADER_SIZE > len(data):
+                self.pending_data = bytes(data_mv[start:])
+                break
+
+            msg_class, msg_id, length = struct.unpack_from('<BBH', data_mv, start + 2)
+
+            # Corrupted length, resync on the next sync chars
+            if length > MAX_PAYLOAD:
+                self.crc_fails += 1
+                start = data.find(SYNC, start + 2)
+                continue
+
+            # Frame still incomplete
+            end = start + HEADER_SIZE + length
+            if end + CHECKSUM_SIZE > len(data):
+                self.pending_data = bytes(data_mv[start:])
+                break
+
+            ck_a, ck_b = checksum(data_mv[start + 2:end])
+            if ck_a != data_mv[end] or ck_b != data_mv[end + 1]:
+                self.crc_fails += 1
+                start = data.find(SYNC, start + 2)
+                continue
+
+            self.clean_sentences += 1
+            if self.parse_frame(msg_class, msg_id, data_mv, start + HEADER_SIZE, length):
+                self.parsed_sentences += 1
+                self.generation += 1
+                self.update_fix()
+                parsed = (msg_class, msg_id)
+
+            start = data.find(SYNC, end + CHECKSUM_SIZE)
+
+        # Chunk ending between the two sync chars: keep the first one, the frame starts there
+        if not self.pending_data and data[-1:] == SYNC[:1]:
+            self.pending_data = SYNC[:1]
+
+        return parsed
+
+    def parse_frame(self, msg_class, msg_id, mv, offset, length):
+        """Dispatch a valid frame to its parser. Returns True if it updated the GPS data"""
+        if msg_class == CLS_NAV:
+            parser = self.message_parsers.get(msg_id)
+            if parser is None or length < NAV_LENGTHS[msg_id]:
+                return False
+            parser(mv, offset)
+            return True
+
+        if msg_class == CLS_ACK and length == 2:
+            if msg_id == ACK_ACK:
+                self.acks += 1
+            else:
+                self.naks += 1
+            self.last_ack = (mv[offset], mv[offset + 1])
+        return False
+
+# Test
+
+def split_test (frames=200):
+    # Feed a stream of NAV-POSLLH frames in chunks cut at every position of the frame, including between the two
+    # sync chars: every frame must be parsed
+    payload = struct.pack('<Iiiii', 0, -492000000, -254000000, 950000, 930000) + bytes(8)
+    one = frame(CLS_NAV, NAV_POSLLH, payload)
+    stream = bytes(one) * frames
+    ok = True
+    for cut in range(len(one)):
+        gps = MicropyUBX()
+        start = 0
+        for end in range(cut + 1, len(stream), len(one)):
+            gps.feed(stream[start:end])
+            start = end
+        gps.feed(stream[start:])
+        if gps.parsed_sentences != frames:
+            print('Cut at ' + str(cut) + ': ' + str(gps.parsed_sentences) + ' of ' + str(frames) + ' frames parsed')
+            ok = False
+    return ok
+
+def mixed_stream_test (epochs=100):
+    # Feed NAV-POSLLH frames mixed with frames of unknown classes and ids, ACKs and NMEA sentences, in uneven chunks.
+    # Every 5th NAV-POSLLH has a bad checksum and every 7th a corrupted length: those are counted in crc_fails, the
+    # others parsed, and nothing else is
+    posllh = frame(CLS_NAV, NAV_POSLLH, struct.pack('<Iiiii', 0, -492000000, -254000000, 950000, 930000) + bytes(8))
+    unknown = (frame(0x0A, 0x04, b'ROM CORE 7.03 (45969)\x00' + bytes(18)),    # MON-VER
+               frame(CLS_NAV, 0x30, bytes(20)))                                # NAV-SVINFO, not parsed
+    nmea = b'$GPGSA,A,3,04,05,,09,12,,,24,,,,,2.5,1.3,2.1*39\r\n$GPTXT,01,01,02,ANTSTATUS=OK*3B\r\n'
+    stream = bytearray()
+    corrupted = 0
+    for i in range(epochs):
+        one = bytearray(posllh)
+        if i % 5 == 1:
+            one[-1] ^= 0xff
+            corrupted += 1
+        elif i % 7 == 3:
+            one[4] = MAX_PAYLOAD + 1
+            corrupted += 1
+        stream += nmea[:i % len(nmea)] + one + unknown[i % 2] + frame(CLS_ACK, ACK_ACK, bytes((CLS_CFG, 0x01)))
+        stream += nmea[i % len(nmea):]
+    gps = MicropyUBX()
+    start = 0
+    size = 1
+    while start < len(stream):
+        gps.feed(bytes(stream[start:start + size]))
+        start += size
+        size = size % 13 + 1
+    ok = gps.parsed_sentences == epochs - corrupted and gps.crc_fails == corrupted and gps.acks == epochs
+    if not ok:
+        print('Parsed ' + str(gps.parsed_sentences) + ' of ' + str(epochs - corrupted) + ', crc fails ' +
+              str(gps.crc_fails) + ' of ' + str(corrupted) + ', acks ' + str(gps.acks) + ' of ' + str(epochs))
+    return ok
+
+if __name__ == "__main__":
+    print('Split frames: ' + ('OK' if split_test() else 'FAIL'))
+    print('Mixed stream: ' + ('OK' if mixed_stream_test() else 'FAIL'))
+
+    from machine import Pin, UART
+    from micropyGPS import get_data
+
+    # Initialize GPS module at its default NMEA baudrate and switch it to UBX
+    gps_module = UART(1, baudrate=9600, tx=Pin(8), rx=Pin(9))
+    configure(gps_module, baudrate=38400)
+    gps = MicropyUBX(-3)
+
+    while True:
+        gps_data, changed = get_data(gps, gps_module)
+        if changed:
+            print(gps_data, gps.acks, gps.naks, gps.crc_fails)
+        time.sleep_ms(100)
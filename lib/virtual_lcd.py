@@ -0,0 +1,186 @@
+'''
+MicroPython module with a headless stand-in for the LCD12864, to test and benchmark the screens without a device.
+VirtualLCD is an LCD12864 on a fake SPI bus: drawing, show() and the SPI byte counters behave exactly as on the
+display, and every frame shown is recorded so it can be compared with a golden image or saved as PBM/PNG.
+Runs anywhere framebuf is available: the device, the MicroPython unix port, or CPython with the stand-ins in host.
+'''
+
+import struct
+from binascii import crc32
+from lcd12864 import LCD12864, FakeSPI, FakePin
+
+WIDTH = 128
+HEIGHT = 64
+FRAME_SIZE = WIDTH * HEIGHT // 8
+
+
+class VirtualLCD(LCD12864):
+    def __init__(self, max_frames=100):
+        self.spi = FakeSPI()
+        super().__init__(self.spi, FakePin())
+
+        # Recorded frames (MONO_HLSB, 1 bit per pixel, 1 = pixel on), the oldest are dropped after max_frames
+        self.max_frames = max_frames
+        self.recorded = []
+        self.recorded_bytes = []    # SPI bytes sent for each recorded frame
+
+    def _show_rows(self, top, bottom, full):
+        sent = self.bytes_sent
+        super()._show_rows(top, bottom, full)
+        if len(self.recorded) >= self.max_frames:
+            self.recorded.pop(0)
+            self.recorded_bytes.pop(0)
+        self.recorded.append(self.frame())
+        self.recorded_bytes.append(self.bytes_sent - sent)
+
+    def frame(self):
+        # Copy of the framebuffer as it is now
+        return bytes(self._bufmv[:FRAME_SIZE])
+
+    def last_frame(self):
+        return self.recorded[-1] if self.recorded else None
+
+
+def frame_pbm (frame):
+    # Binary PBM (P4): 1 bit per pixel, most significant bit first, 1 = black. Same layout as MONO_HLSB
+    return b'P4\n' + str(WIDTH).encode() + b' ' + str(HEIGHT).encode() + b'\n' + frame
+
+def load_pbm (data):
+    # Frame from a binary PBM saved with frame_pbm() (magic number line, then size line)
+    header_end = 0
+    for _ in range(2):
+        header_end = data.index(b'\n', header_end) + 1
+    return bytes(data[header_end:header_end + FRAME_SIZE])
+
+def _compress (data):
+    try:
+        import zlib
+        return zlib.compress(data)
+    except (ImportError, AttributeError):
+        import io
+        import deflate
+        out = io.BytesIO()
+        with deflate.DeflateIO(out, deflate.ZLIB) as stream:
+            stream.write(data)
+        return out.getvalue()
+
+def _png_chunk (kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', crc32(kind + data) & 0xffffffff)
+
+def frame_png (frame, scale=1):
+    # 1 bit grayscale PNG (pixels on drawn black on white), optionally scaled up to be readable
+    row_bytes = WIDTH // 8
+    raw = bytearray()
+    for y in range(HEIGHT):
+        row = bytearray(row_bytes * scale)
+        for x in range(WIDTH * scale):
+            src = x // scale
+            if not frame[y * row_bytes + src // 8] & (0x80 >> (src % 8)):
+                row[x // 8] |= 0x80 >> (x % 8)
+        for _ in range(scale):
+            raw.append(0)   # No filter
+            raw.extend(row)
+    header = struct.pack('>IIBBBBB', WIDTH * scale, HEIGHT * scale, 1, 0, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', header) + _png_chunk(b'IDAT', _compress(bytes(raw))) +
+            _png_chunk(b'IEND', b''))
+
+def frame_text (frame):
+    # ASCII art of a frame, to print differences in a test
+    lines = []
+    for y in range(HEIGHT):
+        lines.append(''.join('#' if frame[y * WIDTH // 8 + x // 8] & (0x80 >> (x % 8)) else '.' for x in range(WIDTH)))
+    return '\n'.join(lines)
+
+def save (path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+# Test
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    # CPython, with host/framebuf.py
+    import time
+
+    def ticks_us():
+        return int(time.perf_counter() * 1000000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+def render_benchmark (render, models, repeat=10):
+    # Render a screen (render(lcd, *model)) for each model in turn, as the display manager does. Returns the time
+    # and SPI bytes per frame
+    lcd = VirtualLCD(max_frames=1)
+    sent = lcd.bytes_sent
+    start = ticks_us()
+    for _ in range(repeat):
+        for model in models:
+            render(lcd, *model)
+    elapsed = ticks_diff(ticks_us(), start)
+    frames = repeat * len(models)
+    return elapsed / frames, (lcd.bytes_sent - sent) / frames
+
+# Golden images, relative to the root of the repository (run the tests from there). They are rendered with
+# host/framebuf.py, a port whose framebuf draws differently (another font) fails them until they are updated
+GOLDEN = 'golden'
+
+def firmware_screens ():
+    # (name, render function, models) of every screen of the firmware (see screens), the first model is the one of
+    # its golden image. The graphs get a sample per frame
+    import screens
+
+    def graph(lcd, speed, altitude):
+        screens.SPEED_GRAPH.push(speed)
+        screens.ALTITUDE_GRAPH.push(altitude)
+        screens.lcd_graph(lcd, screens.SPEED_GRAPH.trend.pushed)
+
+    screens.SPEED_GRAPH.clear()
+    screens.ALTITUDE_GRAPH.clear()
+    for i in range(WIDTH - 1):
+        graph(VirtualLCD(max_frames=1), 20 + (i * 7) % 15, 900 + i // 4)
+    return (
+        ('lcd_no_info', screens.lcd_no_info, [(True,), (False,)]),
+        ('lcd_idle', screens.lcd_idle, [(False, False, True), (True, True, True), (False, True, False)]),
+        ('lcd_sending', screens.lcd_sending, [(False,), (True,)]),
+        ('lcd_running_paused', screens.lcd_running_paused,
+         [(24.5, (1, 2, 3), '17/05/24', '12:34', 123.4, 22, 3.2, True)] +
+         [(s / 2, (0, s // 60, s % 60), '17/05/24', '12:34', s / 10, 22, s / 360, s % 30 != 0) for s in range(60)]),
+        ('lcd_graph', graph, [(24, 932)] + [(20 + s % 15, 932 + s // 4) for s in range(60)]),
+        ('lcd_saving', screens.lcd_saving, [(False,), (True,)]),
+        ('lcd_alarm', screens.lcd_alarm, [(True,), (False,)]),
+    )
+
+def golden_test (path=GOLDEN, update=False):
+    # Render every screen with its first model and compare the frame shown with <path>/<name>.pbm. With update the
+    # golden images are written instead
+    failures = 0
+    for name, render, models in firmware_screens():
+        lcd = VirtualLCD(max_frames=1)
+        render(lcd, *models[0])
+        frame = lcd.last_frame()
+        golden_path = path + '/' + name + '.pbm'
+        if update:
+            save(golden_path, frame_pbm(frame))
+            continue
+        with open(golden_path, 'rb') as f:
+            golden = load_pbm(f.read())
+        if frame != golden:
+            print(name + ' differs from ' + golden_path + ':')
+            print(frame_text(frame))
+            failures += 1
+    return failures == 0
+
+def screens_benchmark (repeat=5):
+    # Time and SPI bytes per frame of every screen, going through its models
+    for name, render, models in firmware_screens():
+        us, spi_bytes = render_benchmark(render, models, repeat)
+        print(name + ': ' + str(round(us)) + ' us/frame, SPI: ' + str(round(spi_bytes)) + ' bytes/frame')
+
+if __name__ == '__main__':
+    import sys
+    if 'update' in sys.argv:
+        golden_test(update=True)
+    print('Golden images: ' + ('OK' if golden_test() else 'FAIL'))
+    screens_benchmark()
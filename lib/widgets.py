@@ -0,0 +1,249 @@
+'''
+MicroPython module with a small widget layer for the LCD12864 screens.
+A screen is a list of widgets. The first time it is shown everything is drawn, static labels included. After that
+only the fields whose value changed redraw their own rectangle and report it to the driver (mark_dirty), so the
+framebuffer work, the strings built and the rows compared before sending are limited to what changed.
+'''
+
+import framebuf
+from trend import Trend
+
+CHAR = 8    # Font size (pixels)
+
+
+class Widget:
+    def __init__(self, x, y, w, h):
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+
+    def draw(self, lcd):
+        # Draw on a cleared screen
+        pass
+
+    def refresh(self, lcd):
+        # Redraw if the value changed. Returns True if something was drawn
+        return False
+
+    def _clear(self, lcd):
+        lcd.fill_rect(self.x, self.y, self.w, self.h, 0)
+        lcd.mark_dirty(self.x, self.y, self.w, self.h)
+
+
+class Label(Widget):
+    # Static text, only drawn when the screen is
+    def __init__(self, x, y, text):
+        super().__init__(x, y, CHAR * len(text), CHAR)
+        self.text = text
+
+    def draw(self, lcd):
+        lcd.text(self.text, self.x, self.y, 1)
+
+
+class Field(Widget):
+    # Text field of a fixed number of characters. fmt is a format string ('{}km/h') or a function returning the
+    # text of the value, the text is only built when the value changes. None and '' leave the field empty
+    def __init__(self, x, y, chars, fmt=None):
+        super().__init__(x, y, CHAR * chars, CHAR)
+        self.chars = chars
+        self.fmt = fmt
+        self.value = None
+        self._drawn = None
+
+    def set(self, value):
+        self.value = value
+
+    def format(self, value):
+        if self.fmt is None:
+            return str(value)
+        if isinstance(self.fmt, str):
+            return self.fmt.format(value)
+        return self.fmt(value)
+
+    def draw(self, lcd):
+        self._drawn = self.value
+        if self.value is not None and self.value != '':
+            lcd.text(self.format(self.value)[:self.chars], self.x, self.y, 1)
+
+    def refresh(self, lcd):
+        if self.value == self._drawn:
+            return False
+        self._clear(lcd)
+        self.draw(lcd)
+        return True
+
+
+class BigField(Field):
+    # Field drawn with a BigFont, right aligned in its w pixels wide rectangle
+    def __init__(self, x, y, w, font, fmt=None):
+        super().__init__(x, y, 0, fmt)
+        self.w = w
+        self.h = font.height
+        self.font = font
+
+    def draw(self, lcd):
+        self._drawn = self.value
+        if self.value is not None and self.value != '':
+            rendered, width = self.font.render(self.format(self.value))
+            lcd.blit(rendered, self.x + self.w - width, self.y)
+
+
+class Icon(Widget):
+    # Monochrome bitmap (MONO_HLSB rows) that can be shown or hidden
+    def __init__(self, x, y, w, h, bitmap, visible=True):
+        super().__init__(x, y, w, h)
+        self.fbuf = framebuf.FrameBuffer(bytearray(bitmap), w, h, framebuf.MONO_HLSB)
+        self.visible = visible
+        self._drawn = None
+
+    def set(self, visible):
+        self.visible = visible
+
+    def draw(self, lcd):
+        self._drawn = self.visible
+        if self.visible:
+            lcd.blit(self.fbuf, self.x, self.y, 0)
+
+    def refresh(self, lcd):
+        if self.visible == self._drawn:
+            return False
+        self._clear(lcd)
+        self.draw(lcd)
+        return True
+
+
+class Bar(Widget):
+    # Horizontal bar filled in proportion to value (0 to max_value)
+    def __init__(self, x, y, w, h, max_value):
+        super().__init__(x, y, w, h)
+        self.max_value = max_value
+        self.value = 0
+        self._drawn = None
+
+    def set(self, value):
+        self.value = value
+
+    def _fill(self):
+        value = min(max(self.value, 0), self.max_value)
+        return (self.w - 2) * value // self.max_value
+
+    def draw(self, lcd):
+        fill = self._fill()
+        self._drawn = fill
+        lcd.rect(self.x, self.y, self.w, self.h, 1)
+        lcd.fill_rect(self.x + 1, self.y + 1, fill, self.h - 2, 1)
+
+    def refresh(self, lcd):
+        if self._fill() == self._drawn:
+            return False
+        self._clear(lcd)
+        self.draw(lcd)
+        return True
+
+
+class Graph(Widget):
+    # Sparkline of the last w samples, pushed with push(). A new sample scrolls the graph one column to the left and
+    # draws the new column, the whole graph is only redrawn when its scale (multiples of step around the minimum and
+    # maximum of the samples) changes
+    def __init__(self, x, y, w, h, step):
+        super().__init__(x, y, w, h)
+        self.step = step
+        self.trend = Trend(w)
+        self.fbuf = framebuf.FrameBuffer(bytearray((w + 7) // 8 * h), w, h, framebuf.MONO_HLSB)
+        self.redraws = 0
+        self.clear()
+
+    def clear(self):
+        self.trend.clear()
+        self.fbuf.fill(0)
+        self.low = 0
+        self.high = self.step
+        self._changed = True
+
+    def push(self, value):
+        trend = self.trend
+        trend.push(value)
+        low = int(trend.min // self.step) * self.step
+        high = max(low + self.step, -int(-trend.max // self.step) * self.step)
+        if low != self.low or high != self.high:
+            self.low = low
+            self.high = high
+            self._redraw()
+        else:
+            self.fbuf.scroll(-1, 0)
+            self.fbuf.vline(self.w - 1, 0, self.h, 0)
+            self._column(self.w - 1, len(trend) - 1)
+            if len(trend) == self.w:
+                # The oldest sample now starts the graph, drop the line coming from the one before it
+                self.fbuf.vline(0, 0, self.h, 0)
+                self._column(0, 0)
+        self._changed = True
+
+    def _y(self, value):
+        return self.h - 1 - int((value - self.low) * (self.h - 1) / (self.high - self.low))
+
+    def _column(self, x, i):
+        # Line from the previous sample to sample i
+        y = self._y(self.trend[i])
+        y_prev = self._y(self.trend[i - 1]) if i > 0 else y
+        self.fbuf.vline(x, min(y, y_prev), abs(y - y_prev) + 1, 1)
+
+    def _redraw(self):
+        self.fbuf.fill(0)
+        count = len(self.trend)
+        for i in range(count):
+            self._column(self.w - count + i, i)
+        self.redraws += 1
+
+    def draw(self, lcd):
+        lcd.blit(self.fbuf, self.x, self.y)
+        self._changed = False
+
+    def refresh(self, lcd):
+        if not self._changed:
+            return False
+        self.draw(lcd)
+        lcd.mark_dirty(self.x, self.y, self.w, self.h)
+        return True
+
+
+class Screen:
+    def __init__(self, widgets):
+        self.widgets = widgets
+
+    def show(self, lcd):
+        # Draw everything if another screen is on the display, otherwise only the widgets that changed
+        if getattr(lcd, 'screen', None) is not self:
+            lcd.fill(0)
+            for widget in self.widgets:
+                widget.draw(lcd)
+            lcd.screen = self
+            lcd.show()
+        else:
+            for widget in self.widgets:
+                widget.refresh(lcd)
+            lcd.show_dirty()
+
+# Test
+
+import time
+
+if __name__ == '__main__':
+    from machine import Pin, SPI
+    from lcd12864 import LCD12864
+    spi = SPI(1, baudrate=1_000_000, sck=Pin(14, Pin.OUT), mosi=Pin(15, Pin.OUT))
+    cs = Pin(13, Pin.OUT, value=0)
+    lcd = LCD12864(spi, cs)
+
+    counter = Field(64, 0, 6, '{:>6d}')
+    bar = Bar(0, 20, 128, 8, 100)
+    screen = Screen((Label(0, 0, 'Count:'), counter, bar))
+
+    sent = lcd.bytes_sent
+    for count in range(101):
+        counter.set(count)
+        bar.set(count)
+        screen.show(lcd)
+        time.sleep_ms(50)
+    print('SPI bytes/frame: ' + str((lcd.bytes_sent - sent) // 101))
@@ -1,19 +1,48 @@
 '''
 Imports
 '''
-import lib.lcd12864 as lcd12864
-import lib.mfrc522 as mfrc522
-import lib.micropyGPS as micropyGPS
-import lib.sdcard as sdcard
-import lib.sim800l as sim800l
-from lib.ble_simple_peripheral import BLESimplePeripheral
-import bluetooth
-from machine import Pin, SPI, UART
+# The modules in lib by name (lib is on sys.path), the way they import each other: one module object each.
+# Hardware drivers are imported by the init functions, so the firmware also runs on the host (see simulate())
+import lcd12864
+import micropyGPS
+import ubx
+import gps_pipeline
+import scheduler
+import display_manager
+import screens
+import block_cache
+import storage
+import ble_sync
 import time
 import uos
-import ujson as json
-from math import sqrt, sin, cos, atan2, radians
-import lib.dht11 as dht11
+try:
+    import ujson as json
+except ImportError:
+    import json
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+if not hasattr(time, 'ticks_ms'):
+    # CPython, for simulate() (with host on the path for the MicroPython modules): the ticks functions main and lib use,
+    # from a monotonic clock that doesn't wrap
+    def ticks_ms ():
+        return int(time.monotonic() * 1000)
+
+    def ticks_us ():
+        return int(time.monotonic() * 1000000)
+
+    def ticks_add (ticks, delta):
+        return ticks + delta
+
+    def ticks_diff (end, start):
+        return end - start
+
+    time.ticks_ms = ticks_ms
+    time.ticks_us = ticks_us
+    time.ticks_add = ticks_add
+    time.ticks_diff = ticks_diff
 
 '''
 Constants
@@ -61,6 +90,39 @@ DT_BUZZER_ON = 500
 DT_BUZZER_OFF = 200
 DT_TRACKER = 10000
 DT_RST = 5000
+DT_LONG_PRESS = 1500
+DT_DEBOUNCE = 40
+DT_SMS_PROMPT = 1000
+
+# Task periods #
+DT_GPS_POLL = 50
+DT_BUTTON_POLL = 20
+DT_RFID_POLL = 200
+DT_DISPLAY = 50
+LCD_MAX_FPS = 4
+DT_TEMP = 2000
+DT_CHRONO = 1000
+GRAPH_MINUTES = 10
+DT_TREND = GRAPH_MINUTES * 60000 // 128   # One graph column per sample
+DT_BLE = 500
+DT_CHECKPOINT = 30000   # Ride checkpoint to the SD card, at most this much of a ride is lost to a power loss
+DT_STATE = 20
+
+# GPS protocol #
+GPS_UBX = False         # Switch the receiver to UBX binary output instead of NMEA
+GPS_RATE_HZ = 1         # Navigation rate: 1, 5 or 10 Hz
+GPS_FAST_BAUD = 38400   # Baudrate used for UBX output or rates above 1 Hz
+GPS_RXBUF = 1024        # UART receive buffer, must hold the GPS output of the longest blocking step
+GPS_RING_SIZE = 2048    # Interrupt drained buffers, keep receiving while the main loop is blocked
+SIM_RING_SIZE = 512
+GPS_DUAL_CORE = False   # Read and parse the GPS on core 1, core 0 only picks up the fixes
+
+# SD card #
+SD_CACHE_SLOTS = 8      # Blocks kept by the write-back cache (512 bytes each), 0 to access the card directly
+SD_RATES = (25000000, 20000000, 10000000)   # Clock rates tried after initialisation, the fastest that works is used
+
+# Debug #
+DEBUG = False           # Print the SD card rate at boot and the ride statistics (scheduler, track, journal, UARTs)
 
 # Other constants #
 CARD_ID = 3186880355
@@ -71,114 +133,67 @@ ALARM_DISTANCE = 5.0    # meters
 
 # Initializing functions #
 def init_LCD ():
+    from machine import Pin, SPI
     spi = SPI(1, baudrate=1_000_000, sck=Pin(LCD_SCK, Pin.OUT), mosi=Pin(LCD_MOSI, Pin.OUT))
     cs = Pin(LCD_CS, Pin.OUT, value=0)
     fbuf = lcd12864.LCD12864(spi, cs)
     return fbuf
 
 def init_RFID ():
+    import mfrc522
     rfid = mfrc522.MFRC522(spi_id=0, sck=RFID_SCK, miso=RFID_MISO, mosi=RFID_MOSI, cs=RFID_CS, rst=RFID_RST)
     return rfid
 
 def init_GPS ():
-    gps_module = UART(1, baudrate=9600, tx=Pin(GPS_TX), rx=Pin(GPS_RX))
+    from machine import Pin, UART
+    import uart_ring
+    gps_module = UART(1, baudrate=9600, tx=Pin(GPS_TX), rx=Pin(GPS_RX), rxbuf=GPS_RXBUF)
     time_zone = -3
-    gps = micropyGPS.MicropyGPS(time_zone)
-    return gps_module, gps
+    meas_rate_ms = 1000 // GPS_RATE_HZ
+    if GPS_UBX:
+        ubx.configure(gps_module, baudrate=GPS_FAST_BAUD, meas_rate_ms=meas_rate_ms)
+        gps = ubx.MicropyUBX(time_zone)
+    else:
+        if GPS_RATE_HZ > 1:
+            ubx.configure_nmea(gps_module, baudrate=GPS_FAST_BAUD, meas_rate_ms=meas_rate_ms)
+        gps = micropyGPS.MicropyGPS(time_zone, sentences=('RMC', 'GGA'))
+    pipeline = gps_pipeline.GPSPipeline(GPS_RATE_HZ, DT_GPS, DT_COORDS)
+    # Core 1 is never blocked by the rest of the firmware, it reads the UART directly
+    gps_rx = gps_module if GPS_DUAL_CORE else uart_ring.UARTRingBuffer(gps_module, GPS_RING_SIZE, name='gps rx')
+    return gps_rx, gps, pipeline
 
 def init_SD ():
+    from machine import Pin, SPI
+    import sdcard
     cs = Pin(SD_CS, Pin.OUT)
     spi = SPI(0, baudrate=1000000, polarity=0, phase=0, bits=8, firstbit=SPI.MSB, sck=Pin(SD_SCK), mosi=Pin(SD_MOSI), miso=Pin(SD_MISO))
-    sd = sdcard.SDCard(spi, cs)
-    return sd
-
-def init_BLE (): 
+    sd = sdcard.SDCard(spi, cs, rates=SD_RATES)
+    if DEBUG:
+        print('SD card: ' + str(sd.baudrate) + ' Hz, ' + str(sd.throughput // 1024) + ' KB/s')
+    if SD_CACHE_SLOTS:
+        sd = block_cache.BlockCache(sd, SD_CACHE_SLOTS)
+    # Mounted once, the ride index stays in memory: checking for unsynced rides doesn't touch the card
+    store = storage.Storage(sd, "/sd")
+    try:
+        store.start()
+    except OSError:
+        pass # No card yet, mounted again on the first access
+    return store
+
+def init_BLE ():
+    import bluetooth
+    from ble_simple_peripheral import BLESimplePeripheral
     ble = bluetooth.BLE()
     sp = BLESimplePeripheral(ble)
     return sp
 
 def init_SIM800L ():
-    sim_card = sim800l.SIM800(0, uart_rx=Pin(SIM_RX), uart_tx=Pin(SIM_TX), baud=115200)
+    from machine import Pin
+    import sim800l
+    sim_card = sim800l.SIM800(0, uart_rx=Pin(SIM_RX), uart_tx=Pin(SIM_TX), baud=115200, rx_buffer=SIM_RING_SIZE)
     sim_card.send_command(f'AT+CMGF={"1"}')
     return sim_card
 
-# Display updates #
-def lcd_no_info (lcd, ble_connected):
-    lcd.fill(0)
-    lcd.text('No user data', 0, 0, 1)
-    lcd.text('Please send data', 0, 10, 1)
-    if ble_connected:
-        lcd.text('Bluetooth on', 0, 50, 1)
-    else:
-        lcd.text('Bluetooth off', 0, 50, 1)
-    lcd.show()
-
-def lcd_idle (lcd, data_synced, ble_connected, gps_connected):
-    lcd.fill(0)
-    lcd.text('Press button', 0, 0, 1)
-    lcd.text('to start', 0, 10, 1)
-    if data_synced:
-        lcd.text('Data synced', 0, 20, 1)
-    else:
-        if not ble_connected:
-            lcd.text('Unsynced data', 0, 20, 1)
-            lcd.text('Please connect', 0, 30, 1)
-            lcd.text('to phone', 0, 40, 1)
-    if not gps_connected:
-        lcd.text('No GPS signal', 0, 50, 1)
-    lcd.show()
-
-def lcd_sending (lcd, synced):
-    lcd.fill(0)
-    lcd.text('Syncing data', 0, 0, 1)
-    lcd.text('Please wait', 0, 10, 1)
-    lcd.text('...', 0, 20, 1)
-    if synced:
-        lcd.text('Done', 0, 30, 1)
-    lcd.show()
-
-def lcd_running_paused (lcd, speed, chronometer, date, current_time, calories, temp, dist, gps_connected):
-    lcd.fill(0)
-    lcd.text(current_time, 0, 0, 1)
-    lcd.text(date, 48, 0, 1)
-    lcd.text(chronometer_str(chronometer), 0, 10, 1)
-    if dist >= 1.0:
-        lcd.text("dist: " + str(round(dist,1)) + 'km', 0, 20, 1)
-    else:
-        lcd.text("dist: " + str(round(dist*1000)) + 'm', 0, 20, 1)
-    lcd.text("cal: " + str(round(calories,1)) + 'kcal', 0, 30, 1)
-    lcd.text("speed: " + str(round(speed,1)) + 'km/h', 0, 40, 1)
-    lcd.text(str(round(temp)), 88, 50, 1)
-    lcd.ellipse(105, 50, 1, 1, 1, False)
-    lcd.text('C', 110, 50, 1)
-    if not gps_connected:
-        lcd.text('No signal', 0, 50, 1)
-    lcd.show()
-
-def lcd_saving (lcd, error):
-    lcd.fill(0)
-    lcd.text('Saving...', 0, 0, 1)
-    if error:
-        lcd.text('Error saving', 0, 10, 1)
-        lcd.text('Please wait', 0, 20, 1)
-    lcd.show()
-
-def lcd_alarm (lcd, gps_connected):
-    lcd.fill(0)
-    lcd.text('Alarm on', 0, 0, 1)
-    if gps_connected:
-        lcd.text('GPS signal OK', 0, 10, 1)
-    else:
-        lcd.text('No GPS signal', 0, 10, 1)
-    lcd.show()
-
-# Increment the chronometer counter
-def incr_sec_counter (counter, start_time):
-    if time.time() - start_time >= 1:
-        counter += 1
-        start_time = time.time()
-    return counter, start_time
-
 # Convert total of seconds in hours, minutes and seconds
 def calculate_time (sec_counter):
     hours = int(sec_counter / 3600)
@@ -186,19 +201,6 @@ def calculate_time (sec_counter):
     seconds = int(sec_counter % 60)
     return hours, minutes, seconds
 
-# Calculate distance between two points using Haversine formula (in km)
-def distance (lat0, lon0, lat1, lon1):
-    R = 6371.0
-    lat0 = radians(lat0)
-    lon0 = radians(lon0)
-    lat1 = radians(lat1)
-    lon1 = radians(lon1)
-    dlon = lon1 - lon0
-    dlat = lat1 - lat0
-    a = sin(dlat / 2)**2 + cos(lat0) * cos(lat1) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    return R * c
-
 # Estimate calories burned (kcal/s) using speed in mph, weight in kg
 # Source: https://sites.google.com/site/compendiumofphysicalactivities/Activity-Categories/bicycling?authuser=0
 def calculate_calories (weight, speed):
@@ -219,76 +221,28 @@ def calculate_calories (weight, speed):
         mets = 15.8
     return (mets * 3.5 * weight / 200.0) / 60.0
 
-def chronometer_str (chronometer):
-    hours = str(chronometer[0])
-    minutes = str(chronometer[1])
-    seconds = str(chronometer[2])
-    if len(hours) == 1:
-        hours = "0" + hours
-    if len(minutes) == 1:
-        minutes = "0" + minutes
-    if len(seconds) == 1:
-        seconds = "0" + seconds
-    return hours + ":" + minutes + ":" + seconds
-
-def write_data_SD (vfs, data):
-    uos.mount(vfs, "/sd")
-    i = 0
-    for file in uos.ilistdir("/sd"):
-        if file[0].split(".")[-1] == "txt":
-            i = max(i, int(file[0].split("_")[1].split(".")[0]))
-    i += 1
+def coordinates_str (lat_udeg, lon_udeg):
+    # From the fix in microdegrees, no float formatting
+    return micropyGPS.format_coordinate(lat_udeg) + ',' + micropyGPS.format_coordinate(lon_udeg)
+
+def write_data_SD (store, data):
     if data:
         try:
-            with open("/sd/data_" + str(i) + ".txt", "w") as f:
-                for line in data:
-                    f.write(line + "\n")
-                f.write('$') # Conventioned end of file character
-                uos.umount("/sd")
+            store.save_ride(data)
             return True
         except:
-            uos.umount("/sd")
             return False
 
-def read_data_SD (vfs):
-    data = []
-    tmp = []
-    if is_SD_empty(vfs):
-        return data
-    uos.mount(vfs, "/sd")
-    for file in uos.ilistdir("/sd"):
-        if file[0].split(".")[-1] == "txt":
-            with open("/sd/" + file[0], "r") as f:
-                tmp.append(file[0])
-                tmp.append(f.read())
-                data.append(tmp)
-                tmp = []
-            
-    uos.umount("/sd")    
-    return data
-
-def is_SD_empty (vfs):
-    uos.mount(vfs, "/sd")
-    count = 0
-    for file in uos.ilistdir("/sd"):
-        if file[0].split(".")[-1] == "txt":
-            count += 1
-    if count == 0:
-        uos.umount("/sd")
-        return True
-    uos.umount("/sd")
-    return False
+def is_SD_empty (store):
+    return store.is_empty()
 
 def send_data_BLE (sp, data):
-    data_bytes = bytes(data, 'utf-8')
-    num_bytes = len(data_bytes)
-    packets = [data_bytes[i:i+BLE_PACKET_SIZE] for i in range(0, num_bytes, BLE_PACKET_SIZE)]
-    for packet in packets:
-        if sp.is_connected():
-            sp.send(packet)
-        else:
-            return False
-    return True
+    return ble_sync.send(sp, bytes(data, 'utf-8'), BLE_PACKET_SIZE)
+
+async def send_ride_BLE (sp, store, ride, buffer):
+    # Stream a ride file, a chunk at a time
+    with store.open_ride(ride) as f:
+        return await ble_sync.send_file(sp, f, buffer, BLE_PACKET_SIZE)
 
 def save_user_data (data):
     with open("user_data.json", "w") as f:
@@ -307,16 +261,19 @@ def receive_data_BLE (sp):
     if sp.is_connected():
         sp.on_write(on_rx)
 
-def send_sms (sim800l, message, number):
-    # send sms
-    sim800l.send_command("AT+CMGS=\"" + number + "\"")
+async def sleep_ms (ms):
+    await asyncio.sleep(ms / 1000)
+
+async def send_sms (sim800l, message, number):
+    # send sms, waiting for the '>' prompt without blocking the other tasks
+    sim800l.uart.write("AT+CMGS=\"" + number + "\"\r")
+    t_start = time.ticks_ms()
+    response = b''
+    while time.ticks_diff(time.ticks_ms(), t_start) < DT_SMS_PROMPT and b'>' not in response:
+        await sleep_ms(10)
+        if sim800l.rx.any():
+            response += sim800l.rx.read(sim800l.rx.any())
     sim800l.uart.write(message + '\n\n' + SMS_HASH + chr(26))
-    
-def button_pressed (button, t_current, t_button):
-    if button.value() == 0:
-        if t_current - t_button > DT_BUTTON:
-            return True
-    return False
 
 def rfid_read (rfid, CARD_ID, t_current=None, t_rfid=None):
     if t_current and t_rfid:
@@ -335,17 +292,387 @@ def rfid_read (rfid, CARD_ID, t_current=None, t_rfid=None):
     return False
 
 def check_movement (lat0, lon0, lat1, lon1):
-    return (distance(lat0, lon0, lat1, lon1)*1000 > ALARM_DISTANCE)
-
-def reset_device (vfs):
-    uos.mount(vfs, "/sd")
-    for file in uos.ilistdir("/sd"):
-        if file[0].split(".")[-1] == "txt":
-            uos.remove("/sd/" + file[0])
-    uos.umount("/sd")
+    return (gps_pipeline.distance(lat0, lon0, lat1, lon1)*1000 > ALARM_DISTANCE)
+
+def reset_device (store):
+    try:
+        store.clear()
+    except OSError:
+        pass
     uos.remove("/user_data.json")
 
 
+# Tasks
+
+class BikeBrain:
+    # State shared by the firmware tasks. Input tasks (GPS, buttons, RFID) publish data and events, the state machine
+    # task coordinates the others through the current state, each periodic job runs at its own cadence
+    def __init__ (self, lcd, gps_rx, gps, pipeline, store, rfid, sp, sim_card, stop_start, pause_resume, buzzer, temp, led, state, gps_exchange=None):
+        self.lcd = lcd
+        self.display = display_manager.DisplayManager(lcd, LCD_MAX_FPS)
+        self.gps_rx = gps_rx
+        self.gps = gps
+        self.gps_exchange = gps_exchange    # Set in dual core mode, gps_rx and gps then belong to core 1
+        self.pipeline = pipeline
+        self.store = store
+        self.rfid = rfid
+        self.sp = sp
+        self.sim_card = sim_card
+        self.stop_start = stop_start
+        self.pause_resume = pause_resume
+        self.buzzer = buzzer
+        self.temp = temp
+        self.led = led
+        self.sms_lock = asyncio.Lock()
+
+        # States: no_info, idle, sending, running, paused, saving, alarm_idle, alarm_active
+        self.state = state
+
+        # Current GPS data
+        self.gps_data = None
+        self.lat = self.lon = self.speed = 0.0
+        self.lat_udeg = self.lon_udeg = 0   # Same position in microdegrees, for the messages
+        self.altitude = 0.0
+        self.date = self.clock = ""
+
+        # Registered data
+        self.calories = 0.0
+        self.alarm_lat = self.alarm_lon = 0.0
+        self.temperature = 0.0
+        self.sec_counter = 0
+        self.chronometer = (0, 0, 0)
+        self.checkpoint_seconds = -1    # Ride seconds at the last checkpoint
+
+        # Data list format: [start date, start time, finish date, finish time, elapsed time, distance, max speed, calories],
+        # the coordinates are logged to the SD card during the ride and saved after it
+        self.data_list = []
+
+        # Storage and sync status
+        self.sync_flag = True
+        self.synced = False
+        self.sync_buffer = bytearray(ble_sync.CHUNK_SIZE)  # Rides are sent from the SD card through this buffer
+        self.save_error = False
+
+        # Events, set by the input tasks and consumed by the state machine
+        self.ss_pressed = False
+        self.pr_pressed = False
+        self.pr_long = False
+        self.rst_pressed = False
+        self.card_read = False
+
+        # Button edge detection
+        self.ss_last = self.pr_last = 1
+        self.t_ss = self.t_pr = time.ticks_ms()
+        self.pr_held = 0    # Long press events already sent for the current pause/resume press (1: long, 2: reset)
+
+        # Ride screen: numbers or graphs
+        self.graph_screen = False
+
+        # Periodic jobs, the chronometer runs every missed second so no ride time is lost
+        self.scheduler = scheduler.Scheduler()
+        self.scheduler.add('gps', DT_GPS_POLL, self.gps_job)
+        self.scheduler.add('buttons', DT_BUTTON_POLL, self.buttons_job)
+        self.scheduler.add('temperature', DT_TEMP, self.temperature_job)
+        self.scheduler.add('chronometer', DT_CHRONO, self.chronometer_job, catch_up=True)
+        self.scheduler.add('display', DT_DISPLAY, self.display_job)
+        self.scheduler.add('tracker', DT_TRACKER, self.tracker_job)
+        self.scheduler.add('trend', DT_TREND, self.trend_job)
+        self.scheduler.add('checkpoint', DT_CHECKPOINT, self.checkpoint_job)
+
+    async def sms (self, message):
+        # One SMS at a time, the tracker and the state machine share the SIM800L
+        async with self.sms_lock:
+            await send_sms(self.sim_card, message + " (" + coordinates_str(self.lat_udeg, self.lon_udeg) + ")", NUMBER)
+
+    def resume_ride (self, checkpoint):
+        # Ride interrupted by a power loss, back to where and how it was checkpointed: running, or paused if it was
+        self.data_list = [checkpoint['start_date'], checkpoint['start_time']]
+        self.sec_counter = checkpoint['seconds']
+        self.chronometer = calculate_time(self.sec_counter)
+        self.pipeline.distance = checkpoint['distance']
+        self.pipeline.max_speed = checkpoint['max_speed']
+        self.calories = checkpoint['calories']
+        self.checkpoint_seconds = self.sec_counter
+        self.state = 'paused' if checkpoint['paused'] else 'running'
+
+    def ride_stats (self):
+        # Print the statistics of the ride (with DEBUG) and start over for the next one
+        if DEBUG:
+            print(self.scheduler.report())
+            print(self.store.recorder.report())
+            print(self.store.journal.report())
+        for rx in (self.gps_rx, self.sim_card.rx):
+            if hasattr(rx, 'report'):   # Ring buffer, not the UART itself
+                if DEBUG:
+                    print(rx.report())
+                rx.reset_stats()
+        self.scheduler.reset_stats()
+
+    def stop_ride (self):
+        self.data_list.append(self.date) # Save finish date (day/month/year)
+        self.data_list.append(self.clock) # Save finish time (hour:minute)
+        self.data_list.append(screens.chronometer_str(self.chronometer)) # Save elapsed time (hours:minutes:seconds)
+        self.data_list.append(str(round(self.pipeline.distance*1000))) # Save distance (m)
+        self.data_list.append(str(round(self.pipeline.max_speed,1))) # Save max speed (km/h)
+        self.data_list.append(str(round(self.calories,1))) # Save calories (kcal)
+        self.chronometer = (0, 0, 0)
+        self.sec_counter = 0
+        self.pipeline.reset()
+        self.calories = 0.0
+        screens.SPEED_GRAPH.clear()
+        screens.ALTITUDE_GRAPH.clear()
+        self.graph_screen = False
+
+    # Periodic jobs, run by the scheduler
+
+    def gps_job (self):
+        if self.gps_exchange is None:
+            gps_data, gps_changed = micropyGPS.get_data(self.gps, self.gps_rx)
+            timestamp = self.gps.timestamp
+            self.altitude = self.gps.altitude
+            fix = self.gps.get_fix()
+        else:
+            gps_data, gps_changed = self.gps_exchange.get_data()
+            timestamp = self.gps_exchange.timestamp
+            self.altitude = self.gps_exchange.altitude
+            fix = self.gps_exchange
+        self.gps_data = gps_data
+        if gps_changed and gps_data:
+            self.lat, self.lon, self.speed, self.date, self.clock = gps_data
+            self.lat_udeg = fix.latitude_udeg
+            self.lon_udeg = fix.longitude_udeg
+
+            # Integrate distance and max speed from every new fix (only while running), decimate the displayed speed
+            if self.state == 'running' or self.state == 'paused':
+                self.pipeline.add_fix(self.lat, self.lon, self.speed, timestamp, self.state == 'running')
+                if self.pipeline.take_track_point():
+                    try:
+                        self.store.add_point(timestamp[0]*3600 + timestamp[1]*60 + int(timestamp[2]), self.lat, self.lon, self.speed)
+                    except OSError:
+                        pass # Point lost, the card is mounted again on the next one
+
+    def buttons_job (self):
+        t_current = time.ticks_ms()
+        ss = self.stop_start.value()
+        pr = self.pause_resume.value()
+
+        # A press is a released to pressed edge, ignored for DT_BUTTON after the previous one
+        if ss == 0 and self.ss_last == 1 and time.ticks_diff(t_current, self.t_ss) > DT_BUTTON:
+            self.t_ss = t_current
+            self.ss_pressed = True
+
+        # Pause/resume: released before DT_LONG_PRESS it's a press, held longer it's a long press (switches the ride
+        # screen), held for DT_RST it resets the device
+        if pr == 0 and self.pr_last == 1:
+            self.t_pr = t_current
+            self.pr_held = 0
+        elif pr == 0:
+            held = time.ticks_diff(t_current, self.t_pr)
+            if self.pr_held == 0 and held > DT_LONG_PRESS:
+                self.pr_held = 1
+                self.pr_long = True
+            elif self.pr_held == 1 and held > DT_RST:
+                self.pr_held = 2
+                self.rst_pressed = True
+        elif self.pr_last == 0 and self.pr_held == 0 and time.ticks_diff(t_current, self.t_pr) >= DT_DEBOUNCE:
+            self.pr_pressed = True
+
+        self.ss_last = ss
+        self.pr_last = pr
+
+    def temperature_job (self):
+        if self.state == 'running' or self.state == 'paused':
+            self.temp.measure()
+            tmp = self.temp.temperature
+            if tmp != -1:
+                self.temperature = tmp
+
+    def chronometer_job (self):
+        # Count ride seconds and calories while running
+        if self.state == 'running':
+            self.sec_counter += 1
+            self.chronometer = calculate_time(self.sec_counter)
+            self.calories += calculate_calories(WEIGHT, self.speed*0.6213711922)
+
+    def display_job (self):
+        # Models hold the values as displayed (rounded), the screen is only redrawn when one of them changes
+        state = self.state
+        gps_flag = self.gps_data is not None
+        if state == 'no_info':
+            self.display.update(state, screens.lcd_no_info, (self.sp.is_connected(),))
+        elif state == 'idle':
+            self.display.update(state, screens.lcd_idle, (self.sync_flag, self.sp.is_connected(), gps_flag))
+        elif state == 'sending':
+            self.display.update(state, screens.lcd_sending, (self.synced,))
+        elif (state == 'running' or state == 'paused') and self.graph_screen:
+            self.display.update('graph', screens.lcd_graph, (screens.SPEED_GRAPH.trend.pushed,))
+        elif state == 'running' or state == 'paused':
+            dist = self.pipeline.distance
+            dist = round(dist, 1) if dist >= 1.0 else round(dist, 3)
+            self.display.update('running', screens.lcd_running_paused, (round(self.pipeline.display_speed, 1), self.chronometer, self.date, self.clock,
+                                                                round(self.calories, 1), round(self.temperature), dist, gps_flag))
+        elif state == 'saving':
+            self.display.update(state, screens.lcd_saving, (self.save_error,))
+        elif state == 'alarm_idle' or state == 'alarm_active':
+            self.display.update('alarm', screens.lcd_alarm, (gps_flag,))
+
+    def trend_job (self):
+        if self.state == 'running':
+            screens.SPEED_GRAPH.push(self.pipeline.display_speed)
+            screens.ALTITUDE_GRAPH.push(self.altitude)
+
+    def checkpoint_job (self):
+        # Only while the ride goes on, nothing changes while paused
+        if self.state == 'running' and self.sec_counter != self.checkpoint_seconds:
+            self.checkpoint()
+
+    def checkpoint (self):
+        try:
+            self.store.checkpoint(self.sec_counter, self.pipeline.distance, self.pipeline.max_speed, self.calories,
+                                  self.state == 'paused')
+            self.checkpoint_seconds = self.sec_counter
+        except OSError:
+            pass # Tried again on the next one
+
+    def tracker_job (self):
+        if self.state == 'alarm_active' and self.gps_data:
+            asyncio.create_task(self.sms("Current location:"))
+
+    # Tasks
+
+    async def rfid_task (self):
+        while True:
+            if self.state in ('idle', 'alarm_idle', 'alarm_active') and rfid_read(self.rfid, CARD_ID):
+                self.card_read = True
+                await sleep_ms(DT_RFID)    # Card is usually still in range, don't read it again right away
+            else:
+                await sleep_ms(DT_RFID_POLL)
+
+    async def buzzer_task (self):
+        while True:
+            if self.state == 'alarm_active':
+                self.buzzer.value(1)
+                self.led.value(1)
+                await sleep_ms(DT_BUZZER_ON)
+                self.buzzer.value(0)
+                self.led.value(0)
+                await sleep_ms(DT_BUZZER_OFF)
+            else:
+                await sleep_ms(DT_STATE)
+
+    async def storage_task (self):
+        # SD writer, saves the finished ride
+        while True:
+            if self.state == 'saving':
+                self.save_error = False
+                await sleep_ms(1000)
+                if write_data_SD(self.store, self.data_list):
+                    self.data_list = []
+                    self.sync_flag = False
+                    self.state = 'idle'
+                else:
+                    self.save_error = True
+                    await sleep_ms(1000)
+            else:
+                await sleep_ms(DT_STATE)
+
+    async def ble_task (self):
+        # Receives the user data and syncs the saved rides with the phone
+        while True:
+            if self.state == 'no_info':
+                receive_data_BLE(self.sp)
+            elif self.state == 'idle':
+                self.sync_flag = is_SD_empty(self.store)
+            elif self.state == 'sending':
+                self.synced = False
+                await sleep_ms(1000)
+                sent = False
+                for ride in self.store.unsynced():
+                    try:
+                        if await send_ride_BLE(self.sp, self.store, ride, self.sync_buffer):
+                            self.store.mark_synced(ride, False)
+                            sent = True
+                    except OSError:
+                        pass # Sent again on the next try
+                if sent:
+                    try:
+                        self.store.save_index() # Once for the whole session
+                    except OSError:
+                        pass # The rides are sent again
+                if is_SD_empty(self.store) and send_data_BLE(self.sp, '*'):
+                    self.synced = True
+                    self.sync_flag = True
+                    await sleep_ms(1000)
+                    self.state = 'idle'
+                continue
+            await sleep_ms(DT_BLE)
+
+    async def state_task (self):
+        global user_data_flag
+        while True:
+            state = self.state
+            gps_flag = self.gps_data is not None
+
+            if state == 'no_info':
+                if user_data_flag:
+                    save_user_data({"number": NUMBER, "weight": WEIGHT, "hash": SMS_HASH})
+                    self.state = 'idle'
+
+            elif state == 'idle':
+                if self.rst_pressed:
+                    reset_device(self.store)
+                    user_data_flag = False
+                    self.state = 'no_info'
+                elif gps_flag and self.ss_pressed:
+                    self.data_list.append(self.date) # Save start date
+                    self.data_list.append(self.clock) # Save start time
+                    try:
+                        self.store.start_track(self.date, self.clock)
+                    except OSError:
+                        pass # Ride saved without its track
+                    self.state = 'running'
+                    await self.sms("Exercise started")
+                elif gps_flag and self.card_read:
+                    self.alarm_lat = self.lat
+                    self.alarm_lon = self.lon
+                    self.led.value(1)
+                    self.state = 'alarm_idle'
+                    await self.sms("Alarm on")
+                elif self.sp.is_connected() and not self.sync_flag:
+                    self.state = 'sending'
+
+            elif state == 'running' or state == 'paused':
+                if self.ss_pressed:
+                    self.stop_ride()
+                    self.ride_stats()
+                    self.state = 'saving'
+                    await self.sms("Exercise stopped")
+                elif self.pr_pressed:
+                    self.state = 'paused' if state == 'running' else 'running'
+                    self.checkpoint() # A power loss resumes the ride as it is now
+                elif self.pr_long:
+                    self.graph_screen = not self.graph_screen
+
+            elif state == 'alarm_idle' or state == 'alarm_active':
+                if self.card_read:
+                    self.state = 'idle'
+                    self.buzzer.value(0)
+                    self.led.value(0)
+                    await self.sms("Alarm off")
+                elif state == 'alarm_idle' and check_movement(self.alarm_lat, self.alarm_lon, self.lat, self.lon):
+                    self.state = 'alarm_active'
+                    await self.sms("Alarm triggered")
+
+            # Events only count in the state they happened in
+            self.ss_pressed = self.pr_pressed = self.pr_long = self.rst_pressed = self.card_read = False
+            await sleep_ms(DT_STATE)
+
+    async def run (self):
+        for task in (self.scheduler.run, self.rfid_task, self.buzzer_task, self.storage_task, self.ble_task):
+            asyncio.create_task(task())
+        await self.state_task()
+
+
 # Main
 
 try:
@@ -358,256 +685,189 @@ try:
 except:
     user_data_flag = False
 
-# States: no_info, idle, sending, running, paused, saving, alarm_idle, alarm_active
-state = ('no_info' if not user_data_flag else 'idle')
-
-# Initialize peripherals
-lcd = init_LCD()
-gps_module, gps = init_GPS()
-sd = init_SD()
-vfs = uos.VfsFat(sd)
-rfid = init_RFID()
-sp = init_BLE()
-sim_card = init_SIM800L()
-stop_start = Pin(STOP_START, Pin.IN, Pin.PULL_UP)
-pause_resume = Pin(PAUSE_RESUME, Pin.IN, Pin.PULL_UP)
-buzzer = Pin(Pin(BUZZER), Pin.OUT)
-buzzer.value(0)
-buzzer_state = False
-temp = dht11.DHT11(Pin(TEMP, Pin.OUT, Pin.PULL_DOWN))
-led = Pin(LED, Pin.OUT)
-led.value(0)
-
-# Current GPS data
-lat = lon = speed = 0.0
-date = clock = ""
-prev_lat = prev_lon = ""
-
-# Registered data
-start_date = start_clock = finish_date = finish_clock = ""
-calories = 0.0
-travel_distance = 0.0
-max_speed = 0.0
-coordinates = []
-alarm_lat = alarm_lon = 0.0
-temperature = 0.0
-
-# Data list format: [start date, start time, finish date, finish time, elapsed time, distance, max speed, calories, coordinates]
-data_list = []
-
-# Manage debouncing and periodic data updates
-t_rfid = t_gps = t_coords = t_ss_button = t_pr_button = t_buzzer = t_tracker = t_rst = 0
-t_current = 0
-
-# Manage pausable chronometer
-start_time = 0
-sec_counter = 0
-chronometer = (0, 0, 0)
-
-# Main loop
-while True:
-
-    gps_data = micropyGPS.get_data(gps, gps_module)
-    if gps_data:
-        lat = gps_data[0]
-        lon = gps_data[1]
-        speed = gps_data[2]
-        date = gps_data[3]
-        clock = gps_data[4]
-
-    t_current = time.ticks_ms()
-
-    if state == 'no_info':
-        lcd_no_info(lcd, sp.is_connected())
-        receive_data_BLE(sp)
-        if user_data_flag:
-            save_user_data({"number": NUMBER, "weight": WEIGHT, "hash": SMS_HASH})
-            state = 'idle'
-
-    elif state == 'idle':
-        if pause_resume.value() == 0:
-            if t_current - t_rst > DT_RST:
-                reset_device(vfs)
-                user_data_flag = False
-                state = 'no_info'
-                continue
-        else:
-            t_rst = time.ticks_ms()
-
-        if is_SD_empty(vfs):
-            sync_flag = True
-        else:
-            sync_flag = False
-
-        if sp.is_connected():
-            ble_flag = True
-        else:
-            ble_flag = False
-
-        if gps_data:
-            gps_flag = True
-            if stop_start.value() == 0:
-                send_sms(sim_card, "Exercise started (" + str(lat) + "," + str(lon) + ")", NUMBER)
-                t_ss_button = time.ticks_ms()
-                start_time = time.time()
-                data_list.append(date) # Save start date
-                data_list.append(clock) # Save start time
-                state = 'running'
-            elif rfid_read(rfid, CARD_ID):
-                t_rfid = time.ticks_ms()
-                alarm_lat = lat
-                alarm_lon = lon
-                send_sms(sim_card, "Alarm on (" + str(lat) + "," + str(lon) + ")", NUMBER)
-                led.value(1)
-                state = 'alarm_idle'
-        else:
-            gps_flag = False
-
-        if ble_flag and not sync_flag:
-            state = 'sending'
-
-        lcd_idle(lcd, sync_flag, ble_flag, gps_flag)
-
-    elif state == 'sending':
-        lcd_sending(lcd, False)
-        time.sleep(1)
-        data = read_data_SD(vfs)
-        uos.mount(vfs, "/sd")
-        for d in data:
-            if send_data_BLE(sp, d[1]):
-                uos.remove("/sd/" + d[0])
-        uos.umount("/sd")
-        if is_SD_empty(vfs) and send_data_BLE(sp, '*'):
-            lcd_sending(lcd, True)
-            time.sleep(1)
-            state = 'idle'
-
-    elif state == 'running' or state == 'paused':
+def main ():
+    from machine import Pin
+    import dht11
+
+    # Initialize peripherals
+    lcd = init_LCD()
+    gps_rx, gps, pipeline = init_GPS()
+    store = init_SD()
+    rfid = init_RFID()
+    sp = init_BLE()
+    sim_card = init_SIM800L()
+    stop_start = Pin(STOP_START, Pin.IN, Pin.PULL_UP)
+    pause_resume = Pin(PAUSE_RESUME, Pin.IN, Pin.PULL_UP)
+    buzzer = Pin(Pin(BUZZER), Pin.OUT)
+    buzzer.value(0)
+    temp = dht11.DHT11(Pin(TEMP, Pin.OUT, Pin.PULL_DOWN))
+    led = Pin(LED, Pin.OUT)
+    led.value(0)
+
+    gps_exchange = None
+    if GPS_DUAL_CORE:
+        import gps_thread
+        gps_exchange = gps_thread.FixExchange()
+        gps_thread.GPSThread(gps_rx, gps, gps_exchange).start()
+
+    state = ('no_info' if not user_data_flag else 'idle')
+    device = BikeBrain(lcd, gps_rx, gps, pipeline, store, rfid, sp, sim_card, stop_start, pause_resume, buzzer, temp, led, state, gps_exchange)
+    try:
+        checkpoint = store.recover()
+    except OSError:
+        checkpoint = None
+    if checkpoint is not None:
+        device.resume_ride(checkpoint)
+    asyncio.run(device.run())
+
+
+# Host simulation
+
+class SimPin:
+    # Button (1 when released), buzzer or LED
+    def __init__(self, value=1):
+        self._value = value
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = value
+
+class SimGPS:
+    # GPS UART: RMC and GGA every second, riding north at speed km/h
+    def __init__(self, speed=20.0):
+        self.speed = speed
+        self.t_start = time.ticks_ms()
+        self.seconds = 0    # Seconds of output generated
+        self.pending = b''
+
+    def any(self):
+        while self.seconds <= time.ticks_diff(time.ticks_ms(), self.t_start) // 1000:
+            t = self.seconds
+            utc = '12{0:02d}{1:02d}.00'.format(t // 60 % 60, t % 60)
+            lat = '25{0:08.5f}'.format(24.0 - t * self.speed / 3.6 / 1852)    # A minute of latitude is 1852 m
+            self.pending += gps_pipeline.nmea_sentence('GPRMC,' + utc + ',A,' + lat + ',S,04912.00000,W,' +
+                                                       '{0:.1f}'.format(self.speed / 1.852) + ',0.0,170524,,,A').encode()
+            self.pending += gps_pipeline.nmea_sentence('GPGGA,' + utc + ',' + lat +
+                                                       ',S,04912.00000,W,1,08,1.01,900.0,M,-5.0,M,,').encode()
+            self.seconds += 1
+        return len(self.pending)
+
+    def read(self, n):
+        data = self.pending[:n]
+        self.pending = self.pending[n:]
+        return data
 
-        temp.measure()
-        tmp = temp.temperature
-        if tmp != -1:
-            temperature = tmp
+class SimRFID:
+    # No card in range
+    OK = 0
+    NOTAGERR = 1
+    REQIDL = 0x26
 
-        if state == 'paused':
-            start_time = time.time()
+    def init(self):
+        pass
 
-        sec_counter, start_time = incr_sec_counter(sec_counter, start_time)
+    def request(self, mode):
+        return self.NOTAGERR, None
 
-        if gps_data:
-            gps_flag = True
-        else:
-            gps_flag = False
-
-        # Check if button was pressed to stop running
-        if button_pressed (stop_start, t_current, t_ss_button):
-            t_button = time.ticks_ms()
-            data_list.append(date) # Save finish date (day/month/year)
-            data_list.append(clock) # Save finish time (hour:minute)
-            data_list.append(chronometer_str(chronometer)) # Save elapsed time (hours:minutes:seconds)
-            data_list.append(str(round(travel_distance*1000))) # Save distance (m)
-            data_list.append(str(round(max_speed,1))) # Save max speed (km/h)
-            data_list.append(str(round(calories,1))) # Save calories (kcal)
-            for coord in coordinates:
-                data_list.append(coord) # Save coordinates
-            coordinates = []
-            chronometer = (0, 0, 0)
-            sec_counter = 0
-            prev_lat = prev_lon = ""
-            travel_distance = 0.0
-            max_speed = 0.0
-            calories = 0.0
-            state = 'saving'    # Update state
-            send_sms(sim_card, "Exercise stopped (" + str(lat) + "," + str(lon) + ")", NUMBER)
-            continue
-        
-        # Check if button was pressed to pause/resume
-        if button_pressed (pause_resume, t_current, t_pr_button):
-            t_pr_button = time.ticks_ms()
-            state = 'paused' if state == 'running' else 'running'    # Update state
-
-        if state == 'running':
-
-            chronometer = calculate_time(sec_counter)
-
-            if t_current - t_gps > DT_GPS:    # Update from gps every second
-                t_gps = time.ticks_ms()
-
-                if prev_lat == "" and prev_lon == "":
-                    prev_lat = lat
-                    prev_lon = lon
-
-                travel_distance += distance(float(prev_lat), float(prev_lon), float(lat), float(lon))
-
-                if speed > max_speed:
-                    max_speed = speed
-                
-                calories += calculate_calories(WEIGHT, speed*0.6213711922)
-
-                prev_lat = lat
-                prev_lon = lon
-                
-            if t_current - t_coords > DT_COORDS:
-                t_coords = time.ticks_ms()
-                if gps_data:
-                    coordinates.append(str(lat) + "," + str(lon))
+class SimSIM800L:
+    # Answers the SMS prompt and prints the messages
+    def __init__(self):
+        self.uart = self
+        self.rx = self
+        self._response = b''
 
+    def write(self, data):
+        if data.startswith('AT+CMGS'):
+            self._response = b'> '
         else:
-            pass
-        
-        lcd_running_paused(lcd, speed, chronometer, date, clock, calories, temperature, travel_distance, gps_flag)
+            print('SMS: ' + data.split('\n')[0])
 
+    def any(self):
+        return len(self._response)
 
-    elif state == 'saving':
-        lcd_saving(lcd, False)
-        time.sleep(1)
-        if write_data_SD(vfs, data_list):
-            data_list = []
-            state = 'idle'
-        else:
-            lcd_saving(lcd, True)
-            time.sleep(1)
-
-    elif state == 'alarm_idle' or state == 'alarm_active':
-        if gps_data:
-            lcd_alarm(lcd, True)
-        else:
-            lcd_alarm(lcd, False)
-
-        if rfid_read(rfid, CARD_ID, t_current, t_rfid):
-            t_rfid = time.ticks_ms()
-            buzzer.value(0)
-            buzzer_state = False
-            send_sms(sim_card, "Alarm off (" + str(lat) + "," + str(lon) + ")", NUMBER)
-            led.value(0)
-            state = 'idle'
-            continue
-        
-        if state == 'alarm_idle':
-            if check_movement(float(alarm_lat), float(alarm_lon), float(lat), float(lon)):
-                send_sms(sim_card, "Alarm triggered (" + str(lat) + "," + str(lon) + ")", NUMBER)
-                state = 'alarm_active'
-                buzzer.value(1)
-                buzzer_state = True
-                led.value(1)
-        else:
+    def read(self, n):
+        data = self._response[:n]
+        self._response = self._response[n:]
+        return data
 
-            if buzzer_state:
-                if t_current - t_buzzer > DT_BUZZER_ON:
-                    t_buzzer = time.ticks_ms()
-                    buzzer.value(0)
-                    buzzer_state = False
-                    led.value(0)
-            else:
-                if t_current - t_buzzer > DT_BUZZER_OFF:
-                    t_buzzer = time.ticks_ms()
-                    buzzer.value(1)
-                    buzzer_state = True
-                    led.value(1)
-
-            if t_current - t_tracker > DT_TRACKER:
-                t_tracker = time.ticks_ms()
-                if gps_data:
-                    send_sms(sim_card, "Current location: (" + str(lat) + "," + str(lon) + ")", NUMBER)
+class SimDHT11:
+    temperature = 22
+
+    def measure(self):
+        pass
+
+class SimPeripheral(ble_sync.FakePeripheral):
+    # Phone, connected when connected is set
+    connected = False
+
+    def is_connected(self):
+        return self.connected
+
+    def on_write(self, callback):
+        pass
+
+class SimCard(block_cache.FileBlockDevice):
+    # SD card image
+    def init_card(self, baudrate):
+        pass
+
+async def sim_press (button, ms=100):
+    button.value(0)
+    await sleep_ms(ms)
+    button.value(1)
+
+async def sim_wait (condition, timeout_ms=10000):
+    t_start = time.ticks_ms()
+    while not condition():
+        if time.ticks_diff(time.ticks_ms(), t_start) > timeout_ms:
+            raise RuntimeError('simulation stuck')
+        await sleep_ms(50)
+
+def simulate (ride_s=20, image='sim_sd.img', mount_point='/sim'):
+    # Run the firmware tasks on the host with simulated peripherals: wait for a GPS fix, ride for ride_s seconds, stop,
+    # save the ride on a FAT image of the SD card and sync it to the phone. On CPython (see host/uos.py) the files go
+    # to the mount_point directory instead
+    global DEBUG
+    DEBUG = True    # Show the ride statistics
+    card = SimCard(image)
+    uos.VfsFat.mkfs(card)
+    store = storage.Storage(block_cache.BlockCache(card, SD_CACHE_SLOTS), mount_point)
+    store.start()
+    lcd = lcd12864.LCD12864(lcd12864.FakeSPI(), lcd12864.FakePin())
+    gps = micropyGPS.MicropyGPS(-3, sentences=('RMC', 'GGA'))
+    pipeline = gps_pipeline.GPSPipeline(1, DT_GPS, DT_COORDS)
+    sp = SimPeripheral()
+    stop_start = SimPin()
+    device = BikeBrain(lcd, SimGPS(), gps, pipeline, store, SimRFID(), sp, SimSIM800L(), stop_start, SimPin(),
+                       SimPin(0), SimDHT11(), SimPin(0), 'idle')
+
+    async def ride():
+        asyncio.create_task(device.run())
+        await sim_wait(lambda: device.gps_data is not None)
+        await sleep_ms(DT_BUTTON)   # Presses closer than that are ignored
+        await sim_press(stop_start)
+        await sim_wait(lambda: device.state == 'running')
+        await sleep_ms(ride_s * 1000)
+        await sim_press(stop_start)
+        await sim_wait(lambda: device.state == 'idle')
+        sp.connected = True
+        await sim_wait(lambda: device.synced and device.state == 'idle')
+
+    asyncio.run(ride())
+    print('Synced ' + str(sp.bytes_sent) + ' bytes in ' + str(sp.packets) + ' packets, ' + str(lcd.bytes_sent) +
+          ' bytes sent to the LCD')
+    synced = sp.bytes_sent > 0 and store.is_empty()
+    store.unmount()
+    card.file.close()
+    uos.remove(image)
+    return synced
+
+if __name__ == '__main__':
+    import sys
+    if sys.platform == 'rp2':
+        main()
+    elif sys.implementation.name == 'micropython':
+        print('Simulation: ' + ('OK' if simulate() else 'FAIL'))
     else:
-        pass
\ No newline at end of file
+        print('Simulation: ' + ('OK' if simulate(mount_point='sim') else 'FAIL'))